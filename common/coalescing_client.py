@@ -0,0 +1,72 @@
+import asyncio
+from typing import Any, Dict, Tuple
+
+from chia.types.spend_bundle import SpendBundle
+
+# lookups that repeat within a run, keyed by their arguments
+COALESCED_METHODS = ("get_coin_record_by_name", "get_puzzle_and_solution")
+
+
+def freeze(value: Any) -> Any:
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class CoalescingClient:
+
+    def __init__(self, client, methods: Tuple[str, ...] = COALESCED_METHODS):
+        self.client = client
+        self.methods = set(methods)
+        self.results: Dict[Tuple, asyncio.Task] = dict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.client, name)
+        if name not in self.methods:
+            return attr
+
+        async def coalesced(*args, **kwargs) -> Any:
+            return await self.lookup(name, attr, args, kwargs)
+
+        return coalesced
+
+
+    def key(self, name: str, args: Tuple, kwargs: Dict[str, Any]) -> Tuple:
+        return (name, freeze(args), freeze(sorted(kwargs.items())))
+
+
+    async def lookup(self, name: str, attr, args: Tuple, kwargs: Dict[str, Any]) -> Any:
+        key = self.key(name, args, kwargs)
+        task = self.results.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(attr(*args, **kwargs))
+            self.results[key] = task
+        else:
+            self.hits += 1
+        try:
+            # concurrent callers share the one in-flight request
+            return await asyncio.shield(task)
+        except Exception:
+            if self.results.get(key) is task:
+                del self.results[key]
+            raise
+
+
+    # the records of coins we just spent are stale
+    async def push_tx(self, spend_bundle: SpendBundle) -> Dict[str, Any]:
+        for coin in spend_bundle.removals():
+            self.results.pop(("get_coin_record_by_name", (coin.name(),), ()), None)
+        return await self.client.push_tx(spend_bundle)
+
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return 0.0 if total == 0 else self.hits / total
+
+
+    def report(self) -> str:
+        return f'Coalesced {self.hits} of {self.hits + self.misses} node lookups ({self.hit_rate():.0%} hit rate)'
@@ -0,0 +1,54 @@
+import os
+from typing import Dict, List, Optional
+
+from aiohttp import ClientResponseError
+
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient, coin_record_dict_backwards_compat
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+
+# LOOKUP_CHUNK - how many puzzle hashes/hints go into one bulk coin record request
+LOOKUP_CHUNK = int(os.environ.get("LOOKUP_CHUNK", 1000))
+
+# flipped off the first time a node answers without get_coin_records_by_hints
+bulk_hints_supported = True
+
+
+def chunks(items: List, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+async def get_coin_records_by_puzzle_hashes(node_client: FullNodeRpcClient, puzzle_hashes: List[bytes32], include_spent_coins: bool = False,
+                                            chunk_size: int = LOOKUP_CHUNK, start_height: Optional[int] = None) -> Dict[bytes32, List[CoinRecord]]:
+    coin_records = {puzzle_hash: [] for puzzle_hash in puzzle_hashes}
+    for chunk in chunks(list(coin_records.keys()), chunk_size):
+        for coin_record in await node_client.get_coin_records_by_puzzle_hashes(chunk, include_spent_coins, start_height):
+            coin_records[coin_record.coin.puzzle_hash].append(coin_record)
+    return coin_records
+
+
+async def get_coin_records_by_hints(node_client: FullNodeRpcClient, hints: List[bytes32], include_spent_coins: bool = False,
+                                    chunk_size: int = LOOKUP_CHUNK, start_height: Optional[int] = None) -> List[CoinRecord]:
+    global bulk_hints_supported
+    hints = list(dict.fromkeys(hints))
+    coin_records = dict()
+    if bulk_hints_supported:
+        try:
+            for chunk in chunks(hints, chunk_size):
+                request = {"hints": [hint.hex() for hint in chunk], "include_spent_coins": include_spent_coins}
+                if start_height is not None:
+                    request["start_height"] = start_height
+                response = await node_client.fetch("get_coin_records_by_hints", request)
+                for coin_record in response["coin_records"]:
+                    coin_record = CoinRecord.from_json_dict(coin_record_dict_backwards_compat(coin_record))
+                    coin_records[coin_record.name] = coin_record
+            return list(coin_records.values())
+        except (ClientResponseError, ValueError) as e:
+            print(f'Node has no bulk hint lookup, falling back to one request per hint ({repr(e)})')
+            bulk_hints_supported = False
+
+    for hint in hints:
+        for coin_record in await node_client.get_coin_records_by_hint(hint, include_spent_coins, start_height):
+            coin_records[coin_record.name] = coin_record
+    return list(coin_records.values())
@@ -0,0 +1,81 @@
+import os
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.types.spend_bundle import SpendBundle
+
+from coalescing_client import COALESCED_METHODS, CoalescingClient
+
+# coin state that only changes when a block is added or we spend the coin
+COIN_STATE_METHODS = ("get_coin_record_by_name", "get_coin_records_by_puzzle_hash", "get_coin_records_by_puzzle_hashes")
+# answers that hold until the next block, spending does not change them
+PEAK_STATE_METHODS = COIN_STATE_METHODS + ("get_fee_estimate",)
+
+# PEAK_CHECK_INTERVAL - seconds between get_blockchain_state checks made on behalf of cached lookups
+PEAK_CHECK_INTERVAL = float(os.environ.get("PEAK_CHECK_INTERVAL", 5))
+
+
+class CoinStateCache(CoalescingClient):
+
+    def __init__(self, client, peak_check_interval: float = PEAK_CHECK_INTERVAL):
+        super().__init__(client, COALESCED_METHODS + PEAK_STATE_METHODS)
+        self.peak_check_interval = peak_check_interval
+        self.peak_height: Optional[int] = None
+        self.peak_checked = 0.0
+        self.read_at: Dict[Tuple, Optional[int]] = dict()
+
+
+    async def get_blockchain_state(self) -> Dict[str, Any]:
+        state = await self.client.get_blockchain_state()
+        self.peak_checked = time.monotonic()
+        peak = state["peak"]
+        height = None if peak is None else int(peak.height)
+        if height != self.peak_height:
+            self.new_peak(height)
+        return state
+
+
+    def new_peak(self, height: Optional[int]):
+        self.peak_height = height
+        for key in list(self.results.keys()):
+            if key[0] in PEAK_STATE_METHODS and self.read_at.get(key) != height and not self.is_settled(key):
+                self.forget(key)
+
+
+    # a confirmed spent coin never changes again
+    def is_settled(self, key: Tuple) -> bool:
+        task = self.results[key]
+        if not task.done() or task.cancelled() or task.exception() is not None:
+            return False
+        coin_record = task.result()
+        return isinstance(coin_record, CoinRecord) and coin_record.spent_block_index > 0
+
+
+    def forget(self, key: Tuple):
+        self.results.pop(key, None)
+        self.read_at.pop(key, None)
+
+
+    async def lookup(self, name: str, attr, args: Tuple, kwargs: Dict[str, Any]) -> Any:
+        if name in PEAK_STATE_METHODS and time.monotonic() - self.peak_checked >= self.peak_check_interval:
+            await self.get_blockchain_state()
+        key = self.key(name, args, kwargs)
+        if key not in self.results:
+            self.read_at[key] = self.peak_height
+        return await super().lookup(name, attr, args, kwargs)
+
+
+    async def push_tx(self, spend_bundle: SpendBundle) -> Dict[str, Any]:
+        touched: Set[bytes32] = set()
+        for coin in spend_bundle.removals():
+            touched.update([coin.name(), coin.puzzle_hash])
+        for coin in spend_bundle.additions():
+            touched.add(coin.puzzle_hash)
+        for key in list(self.results.keys()):
+            if key[0] in COIN_STATE_METHODS and len(key[1]) > 0:
+                first = key[1][0]
+                if any(item in touched for item in (first if isinstance(first, tuple) else (first,))):
+                    self.forget(key)
+        return await self.client.push_tx(spend_bundle)
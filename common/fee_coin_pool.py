@@ -0,0 +1,168 @@
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List
+
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.default_root import DEFAULT_ROOT_PATH
+from chia.util.ints import uint64
+from chia.wallet.payment import Payment
+
+from coin_lookup import LOOKUP_CHUNK, chunks
+
+# FEE_POOL_PATH - per tool, the fee coins split off for bundle fees and which of them a pushed bundle holds
+FEE_POOL_PATH = Path(os.environ.get("FEE_POOL_PATH", DEFAULT_ROOT_PATH / "runtime_data" / "fee_coin_pools"))
+# FEE_POOL_SIZE - fee coins one split creates
+FEE_POOL_SIZE = int(os.environ.get("FEE_POOL_SIZE", 100))
+# FEE_POOL_COIN_AMOUNT - mojos in each split fee coin, enough for a fee and a few rebroadcast bumps
+FEE_POOL_COIN_AMOUNT = int(os.environ.get("FEE_POOL_COIN_AMOUNT", 100000000))
+# FEE_POOL_LOW_WATER - a new split is made once fewer free fee coins than this are left
+FEE_POOL_LOW_WATER = int(os.environ.get("FEE_POOL_LOW_WATER", 20))
+# FEE_POOL_RESERVATION_SECONDS - how long a fee coin held by an earlier run stays out of use while still unspent
+FEE_POOL_RESERVATION_SECONDS = float(os.environ.get("FEE_POOL_RESERVATION_SECONDS", 3600))
+
+
+class FeeCoinPool:
+
+    def __init__(self, name: str, directory: Path = FEE_POOL_PATH, size: int = FEE_POOL_SIZE, coin_amount: int = FEE_POOL_COIN_AMOUNT,
+                 low_water: int = FEE_POOL_LOW_WATER, reservation_seconds: float = FEE_POOL_RESERVATION_SECONDS):
+        self.path = Path(directory) / f"{name}.json"
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.size = size
+        self.coin_amount = coin_amount
+        self.low_water = low_water
+        self.reservation_seconds = reservation_seconds
+        # coin name hex -> {"coin", "confirmed", "since", "reserved"}
+        self.entries: Dict[str, Dict] = dict()
+        self.load()
+
+
+    def load(self):
+        self.entries = dict()
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+
+
+    @contextmanager
+    def locked(self):
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+    # runs of the same tool share the file, each change is made to its latest contents under the lock
+    @contextmanager
+    def updating(self):
+        with self.locked():
+            self.load()
+            yield
+            self._write()
+
+
+    def add(self, coins: List[Coin], confirmed: bool = False, reserved: bool = False):
+        with self.updating():
+            now = time.time()
+            for coin in coins:
+                self.entries[coin.name().hex()] = {"coin": coin.to_json_dict(), "confirmed": confirmed, "since": now, "reserved": now if reserved else None}
+
+
+    # reads go to the file too, another run may have reserved or added coins since
+    def coins(self) -> List[Coin]:
+        self.load()
+        return [Coin.from_json_dict(entry["coin"]) for entry in self.entries.values()]
+
+
+    def free(self) -> List[Coin]:
+        self.load()
+        coins = [Coin.from_json_dict(entry["coin"]) for entry in self.entries.values() if entry["confirmed"] and entry["reserved"] is None]
+        return sorted(coins, key=lambda coin: coin.amount)
+
+
+    # split coins still on their way count too, so a slow split is not made twice
+    def needs_split(self) -> bool:
+        self.load()
+        return len([entry for entry in self.entries.values() if entry["reserved"] is None]) < self.low_water
+
+
+    # distinct amounts, coins with the same parent, puzzle hash and amount would be one coin
+    def split_payments(self, puzzle_hash: bytes32) -> List[Payment]:
+        return [Payment(puzzle_hash, uint64(self.coin_amount + i), [puzzle_hash]) for i in range(self.size)]
+
+
+    # no RPC, concurrent bundles each get their own coins
+    def reserve(self, amount: int) -> List[Coin]:
+        with self.updating():
+            coins = []
+            for coin in self.free():
+                if sum(coin.amount for coin in coins) >= amount:
+                    break
+                coins.append(coin)
+            if sum(coin.amount for coin in coins) < amount:
+                raise ValueError(f'Fee coin pool has {sum(coin.amount for coin in self.free())} free mojos, {amount} needed')
+            now = time.time()
+            for coin in coins:
+                self.entries[coin.name().hex()]["reserved"] = now
+        return coins
+
+
+    # unspent coins can go in another bundle, spent ones leave the pool
+    def release(self, coins: List[Coin], spent: List[Coin] = ()):
+        with self.updating():
+            for coin in coins:
+                entry = self.entries.get(coin.name().hex())
+                if entry is not None:
+                    entry["reserved"] = None
+            for coin in spent:
+                self.entries.pop(coin.name().hex(), None)
+
+
+    # one bulk lookup: spent coins leave, split coins confirm, reservations of earlier runs run out
+    async def refresh(self, node_client: FullNodeRpcClient):
+        self.load()
+        if len(self.entries) == 0:
+            return
+        looked_up = set(self.entries.keys())
+        coin_records = dict()
+        for chunk in chunks([coin.name() for coin in self.coins()], LOOKUP_CHUNK):
+            for coin_record in await node_client.get_coin_records_by_names(chunk, include_spent_coins=True):
+                coin_records[coin_record.name.hex()] = coin_record
+        with self.updating():
+            now = time.time()
+            for name, entry in list(self.entries.items()):
+                # added by another run after the lookup
+                if name not in looked_up:
+                    continue
+                coin_record = coin_records.get(name)
+                if coin_record is None:
+                    # a split that never made it into a block
+                    if now - entry["since"] >= self.reservation_seconds:
+                        self.entries.pop(name)
+                elif coin_record.spent:
+                    self.entries.pop(name)
+                else:
+                    entry["confirmed"] = True
+                    if entry["reserved"] is not None and now - entry["reserved"] >= self.reservation_seconds:
+                        entry["reserved"] = None
+
+
+    def save(self):
+        with self.locked():
+            self._write()
+
+
+    def _write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        partial = self.path.with_name(self.path.name + ".partial")
+        with open(partial, "w") as f:
+            json.dump(self.entries, f, sort_keys=True)
+        os.replace(partial, self.path)
@@ -0,0 +1,278 @@
+import asyncio
+import json
+from typing import Awaitable, Callable, List, TextIO, Tuple
+
+from blspy import G2Element
+
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.rpc.wallet_rpc_client import WalletRpcClient
+from chia.types.announcement import Announcement
+from chia.types.blockchain_format.coin import Coin
+from chia.types.coin_record import CoinRecord
+from chia.types.coin_spend import CoinSpend
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint64
+from chia.wallet.payment import Payment
+from chia.wallet.util.tx_config import DEFAULT_COIN_SELECTION_CONFIG, CoinSelectionConfig
+from chia.wallet.wallet import Wallet
+
+from fee_coin_pool import FeeCoinPool
+from spend_cost import MAX_ASSERTED_ANNOUNCEMENTS, SpendNotYetValid, batch_cost_limit, fee_for_cost, mempool_peak, pack_by_cost, spend_bundle_cost, validate_spend_bundle
+from spend_pipeline import SpendExport, push_or_export
+from submission_tracker import Submission, SubmissionTracker
+
+
+class FeePayer:
+
+    # one per tool: its fee coin pool, the bundles it pushed, and the signer its main picked (set before fees are added)
+    def __init__(self, name: str, puzzle_reveals, min_fee: int, max_fee: int, assert_coin_announcement: bool = True, fee_coin_pool: FeeCoinPool = None):
+        self.puzzle_reveals = puzzle_reveals
+        self.min_fee = min_fee
+        self.max_fee = max_fee
+        self.assert_coin_announcement = assert_coin_announcement
+        # fee coins split off ahead of time, each bundle reserves its own without asking the wallet
+        self.fee_coin_pool = FeeCoinPool(name) if fee_coin_pool is None else fee_coin_pool
+        # every pushed bundle, until it confirms and its fee coins go back to the pool
+        self.submissions = SubmissionTracker(self.rebuild_with_fees, self.fee_coin_pool.release)
+        # wallet coin selection, when the pool has run dry or is split again, is one request at a time
+        self.lock = asyncio.Lock()
+        # fee coins of bundles written out unsigned, spent once the export is pushed and never to go in another bundle this run
+        self.exported: List[Coin] = []
+        self.signer = None
+
+
+    # fee per cost from the node's estimate, paid on the cost of the whole bundle including its fee spends
+    # fee_coins and min_fees rebuild a stuck bundle on the coins it already spends, with at least min_fees
+    async def add_fees_and_sign_spend_bundle(self, spend_bundle: SpendBundle, node_client: FullNodeRpcClient, wallet_client: WalletRpcClient, cost: int = None,
+                                             fee_coins: List[Coin] = None, min_fees: int = 0, out: TextIO = None) -> SpendBundle:
+        if cost is None:
+            cost = spend_bundle_cost(spend_bundle)
+        fees: uint64 = uint64(max(min_fees, await fee_for_cost(node_client, cost, self.min_fee, self.max_fee)))
+
+        # a rebuilt bundle keeps spending the fee coins it has, more are reserved when the fee outgrows them
+        fee_coins = [] if fee_coins is None else list(fee_coins)
+        reserved = []
+        try:
+            if sum(coin.amount for coin in fee_coins) < fees:
+                reserved = await self.reserve_fee_coins(wallet_client, fees - sum(coin.amount for coin in fee_coins), out)
+                fee_coins += reserved
+            print(f'evaluating {len(fee_coins)} coin(s) for fees', file=out)
+            fee_spends = self.calculate_fee_spends(fee_coins, fees, spend_bundle.coin_spends, out)
+            cost = spend_bundle_cost(SpendBundle(spend_bundle.coin_spends + fee_spends, G2Element()))
+            total_fees: uint64 = uint64(max(min_fees, await fee_for_cost(node_client, cost, self.min_fee, self.max_fee)))
+            if total_fees > fees:
+                fees = total_fees
+                if sum(coin.amount for coin in fee_coins) < fees:
+                    more = await self.reserve_fee_coins(wallet_client, fees - sum(coin.amount for coin in fee_coins), out)
+                    reserved += more
+                    fee_coins += more
+                fee_spends = self.calculate_fee_spends(fee_coins, fees, spend_bundle.coin_spends, out)
+            print(f'Calculated fees of {fees} for cost {cost} using the node fee estimate', file=out)
+            return await self.signer.sign_coin_spends(spend_bundle.coin_spends + fee_spends)
+        except Exception:
+            self.fee_coin_pool.release(reserved)
+            raise
+
+
+    # coins the wallet must not pick: those in the pool, in bundles still waiting to confirm and in exported bundles
+    def excluded_coin_ids(self):
+        return [coin.name() for coin in self.fee_coin_pool.coins() + self.submissions.coins() + self.exported]
+
+
+    # pool coins first, the wallet only once the pool has run dry
+    async def reserve_fee_coins(self, wallet_client: WalletRpcClient, amount: int, out: TextIO = None) -> List[Coin]:
+        try:
+            return self.fee_coin_pool.reserve(amount)
+        except ValueError as e:
+            # a rebroadcast has no wallet to fall back on
+            if wallet_client is None:
+                raise
+            print(f'{e}, asking the wallet', file=out)
+        async with self.lock:
+            fee_coins = await wallet_client.select_coins(amount=uint64(amount), wallet_id=1,
+                                                         coin_selection_config=CoinSelectionConfig(min_coin_amount=self.min_fee, max_coin_amount=100000000, excluded_coin_amounts=[0,1], excluded_coin_ids=self.excluded_coin_ids()))
+            self.fee_coin_pool.add(fee_coins, confirmed=True, reserved=True)
+        return fee_coins
+
+
+    # one wallet coin split into FEE_POOL_SIZE fee coins whenever the pool runs low
+    async def top_up_fee_coins(self, node_client: FullNodeRpcClient, wallet_client: WalletRpcClient):
+        # an exported split only exists once it is signed and pushed, fees come from the wallet until then
+        if isinstance(self.signer, SpendExport):
+            return
+        await self.fee_coin_pool.refresh(node_client)
+        if not self.fee_coin_pool.needs_split():
+            return
+        try:
+            async with self.lock:
+                amount = self.fee_coin_pool.size * self.fee_coin_pool.coin_amount + sum(range(self.fee_coin_pool.size))
+                funding_coins = await wallet_client.select_coins(amount=uint64(amount), wallet_id=1, coin_selection_config=DEFAULT_COIN_SELECTION_CONFIG.override(excluded_coin_ids=self.excluded_coin_ids()))
+                payments = self.fee_coin_pool.split_payments(funding_coins[0].puzzle_hash)
+                spend_bundle = await self.signer.sign_coin_spends(self.calculate_split_spends(funding_coins, payments))
+                await self.push_spend_bundle(node_client, spend_bundle)
+                self.fee_coin_pool.add([Coin(funding_coins[0].name(), payment.puzzle_hash, payment.amount) for payment in payments])
+            print(f'Splitting {len(payments)} fee coins off {funding_coins[0].name().hex()} as {spend_bundle.name().hex()}')
+        except Exception as e:
+            print(f'Could not split fee coins, fees come from the wallet until a split confirms: {repr(e)}')
+
+
+    def puzzle_reveal(self, coin: Coin):
+        puzzle_reveal = self.puzzle_reveals.get(coin.puzzle_hash)
+        if puzzle_reveal is None:
+            raise Exception("Checked all known keys for valid puzzle reveal. Failed to find any.")
+        return puzzle_reveal
+
+
+    # the first coin creates the fee coins and the change, the others assert its announcement so none is spent alone
+    def calculate_split_spends(self, funding_coins: List[Coin], payments: List[Payment]) -> List[CoinSpend]:
+        first = funding_coins[0]
+        change_amount = sum(coin.amount for coin in funding_coins) - sum(payment.amount for payment in payments)
+        primaries = payments + [Payment(first.puzzle_hash, uint64(change_amount), [first.puzzle_hash])]
+        coin_spends = []
+        for coin in funding_coins:
+            puzzle_reveal = self.puzzle_reveal(coin)
+            if coin == first:
+                solution = Wallet().make_solution(primaries=primaries, coin_announcements={b'$'})
+            else:
+                solution = Wallet().make_solution(primaries=[], coin_announcements_to_assert={Announcement(first.name(), b'$').name()})
+            coin_spends.append(CoinSpend(coin, puzzle_reveal, solution))
+        return coin_spends
+
+
+    def calculate_fee_spends(self, fee_coins: List[Coin], fees: uint64, peer_coin_spends: List[CoinSpend], out: TextIO = None) -> List[CoinSpend]:
+        if sum(coin.amount for coin in fee_coins) < fees:
+            raise ValueError(f'Fee coins hold {sum(coin.amount for coin in fee_coins)} mojos, {fees} needed')
+        # every fee coin is spent, a replacement has to spend all the coins of the bundle it replaces
+        fee_spends = []
+        fees_remaining = fees
+        for fee_coin in fee_coins:
+            print(f'{fee_coin}', file=out)
+            fee_amount = min(fee_coin.amount, fees_remaining)
+            fee_spends.append(self.calculate_change_spend(fee_coin, uint64(fee_amount), peer_coin_spends, out))
+            fees_remaining -= fee_amount
+        return fee_spends
+
+
+    def calculate_change_spend(self, fee_coin: Coin, fee_amount: uint64, peer_coin_spends: List[CoinSpend], out: TextIO = None) -> CoinSpend:
+        puzzle_reveal = self.puzzle_reveal(fee_coin)
+
+        change_amount = fee_coin.amount - fee_amount
+        destination_puzzlehash = fee_coin.puzzle_hash
+        primaries = [Payment(destination_puzzlehash, change_amount, [destination_puzzlehash])]
+
+        if self.assert_coin_announcement is True:
+            # every spend the fee pays for emits CREATE_COIN_ANNOUNCEMENT (), asserting all of them keeps the bundle from being split
+            assert_coin_announcements = [Announcement(coin_spend.coin.name(), b'').name() for coin_spend in peer_coin_spends]
+            solution = Wallet().make_solution(
+                primaries=primaries,
+                fee=fee_amount,
+                coin_announcements_to_assert = assert_coin_announcements
+            )
+        else:
+            solution = Wallet().make_solution(
+                primaries=primaries,
+                fee=fee_amount
+            )
+
+        print(f'solution: {solution}', file=out)
+
+        print(f'Prepping change spend of amount {change_amount} mojos', file=out)
+
+        return CoinSpend(fee_coin, puzzle_reveal, solution)
+
+
+    async def rebuild_with_fees(self, node_client: FullNodeRpcClient, spend_bundle: SpendBundle, fee_coins: List[Coin], min_fees: uint64) -> SpendBundle:
+        rebuilt = await self.add_fees_and_sign_spend_bundle(spend_bundle, node_client, None, fee_coins=fee_coins, min_fees=min_fees)
+        self.add_change(rebuilt, spend_bundle)
+        return rebuilt
+
+
+    # the change of every fee spend goes back in the pool, unconfirmed until its bundle is
+    # a change coin whose bundle never makes it into a block leaves again with the next refresh after FEE_POOL_RESERVATION_SECONDS
+    def add_change(self, spend_bundle: SpendBundle, unpaid: SpendBundle):
+        fee_coin_ids = set(coin.name() for coin in Submission(spend_bundle, unpaid).fee_coins())
+        self.fee_coin_pool.add([coin for coin in spend_bundle.additions() if coin.parent_coin_info in fee_coin_ids and coin.amount > 0])
+
+
+    # an exporting run writes the bundle out unsigned, there is nothing on the node to track
+    async def push_spend_bundle(self, node_client: FullNodeRpcClient, spend_bundle: SpendBundle, unpaid: SpendBundle = None):
+        if isinstance(self.signer, SpendExport):
+            # the export file records the fee coins and they leave the pool, exported stays excluded so no later bundle picks them
+            fee_coins = [] if unpaid is None else Submission(spend_bundle, unpaid).fee_coins()
+            status = await push_or_export(node_client, self.signer, spend_bundle, fee_coins)
+            self.exported += fee_coins
+            self.fee_coin_pool.release([], fee_coins)
+            return status
+        status = await self.submissions.push(node_client, spend_bundle, unpaid)
+        if unpaid is not None:
+            self.add_change(spend_bundle, unpaid)
+        return status
+
+
+    # fees added if asked for and checked against the same peak again, then pushed
+    async def pay_and_push(self, node_client: FullNodeRpcClient, wallet_client: WalletRpcClient, spend_bundle: SpendBundle, cost: int, peak: Tuple[int, int],
+                           add_fees=False, out: TextIO = None):
+        unpaid = spend_bundle
+        if add_fees is True:
+            print(f'Adding fees for cost {cost}', file=out)
+            spend_bundle = await self.add_fees_and_sign_spend_bundle(spend_bundle, node_client, wallet_client, cost, out=out)
+            try:
+                cost = await validate_spend_bundle(node_client, spend_bundle, peak)
+            except Exception:
+                self.submissions.abandon(spend_bundle, unpaid)
+                raise
+            print(f'Spend bundle cost with fees: {cost}', file=out)
+
+        print(f'{spend_bundle}', file=out)
+        return await self.push_spend_bundle(node_client, spend_bundle, unpaid)
+
+
+    # one bundle, and one fee spend, per batch of spends that fits under the batch cost limit
+    # build makes the unsigned spend bundle of one coin, kind names the spends in the log
+    async def spend_batches(self, node_client: FullNodeRpcClient, wallet_client: WalletRpcClient, coin_records: List[CoinRecord],
+                            build: Callable[[CoinRecord], Awaitable[SpendBundle]], kind: str, add_fees=False, peak: Tuple[int, int] = None) -> bool:
+        all_spent = True
+        spend_bundles = []
+        costs = []
+        if peak is None:
+            peak = await mempool_peak(node_client)
+        for coin_record in coin_records:
+            try:
+                spend_bundle = await build(coin_record)
+                # a spend that would not get into the mempool is left out, it would take its whole batch down with it
+                costs.append(await validate_spend_bundle(node_client, spend_bundle, peak))
+                spend_bundles.append(spend_bundle)
+            except SpendNotYetValid as e:
+                print(f'Deferring {coin_record.coin.name().hex()}: {e}')
+                all_spent = False
+            except Exception as e:
+                print('Failed on: ')
+                print(repr(e))
+                print('\r\n...Continuing to next coin')
+                all_spent = False
+
+        batches = pack_by_cost(list(zip(spend_bundles, costs)), costs, batch_cost_limit(), MAX_ASSERTED_ANNOUNCEMENTS)
+        print(f'Packed {len(spend_bundles)} {kind} spends into {len(batches)} bundle(s)')
+        for batch in batches:
+            try:
+                spend_bundle = SpendBundle.aggregate([spend_bundle for (spend_bundle, cost) in batch])
+                batch_cost = sum(cost for (spend_bundle, cost) in batch)
+                unpaid = spend_bundle
+                if add_fees is True:
+                    print(f'Adding fees for cost {batch_cost}')
+                    spend_bundle = await self.add_fees_and_sign_spend_bundle(spend_bundle, node_client, wallet_client, batch_cost)
+                    try:
+                        await validate_spend_bundle(node_client, spend_bundle, peak)
+                    except Exception:
+                        self.submissions.abandon(spend_bundle, unpaid)
+                        raise
+
+                print(f'Pushing {len(batch)} {kind} spends as {spend_bundle.name().hex()}')
+                status = await self.push_spend_bundle(node_client, spend_bundle, unpaid)
+                print(json.dumps(status, sort_keys=True, indent=4))
+            except Exception as e:
+                print('Failed on batch: ')
+                print(repr(e))
+                print('\r\n...Continuing to next batch')
+                all_spent = False
+        return all_spent
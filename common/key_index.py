@@ -0,0 +1,358 @@
+import fcntl
+import mmap
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from blspy import AugSchemeMPL, G1Element, PrivateKey
+
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.byte_types import hexstr_to_bytes
+from chia.util.default_root import DEFAULT_ROOT_PATH
+from chia.wallet.derive_keys import (
+    master_sk_to_wallet_sk_intermediate,
+    master_sk_to_wallet_sk_unhardened_intermediate,
+)
+from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
+    DEFAULT_HIDDEN_PUZZLE_HASH,
+    calculate_synthetic_secret_key,
+    puzzle_for_pk,
+    puzzle_hash_for_pk,
+    puzzle_hash_for_synthetic_public_key,
+)
+
+# The index only ever holds public material (derivation index, hardened flag, public key
+# and puzzle hash). Private keys are re-derived from the master key when something is signed.
+KEY_INDEX_PATH = Path(os.environ.get("KEY_INDEX_PATH", DEFAULT_ROOT_PATH / "runtime_data" / "key_index"))
+
+# Key derivation is CPU bound BLS work, so large ranges are split across processes
+DERIVATION_WORKERS = int(os.environ.get("DERIVATION_WORKERS", os.cpu_count() or 1))
+DERIVATION_CHUNK = int(os.environ.get("DERIVATION_CHUNK", 500))
+
+# MASTER_PUBLIC_KEY (as shown by `chia keys show`) lets discovery-only runs skip the keychain entirely
+MASTER_PUBLIC_KEY = os.environ.get("MASTER_PUBLIC_KEY")
+
+UNHARDENED_WALLET_PATH = [12381, 8444, 2]
+
+MAGIC = b"KIDX"
+VERSION = 1
+HEADER = struct.Struct(">4sB?48s")  # magic, version, hardened, master public key
+RECORD = struct.Struct(">I?48s32s")  # derivation index, hardened, public key, puzzle hash
+PUZZLE_HASH_OFFSET = RECORD.size - 32
+
+
+@dataclass(frozen=True)
+class KeyEntry:
+    index: int
+    hardened: bool
+    public_key_bytes: bytes
+    puzzle_hash: bytes32
+
+    # parsing a G1Element is relatively slow, so only do it for keys we actually use
+    def public_key(self) -> G1Element:
+        return G1Element.from_bytes(self.public_key_bytes)
+
+
+def observer_master_pk() -> Optional[G1Element]:
+    if MASTER_PUBLIC_KEY is None:
+        return None
+    return G1Element.from_bytes(hexstr_to_bytes(MASTER_PUBLIC_KEY))
+
+
+def wallet_intermediate_pk_unhardened(master_pk: G1Element) -> G1Element:
+    pk = master_pk
+    for index in UNHARDENED_WALLET_PATH:
+        pk = AugSchemeMPL.derive_child_pk_unhardened(pk, index)
+    return pk
+
+
+def wallet_intermediate_sk(master_sk: PrivateKey, hardened: bool) -> PrivateKey:
+    if hardened:
+        return master_sk_to_wallet_sk_intermediate(master_sk)
+    return master_sk_to_wallet_sk_unhardened_intermediate(master_sk)
+
+
+def derive_wallet_sk(intermediate_sk: PrivateKey, index: int, hardened: bool) -> PrivateKey:
+    if hardened:
+        return AugSchemeMPL.derive_child_sk(intermediate_sk, index)
+    return AugSchemeMPL.derive_child_sk_unhardened(intermediate_sk, index)
+
+
+def derive_public_key(master_key: Union[PrivateKey, G1Element], hardened: bool, start: int, end: int) -> Iterator[G1Element]:
+    if hardened:
+        assert isinstance(master_key, PrivateKey), "hardened keys can only be derived from a private key"
+        intermediate_sk = wallet_intermediate_sk(master_key, hardened)
+        for i in range(start, end):
+            yield derive_wallet_sk(intermediate_sk, i, hardened).get_g1()
+    else:
+        # unhardened public keys need no private key arithmetic at all
+        if isinstance(master_key, PrivateKey):
+            master_key = master_key.get_g1()
+        intermediate_pk = wallet_intermediate_pk_unhardened(master_key)
+        for i in range(start, end):
+            yield AugSchemeMPL.derive_child_pk_unhardened(intermediate_pk, i)
+
+
+def derive_records(master_key: Union[PrivateKey, G1Element], hardened: bool, start: int, end: int) -> bytes:
+    records = bytearray()
+    for i, pk in zip(range(start, end), derive_public_key(master_key, hardened, start, end)):
+        records += RECORD.pack(i, hardened, bytes(pk), puzzle_hash_for_pk(pk))
+    return bytes(records)
+
+
+def derive_records_worker(master_key_bytes: bytes, hardened: bool, start: int, end: int) -> bytes:
+    master_key = PrivateKey.from_bytes(master_key_bytes) if hardened else G1Element.from_bytes(master_key_bytes)
+    return derive_records(master_key, hardened, start, end)
+
+
+def derive_records_parallel(master_key: Union[PrivateKey, G1Element], hardened: bool, start: int, end: int,
+                            workers: int = DERIVATION_WORKERS, chunk_size: int = DERIVATION_CHUNK) -> bytes:
+    if workers <= 1 or end - start <= chunk_size:
+        return derive_records(master_key, hardened, start, end)
+
+    # only hardened derivation needs the secret key shipped to the workers
+    if not hardened and isinstance(master_key, PrivateKey):
+        master_key = master_key.get_g1()
+
+    chunks = [(i, min(i + chunk_size, end)) for i in range(start, end, chunk_size)]
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        futures = [executor.submit(derive_records_worker, bytes(master_key), hardened, chunk_start, chunk_end)
+                   for chunk_start, chunk_end in chunks]
+        # joined in submission order, so the result is identical to the serial path
+        return b"".join(future.result() for future in futures)
+
+
+class KeyFile:
+
+    def __init__(self, path: Path, master_pk: G1Element, hardened: bool):
+        self.path = path
+        self.lock_path = path.with_name(path.name + ".lock")
+        self.header = HEADER.pack(MAGIC, VERSION, hardened, bytes(master_pk))
+        self.count = 0
+        self._mmap: Optional[mmap.mmap] = None
+        with self.locked():
+            self._open()
+
+
+    # the signer daemon and every driver share the index, only one of them may write it at a time
+    @contextmanager
+    def locked(self):
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+    def _open(self):
+        if self.path.exists():
+            with open(self.path, "rb") as f:
+                header = f.read(HEADER.size)
+            if header != self.header:
+                print(f'Discarding key index {self.path} (written for a different key or version)')
+                self.path.unlink()
+
+        if not self.path.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "wb") as f:
+                f.write(self.header)
+        self._read_count()
+
+
+    def _read_count(self):
+        size = self.path.stat().st_size
+        self.count = (size - HEADER.size) // RECORD.size
+        if size != HEADER.size + self.count * RECORD.size:
+            # an interrupted run can leave a partial record behind
+            with open(self.path, "r+b") as f:
+                f.truncate(HEADER.size + self.count * RECORD.size)
+        self._remap()
+
+
+    def _remap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+    def append(self, records: bytes):
+        assert len(records) % RECORD.size == 0
+        with open(self.path, "ab") as f:
+            f.write(records)
+        self.count += len(records) // RECORD.size
+        self._remap()
+
+
+    # another process may have extended the file since it was opened, so the count is read again under the lock
+    def extend(self, count: int, derive: Callable[[int, int], bytes]) -> int:
+        with self.locked():
+            self._read_count()
+            if self.count >= count:
+                return 0
+            start = self.count
+            self.append(derive(start, count))
+            return count - start
+
+
+    def entry(self, i: int) -> KeyEntry:
+        index, hardened, pk_bytes, puzzle_hash = RECORD.unpack_from(self._mmap, HEADER.size + i * RECORD.size)
+        assert index == i
+        return KeyEntry(index, hardened, pk_bytes, bytes32(puzzle_hash))
+
+
+    def puzzle_hash(self, i: int) -> bytes:
+        offset = HEADER.size + i * RECORD.size + PUZZLE_HASH_OFFSET
+        return self._mmap[offset:offset + 32]
+
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+class KeyIndex:
+
+    def __init__(self, master_sk: Optional[PrivateKey], path: Path = KEY_INDEX_PATH, master_pk: Optional[G1Element] = None):
+        self.master_sk = master_sk
+        self.master_pk = master_sk.get_g1() if master_sk is not None else master_pk
+        assert self.master_pk is not None
+        self.fingerprint = self.master_pk.get_fingerprint()
+        self.path = path
+        self.derivations: Dict[bool, int] = {}
+        self._files: Dict[bool, KeyFile] = {}
+        self._intermediate_sks: Dict[bool, PrivateKey] = {}
+        self._by_puzzle_hash: Dict[bytes, Tuple[bool, int]] = {}
+        self._mapped: Dict[bool, int] = {}
+        self._synthetic_sks: Dict[bytes, PrivateKey] = {}
+
+
+    # an observer index only knows the master public key, so it covers unhardened keys and can't sign
+    @classmethod
+    def observer(cls, master_pk: G1Element, path: Path = KEY_INDEX_PATH) -> "KeyIndex":
+        return cls(None, path, master_pk)
+
+
+    @property
+    def is_observer(self) -> bool:
+        return self.master_sk is None
+
+
+    def load(self, derivations: int, hardened: bool = False) -> int:
+        key_file = self._files.get(hardened)
+        if key_file is None:
+            name = f"{self.fingerprint}_{'hardened' if hardened else 'unhardened'}.idx"
+            key_file = KeyFile(self.path / name, self.master_pk, hardened)
+            self._files[hardened] = key_file
+
+        master_key = self.master_sk if hardened else self.master_pk
+
+        def derive(start: int, end: int) -> bytes:
+            # observers can still read hardened keys indexed earlier by a process holding the private key
+            if hardened and self.is_observer:
+                raise RuntimeError(f"Hardened keys can't be derived from a master public key, only {start} are indexed")
+            print(f'Deriving {end - start} {"hardened" if hardened else "unhardened"} keys ({start} already indexed)')
+            return derive_records_parallel(master_key, hardened, start, end)
+
+        derived = 0
+        if key_file.count < derivations:
+            derived = key_file.extend(derivations, derive)
+
+        self.derivations[hardened] = derivations
+        return derived
+
+
+    def entries(self, hardened: Optional[bool] = None) -> Iterator[KeyEntry]:
+        for key_hardened, key_file in self._files.items():
+            if hardened is not None and key_hardened != hardened:
+                continue
+            for i in range(self.derivations[key_hardened]):
+                yield key_file.entry(i)
+
+
+    def entry(self, index: int, hardened: bool = False) -> KeyEntry:
+        return self._files[hardened].entry(index)
+
+
+    def secret_key(self, entry: KeyEntry) -> PrivateKey:
+        if self.is_observer:
+            raise RuntimeError(f"Observer key index for {self.fingerprint} has no private key")
+        intermediate_sk = self._intermediate_sks.get(entry.hardened)
+        if intermediate_sk is None:
+            intermediate_sk = wallet_intermediate_sk(self.master_sk, entry.hardened)
+            self._intermediate_sks[entry.hardened] = intermediate_sk
+        return derive_wallet_sk(intermediate_sk, entry.index, entry.hardened)
+
+
+    def entry_for_puzzle_hash(self, puzzle_hash: bytes32) -> Optional[KeyEntry]:
+        # the lookup table is built lazily and only picks up entries loaded since the last lookup
+        for hardened, key_file in self._files.items():
+            for i in range(self._mapped.get(hardened, 0), self.derivations[hardened]):
+                self._by_puzzle_hash[key_file.puzzle_hash(i)] = (hardened, i)
+            self._mapped[hardened] = max(self._mapped.get(hardened, 0), self.derivations[hardened])
+
+        location = self._by_puzzle_hash.get(bytes(puzzle_hash))
+        if location is None:
+            return None
+        hardened, i = location
+        if i >= self.derivations[hardened]:
+            return None
+        return self._files[hardened].entry(i)
+
+
+    def find_synthetic_secret_key(self, synthetic_pk: G1Element) -> Optional[PrivateKey]:
+        # a standard puzzle hash only depends on the synthetic key, so that finds the entry directly
+        synth_key = self._synthetic_sks.get(bytes(synthetic_pk))
+        if synth_key is None:
+            entry = self.entry_for_puzzle_hash(puzzle_hash_for_synthetic_public_key(synthetic_pk))
+            if entry is None:
+                return None
+            synth_key = calculate_synthetic_secret_key(self.secret_key(entry), DEFAULT_HIDDEN_PUZZLE_HASH)
+            self._synthetic_sks[bytes(synthetic_pk)] = synth_key
+        return synth_key
+
+
+    def close(self):
+        for key_file in self._files.values():
+            key_file.close()
+
+
+class PuzzleReveals:
+
+    # puzzle hash -> standard puzzle reveal, filled in from the key indexes as hashes are looked up
+    def __init__(self, key_indexes: Optional[List[KeyIndex]] = None):
+        self.key_indexes: List[KeyIndex] = key_indexes if key_indexes is not None else []
+        self._reveals: Dict[bytes32, Program] = {}
+
+
+    def get(self, puzzle_hash: bytes32, default: Optional[Program] = None) -> Optional[Program]:
+        puzzle = self._reveals.get(puzzle_hash)
+        if puzzle is not None:
+            return puzzle
+
+        for key_index in self.key_indexes:
+            entry = key_index.entry_for_puzzle_hash(puzzle_hash)
+            if entry is not None:
+                puzzle = puzzle_for_pk(entry.public_key())
+                self._reveals[bytes32(puzzle_hash)] = puzzle
+                return puzzle
+        return default
+
+
+    def __getitem__(self, puzzle_hash: bytes32) -> Program:
+        puzzle = self.get(puzzle_hash)
+        if puzzle is None:
+            raise KeyError(puzzle_hash)
+        return puzzle
+
+
+    def __contains__(self, puzzle_hash: bytes32) -> bool:
+        return self.get(puzzle_hash) is not None
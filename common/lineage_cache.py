@@ -0,0 +1,119 @@
+import fcntl
+import os
+import struct
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.types.coin_spend import CoinSpend
+from chia.util.default_root import DEFAULT_ROOT_PATH
+from chia.util.ints import uint64
+from chia.wallet.lineage_proof import LineageProof
+
+# LINEAGE_CACHE_PATH - append-only file of lineage proofs by parent coin id, a confirmed parent never changes
+LINEAGE_CACHE_PATH = Path(os.environ.get("LINEAGE_CACHE_PATH", DEFAULT_ROOT_PATH / "runtime_data" / "lineage_proofs.bin"))
+# LINEAGE_CACHE_SIZE - how many lineage proofs are kept in memory
+LINEAGE_CACHE_SIZE = int(os.environ.get("LINEAGE_CACHE_SIZE", 4096))
+
+# parent coin id, grandparent coin id, parent inner puzzle hash, parent amount
+RECORD = struct.Struct(">32s32s32sQ")
+
+
+async def fetch_lineage_proof(node_client: FullNodeRpcClient, parent_coin_id: bytes32) -> LineageProof:
+    parent_coin_record: CoinRecord = await node_client.get_coin_record_by_name(parent_coin_id)
+    parent_coin: Coin = parent_coin_record.coin
+    parent_coin_spend: CoinSpend = await node_client.get_puzzle_and_solution(parent_coin.name(), parent_coin_record.spent_block_index)
+
+    _, curried_args = parent_coin_spend.puzzle_reveal.uncurry()
+    list_args = list(curried_args.as_iter())
+    parent_inner_puzzlehash: bytes32 = list_args[-1].get_tree_hash()
+    return LineageProof(parent_coin.parent_coin_info, parent_inner_puzzlehash, parent_coin.amount)
+
+
+class LineageProofCache:
+
+    def __init__(self, path: Path = LINEAGE_CACHE_PATH, size: int = LINEAGE_CACHE_SIZE):
+        self.path = Path(path)
+        self.size = size
+        self.proofs: OrderedDict[bytes32, LineageProof] = OrderedDict()
+        self._offsets: Optional[Dict[bytes32, int]] = None
+        self.hits = 0
+        self.misses = 0
+
+
+    def offsets(self) -> Dict[bytes32, int]:
+        if self._offsets is None:
+            self._offsets = dict()
+            if self.path.exists():
+                with open(self.path, "rb") as f:
+                    data = f.read()
+                # a torn trailing record is ignored and overwritten by the next append
+                for offset in range(0, len(data) - len(data) % RECORD.size, RECORD.size):
+                    self._offsets[bytes32(data[offset:offset + 32])] = offset
+        return self._offsets
+
+
+    def remember(self, parent_coin_id: bytes32, lineage_proof: LineageProof):
+        self.proofs[parent_coin_id] = lineage_proof
+        self.proofs.move_to_end(parent_coin_id)
+        while len(self.proofs) > self.size:
+            self.proofs.popitem(last=False)
+
+
+    def get(self, parent_coin_id: bytes32) -> Optional[LineageProof]:
+        lineage_proof = self.proofs.get(parent_coin_id)
+        if lineage_proof is not None:
+            self.proofs.move_to_end(parent_coin_id)
+            return lineage_proof
+
+        offset = self.offsets().get(parent_coin_id)
+        if offset is None:
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            record = f.read(RECORD.size)
+        if len(record) != RECORD.size:
+            return None
+        (stored_coin_id, parent_name, inner_puzzle_hash, amount) = RECORD.unpack(record)
+        # another process may have moved the record, treat a mismatch as a miss
+        if stored_coin_id != parent_coin_id:
+            del self.offsets()[parent_coin_id]
+            return None
+        lineage_proof = LineageProof(bytes32(parent_name), bytes32(inner_puzzle_hash), uint64(amount))
+        self.remember(parent_coin_id, lineage_proof)
+        return lineage_proof
+
+
+    def put(self, parent_coin_id: bytes32, lineage_proof: LineageProof):
+        offsets = self.offsets()
+        if parent_coin_id not in offsets:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "ab") as f:
+                # other spend scripts append to the same file, the end only holds still under the lock
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    end = f.seek(0, os.SEEK_END)
+                    if end % RECORD.size != 0:
+                        f.truncate(end - end % RECORD.size)
+                        end = f.seek(0, os.SEEK_END)
+                    f.write(RECORD.pack(parent_coin_id, lineage_proof.parent_name, lineage_proof.inner_puzzle_hash, lineage_proof.amount))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                offsets[parent_coin_id] = end
+        self.remember(parent_coin_id, lineage_proof)
+
+
+    async def lineage_proof(self, node_client: FullNodeRpcClient, parent_coin_id: bytes32) -> LineageProof:
+        lineage_proof = self.get(parent_coin_id)
+        if lineage_proof is not None:
+            self.hits += 1
+            return lineage_proof
+        self.misses += 1
+        lineage_proof = await fetch_lineage_proof(node_client, parent_coin_id)
+        self.put(parent_coin_id, lineage_proof)
+        return lineage_proof
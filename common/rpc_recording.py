@@ -0,0 +1,122 @@
+import asyncio
+import gzip
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.rpc.rpc_client import RpcClient
+from chia.rpc.wallet_rpc_client import WalletRpcClient
+
+# RPC_RECORD - file to record every node and wallet RPC exchange of the run to, for replaying offline
+RPC_RECORD = os.environ.get("RPC_RECORD")
+# RPC_REPLAY - recording to serve node and wallet RPCs from instead of a live node and wallet
+RPC_REPLAY = os.environ.get("RPC_REPLAY")
+# RPC_REPLAY_LATENCY - seconds each replayed request takes, to model a remote node
+RPC_REPLAY_LATENCY = float(os.environ.get("RPC_REPLAY_LATENCY", 0))
+
+
+def request_key(service: str, path: str, request_json: Dict[str, Any]) -> Tuple[str, str, str]:
+    return (service, path, json.dumps(request_json, sort_keys=True, separators=(",", ":")))
+
+
+# gzipped json lines of {service, path, request, response | error}
+class RpcRecorder:
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.lines: List[str] = []
+
+
+    def record(self, service: str, client: RpcClient) -> RpcClient:
+        fetch = client.fetch
+
+        async def recorded_fetch(path, request_json) -> Dict[str, Any]:
+            exchange = {"service": service, "path": path, "request": request_json}
+            try:
+                exchange["response"] = await fetch(path, request_json)
+            except ValueError as e:
+                exchange["error"] = e.args[0] if len(e.args) > 0 else None
+                self.lines.append(json.dumps(exchange, separators=(",", ":")))
+                raise
+            # serialized now, callers are free to mutate the response
+            self.lines.append(json.dumps(exchange, separators=(",", ":")))
+            return exchange["response"]
+
+        client.fetch = recorded_fetch
+        return client
+
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        partial = self.path.with_name(self.path.name + ".partial")
+        with gzip.open(partial, "wt") as f:
+            for line in self.lines:
+                f.write(line + "\n")
+        os.replace(partial, self.path)
+        print(f'Recorded {len(self.lines)} RPC exchanges to {self.path}')
+
+
+class RpcReplay:
+
+    def __init__(self, path: Path, latency: float = RPC_REPLAY_LATENCY):
+        self.latency = latency
+        self.exchanges: Dict[Tuple[str, str, str], List[str]] = dict()
+        self.served: Dict[Tuple[str, str, str], int] = dict()
+        with gzip.open(path, "rt") as f:
+            for line in f:
+                exchange = json.loads(line)
+                self.exchanges.setdefault(request_key(exchange["service"], exchange["path"], exchange["request"]), []).append(line)
+
+
+    # repeated requests get their recorded answers in order, then the last one again
+    def serve(self, service: str, path: str, request_json: Dict[str, Any]) -> Dict[str, Any]:
+        key = request_key(service, path, request_json)
+        lines = self.exchanges.get(key)
+        if lines is None:
+            raise LookupError(f'{service} {path} {key[2]} was not recorded')
+        served = self.served.get(key, 0)
+        self.served[key] = served + 1
+        exchange = json.loads(lines[min(served, len(lines) - 1)])
+        if "error" in exchange:
+            raise ValueError(exchange["error"])
+        return exchange["response"]
+
+
+    def node_client(self) -> FullNodeRpcClient:
+        return ReplayNodeClient(self, "full_node")
+
+
+    def wallet_client(self) -> WalletRpcClient:
+        return ReplayWalletClient(self, "wallet")
+
+
+class ReplayClient:
+
+    def __init__(self, replay: RpcReplay, service: str):
+        self.replay = replay
+        self.service = service
+        self.closing_task = None
+
+
+    async def fetch(self, path, request_json) -> Dict[str, Any]:
+        if self.replay.latency > 0:
+            await asyncio.sleep(self.replay.latency)
+        return self.replay.serve(self.service, path, request_json)
+
+
+    def close(self):
+        pass
+
+
+    async def await_closed(self):
+        pass
+
+
+class ReplayNodeClient(ReplayClient, FullNodeRpcClient):
+    pass
+
+
+class ReplayWalletClient(ReplayClient, WalletRpcClient):
+    pass
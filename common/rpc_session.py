@@ -0,0 +1,73 @@
+import asyncio
+import os
+from typing import Any, Dict, Optional
+
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.rpc.rpc_client import RpcClient
+from chia.rpc.wallet_rpc_client import WalletRpcClient
+from chia.util.default_root import DEFAULT_ROOT_PATH
+from chia.util.ints import uint16
+
+from coin_state_cache import CoinStateCache
+from rpc_recording import RPC_RECORD, RPC_REPLAY, RpcRecorder, RpcReplay
+
+# RPC_CONCURRENCY - how many requests may be in flight at once across the node and wallet clients
+RPC_CONCURRENCY = int(os.environ.get("RPC_CONCURRENCY", 16))
+
+
+class RpcSession:
+
+    def __init__(self, node_client: FullNodeRpcClient, wallet_client: Optional[WalletRpcClient] = None, max_in_flight: int = RPC_CONCURRENCY, recorder: Optional[RpcRecorder] = None):
+        self.rpc_clients = [client for client in (node_client, wallet_client) if client is not None]
+        # repeated node lookups are answered once per peak
+        self.node_client = CoinStateCache(node_client)
+        self.wallet_client = wallet_client
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.recorder = recorder
+        for client in self.clients():
+            self.bound(client)
+
+
+    # one aiohttp session per client, so connections are kept alive for the whole run
+    @classmethod
+    async def create(cls, config: Dict[str, Any], wallet: bool = False, self_hostname: str = "localhost", max_in_flight: int = RPC_CONCURRENCY) -> "RpcSession":
+        if RPC_REPLAY:
+            replay = RpcReplay(RPC_REPLAY)
+            return cls(replay.node_client(), replay.wallet_client() if wallet else None, max_in_flight)
+
+        node_client = await FullNodeRpcClient.create(self_hostname, uint16(config["full_node"]["rpc_port"]), DEFAULT_ROOT_PATH, config)
+        wallet_client = None
+        if wallet:
+            wallet_client = await WalletRpcClient.create(self_hostname, uint16(config["wallet"]["rpc_port"]), DEFAULT_ROOT_PATH, config)
+        recorder = None
+        if RPC_RECORD:
+            recorder = RpcRecorder(RPC_RECORD)
+            recorder.record("full_node", node_client)
+            if wallet_client is not None:
+                recorder.record("wallet", wallet_client)
+        return cls(node_client, wallet_client, max_in_flight, recorder)
+
+
+    def clients(self):
+        return self.rpc_clients
+
+
+    # every client method goes through fetch
+    def bound(self, client: RpcClient):
+        fetch = client.fetch
+
+        async def bounded_fetch(path, request_json) -> Dict[str, Any]:
+            async with self.in_flight:
+                return await fetch(path, request_json)
+
+        client.fetch = bounded_fetch
+
+
+    async def close(self):
+        print(self.node_client.report())
+        for client in self.clients():
+            client.close()
+        for client in self.clients():
+            await client.await_closed()
+        if self.recorder is not None:
+            self.recorder.save()
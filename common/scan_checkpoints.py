@@ -0,0 +1,94 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.default_root import DEFAULT_ROOT_PATH
+
+from coin_lookup import LOOKUP_CHUNK, chunks
+
+# SCAN_CHECKPOINTS_PATH - per tool, last fully handled height per puzzle hash (a CAT puzzle hash commits to its asset id), later runs only look at newer blocks
+SCAN_CHECKPOINTS_PATH = Path(os.environ.get("SCAN_CHECKPOINTS_PATH", DEFAULT_ROOT_PATH / "runtime_data" / "scan_checkpoints"))
+# SCAN_REORG_DEPTH - blocks below a checkpoint that are looked at again in case they were reorged
+SCAN_REORG_DEPTH = int(os.environ.get("SCAN_REORG_DEPTH", 32))
+# FULL_SCAN - "1" ignores the checkpoints and scans from height 0, checkpoints are still updated
+FULL_SCAN = os.environ.get("FULL_SCAN", "0") == "1"
+
+
+class ScanCheckpoints:
+
+    # each tool has its own checkpoints, what counts as handled differs between them
+    def __init__(self, name: str, directory: Path = SCAN_CHECKPOINTS_PATH, reorg_depth: int = SCAN_REORG_DEPTH, full_scan: bool = FULL_SCAN):
+        self.path = Path(directory) / f"{name}.json"
+        self.reorg_depth = reorg_depth
+        self.full_scan = full_scan
+        self.heights: Dict[str, int] = dict()
+        # puzzle hash -> the height it moves to and the coins whose spends have to confirm first
+        self.pending: Dict[str, Dict[str, Any]] = dict()
+        self.peak_height: Optional[int] = None
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                state = json.load(f)
+            # older checkpoint files hold only the heights
+            if "heights" in state:
+                self.heights = state["heights"]
+                self.pending = state.get("pending", dict())
+            else:
+                self.heights = state
+
+
+    # every coin confirmed up to the current peak is handled once this scan is done
+    async def begin(self, node_client: FullNodeRpcClient) -> int:
+        state = await node_client.get_blockchain_state()
+        self.peak_height = state["peak"].height
+        await self.settle(node_client)
+        return self.peak_height
+
+
+    # a pending puzzle hash advances once all its pushed coins are spent, otherwise it is scanned again from its old height
+    async def settle(self, node_client: FullNodeRpcClient):
+        if len(self.pending) == 0:
+            return
+        spent = set()
+        names = [bytes32.from_hexstr(coin_id) for pending in self.pending.values() for coin_id in pending["coin_ids"]]
+        for chunk in chunks(names, LOOKUP_CHUNK):
+            for coin_record in await node_client.get_coin_records_by_names(chunk, include_spent_coins=True):
+                if coin_record.spent:
+                    spent.add(coin_record.name.hex())
+        for puzzle_hash, pending in self.pending.items():
+            if all(coin_id in spent for coin_id in pending["coin_ids"]):
+                self.heights[puzzle_hash] = max(self.heights.get(puzzle_hash, 0), pending["height"])
+            else:
+                print(f'Spends of {puzzle_hash} did not confirm, scanning it again from its last checkpoint')
+        self.pending = dict()
+
+
+    def start_height(self, puzzle_hashes: List[bytes32]) -> int:
+        if self.full_scan:
+            return 0
+        heights = [self.heights.get(puzzle_hash.hex()) for puzzle_hash in puzzle_hashes]
+        # puzzle hashes looked up together share one start height, the lowest of them
+        if len(heights) == 0 or None in heights:
+            return 0
+        return max(0, min(heights) + 1 - self.reorg_depth)
+
+
+    # coin_ids are the coins just pushed for these puzzle hashes, the checkpoint waits until they confirm
+    def done(self, puzzle_hashes: List[bytes32], coin_ids: List[bytes32] = None):
+        if self.peak_height is None:
+            return
+        for puzzle_hash in puzzle_hashes:
+            if coin_ids:
+                self.pending[puzzle_hash.hex()] = {"height": self.peak_height, "coin_ids": [coin_id.hex() for coin_id in coin_ids]}
+            else:
+                self.heights[puzzle_hash.hex()] = self.peak_height
+
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        partial = self.path.with_name(self.path.name + ".partial")
+        with open(partial, "w") as f:
+            json.dump({"heights": self.heights, "pending": self.pending}, f, sort_keys=True)
+        os.replace(partial, self.path)
@@ -0,0 +1,272 @@
+##################################################################
+#
+# Signer - keeps derived wallet keys warm in a long running process
+#          and signs coin spends for the drivers over a unix socket
+#
+#   python3 signer.py <wallet fingerprint>
+#   SIGNER_SOCKET=<path> python3 royalty_share_spend.py ...
+#
+##################################################################
+
+import asyncio
+import json
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from blspy import G1Element, PrivateKey
+
+from chia.consensus.default_constants import DEFAULT_CONSTANTS
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.types.spend_bundle import SpendBundle
+from chia.util.config import load_config
+from chia.util.default_root import DEFAULT_ROOT_PATH
+from chia.util.keychain import Keychain
+from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
+    DEFAULT_HIDDEN_PUZZLE_HASH,
+    calculate_synthetic_secret_key,
+    puzzle_hash_for_synthetic_public_key,
+)
+from chia.wallet.sign_coin_spends import sign_coin_spends
+
+from key_index import KeyIndex
+
+# SIGNER_SOCKET - when set, drivers sign through the signer daemon listening on this path
+SIGNER_SOCKET = os.environ.get("SIGNER_SOCKET")
+DEFAULT_SIGNER_SOCKET = DEFAULT_ROOT_PATH / "runtime_data" / "signer.sock"
+
+# DERIVATIONS - how deep the daemon indexes each key (hardened and unhardened)
+DERIVATIONS = int(os.environ.get("DERIVATIONS", 8150))
+
+PREFIX = os.environ.get("PREFIX", "xch")
+TESTNET = os.environ.get("TESTNET", "testnet10")
+MAX_BLOCK_COST_CLVM = DEFAULT_CONSTANTS.MAX_BLOCK_COST_CLVM
+
+FRAME = struct.Struct(">I")
+
+
+class LocalSigner:
+
+    def __init__(self, key_indexes: List[KeyIndex], additional_data: bytes, max_cost: int = MAX_BLOCK_COST_CLVM):
+        self.key_indexes = key_indexes
+        self.additional_data = additional_data
+        self.max_cost = max_cost
+
+
+    def secret_key_for_public_key(self, pk: G1Element) -> Optional[PrivateKey]:
+        print(f'Looking for wallet keys to sign spend, PK: {pk}')
+        for key_index in self.key_indexes:
+            synth_key = key_index.find_synthetic_secret_key(pk)
+            if synth_key is not None:
+                return synth_key
+        return None
+
+
+    def secret_key_for_puzzle_hash(self, puzzle_hash: bytes32) -> Optional[PrivateKey]:
+        for key_index in self.key_indexes:
+            entry = key_index.entry_for_puzzle_hash(puzzle_hash)
+            if entry is not None:
+                return calculate_synthetic_secret_key(key_index.secret_key(entry), DEFAULT_HIDDEN_PUZZLE_HASH)
+        return None
+
+
+    async def get_public_keys(self) -> List[G1Element]:
+        return [key_index.master_pk for key_index in self.key_indexes]
+
+
+    async def sign_coin_spends(self, coin_spends: List[CoinSpend]) -> SpendBundle:
+        return await sign_coin_spends(
+            coin_spends,
+            self.secret_key_for_public_key,
+            self.secret_key_for_puzzle_hash,
+            self.additional_data,
+            self.max_cost,
+            [puzzle_hash_for_synthetic_public_key],
+        )
+
+
+    async def sign_bundles(self, bundles: List[List[CoinSpend]]) -> List[SpendBundle]:
+        return [await self.sign_coin_spends(coin_spends) for coin_spends in bundles]
+
+
+    async def close(self):
+        pass
+
+
+async def read_message(reader: asyncio.StreamReader) -> Dict[str, Any]:
+    (size,) = FRAME.unpack(await reader.readexactly(FRAME.size))
+    return json.loads(await reader.readexactly(size))
+
+
+async def write_message(writer: asyncio.StreamWriter, message: Dict[str, Any]):
+    data = json.dumps(message).encode()
+    writer.write(FRAME.pack(len(data)) + data)
+    await writer.drain()
+
+
+class SignerDaemon:
+
+    def __init__(self, signer: LocalSigner):
+        self.signer = signer
+        self.server: Optional[asyncio.AbstractServer] = None
+
+
+    async def start(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists():
+            path.unlink()
+        # anyone who can open the socket can get spends signed, so it is never bound with wider permissions
+        umask = os.umask(0o177)
+        try:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path=str(path))
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0o600)
+        print(f'Signer listening on {path}')
+
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await read_message(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    response = await self.handle_request(request)
+                    response["success"] = True
+                except Exception as e:
+                    print(f'Failed on signer request: {repr(e)}')
+                    response = {"success": False, "error": repr(e)}
+                await write_message(writer, response)
+        finally:
+            writer.close()
+
+
+    async def handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        method = request.get("method")
+        if method == "get_public_keys":
+            return {"public_keys": [bytes(pk).hex() for pk in await self.signer.get_public_keys()]}
+        if method == "sign_bundles":
+            bundles = [[CoinSpend.from_json_dict(coin_spend) for coin_spend in bundle] for bundle in request["bundles"]]
+            spend_bundles = await self.signer.sign_bundles(bundles)
+            return {"spend_bundles": [spend_bundle.to_json_dict(include_legacy_keys=False, exclude_modern_keys=False) for spend_bundle in spend_bundles]}
+        raise ValueError(f"Unknown method {method}")
+
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+class SignerClient:
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.lock = asyncio.Lock()
+
+
+    # a daemon restart breaks the connection, so a failed exchange reconnects and is sent once more
+    async def request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        async with self.lock:
+            try:
+                response = await self.exchange(request)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self.reset()
+                response = await self.exchange(request)
+        if not response["success"]:
+            raise RuntimeError(f"Signer failed: {response['error']}")
+        return response
+
+
+    async def exchange(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_unix_connection(str(self.path))
+        await write_message(self.writer, request)
+        return await read_message(self.reader)
+
+
+    # the old connection is broken, there is nothing to wait for
+    def reset(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+
+    async def get_public_keys(self) -> List[G1Element]:
+        response = await self.request({"method": "get_public_keys"})
+        return [G1Element.from_bytes(bytes.fromhex(pk)) for pk in response["public_keys"]]
+
+
+    async def sign_coin_spends(self, coin_spends: List[CoinSpend]) -> SpendBundle:
+        return (await self.sign_bundles([coin_spends]))[0]
+
+
+    # many bundles, one round trip
+    async def sign_bundles(self, bundles: List[List[CoinSpend]]) -> List[SpendBundle]:
+        request = {"method": "sign_bundles", "bundles": [[coin_spend.to_json_dict() for coin_spend in bundle] for bundle in bundles]}
+        response = await self.request(request)
+        return [SpendBundle.from_json_dict(spend_bundle) for spend_bundle in response["spend_bundles"]]
+
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.writer = None
+
+
+def load_additional_data() -> bytes:
+    if PREFIX == 'txch':
+        try:
+            config = load_config(DEFAULT_ROOT_PATH, "config.yaml")
+            return bytes32.from_hexstr(config["farmer"]["network_overrides"]["constants"][TESTNET]["AGG_SIG_ME_ADDITIONAL_DATA"])
+        except Exception as e:
+            print(f"Tried loading AGG_SIG_ME_ADDITIONAL_DATA from config. Exception {e}")
+    return DEFAULT_CONSTANTS.AGG_SIG_ME_ADDITIONAL_DATA
+
+
+# hardened and unhardened keys, DERIVATIONS deep, for each fingerprint in the keychain
+def load_key_indexes(fingerprints: List[int]) -> List[KeyIndex]:
+    print(f'Is keychain locked? {Keychain.is_keyring_locked()}')
+    keychain = Keychain()
+
+    key_indexes = []
+    for fingerprint in fingerprints:
+        sk = keychain.get_private_key_by_fingerprint(fingerprint)
+        assert sk is not None, f"No key for fingerprint {fingerprint}"
+        key_index = KeyIndex(sk[0])
+        key_index.load(DERIVATIONS, hardened=False)
+        key_index.load(DERIVATIONS, hardened=True)
+        key_indexes.append(key_index)
+    return key_indexes
+
+
+def usage():
+    print("Usage: python3 signer.py <WALLET_FINGERPRINT> <optional:MORE_WALLET_FINGERPRINTS...>")
+    print("       SIGNER_SOCKET=<path> overrides the socket path, DERIVATIONS=<n> how deep each key is indexed")
+    exit(1)
+
+
+async def main():
+    if len(sys.argv) < 2:
+        usage()
+
+    daemon = SignerDaemon(LocalSigner(load_key_indexes([int(fingerprint) for fingerprint in sys.argv[1:]]), load_additional_data()))
+    await daemon.start(Path(SIGNER_SOCKET or DEFAULT_SIGNER_SOCKET))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await daemon.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+import math
+import os
+from typing import Dict, List, Optional, Tuple, TypeVar
+
+from chia.consensus.constants import ConsensusConstants
+from chia.consensus.cost_calculator import NPCResult
+from chia.consensus.default_constants import DEFAULT_CONSTANTS
+from chia.full_node.bundle_tools import simple_solution_generator
+from chia.full_node.mempool_check_conditions import get_name_puzzle_conditions, mempool_check_time_locks
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.types.spend_bundle import SpendBundle
+from chia.util.errors import Err
+from chia.util.ints import uint32, uint64
+
+# BATCH_COST_FRACTION - share of MAX_BLOCK_COST_CLVM the spends of one batched bundle may use, the mempool takes at most half a block
+BATCH_COST_FRACTION = float(os.environ.get("BATCH_COST_FRACTION", 0.25))
+# FEE_TARGET_SECONDS - how soon spends should confirm, the node's fee estimate for that wait sets the fee paid per cost
+FEE_TARGET_SECONDS = int(os.environ.get("FEE_TARGET_SECONDS", 120))
+
+# costs are measured with every fork rule active, as the mempool does today
+COST_HEIGHT = max(DEFAULT_CONSTANTS.SOFT_FORK3_HEIGHT, DEFAULT_CONSTANTS.HARD_FORK_HEIGHT, DEFAULT_CONSTANTS.HARD_FORK_FIX_HEIGHT)
+
+# a fee spend asserts one announcement per spend it pays for, consensus caps that per spend
+MAX_ASSERTED_ANNOUNCEMENTS = 1024
+
+# the node answers in whole mojos for a given cost, asking for a full block's worth keeps the rate per cost precise
+FEE_ESTIMATE_COST = DEFAULT_CONSTANTS.MAX_BLOCK_COST_CLVM
+
+# timelocks that only need the chain to move on, such spends are deferred rather than dropped
+IMMATURE_ERRORS = {Err.ASSERT_HEIGHT_ABSOLUTE_FAILED, Err.ASSERT_HEIGHT_RELATIVE_FAILED, Err.ASSERT_SECONDS_ABSOLUTE_FAILED, Err.ASSERT_SECONDS_RELATIVE_FAILED}
+
+T = TypeVar("T")
+
+
+class SpendNotYetValid(ValueError):
+    pass
+
+
+def run_spend_bundle(spend_bundle: SpendBundle, constants: ConsensusConstants = DEFAULT_CONSTANTS, height: int = COST_HEIGHT) -> NPCResult:
+    result = get_name_puzzle_conditions(simple_solution_generator(spend_bundle), constants.MAX_BLOCK_COST_CLVM, mempool_mode=True, height=uint32(height), constants=constants)
+    if result.error is not None:
+        raise ValueError(f'Spend bundle does not run: {Err(result.error).name}')
+    return result
+
+
+# the same cost the mempool charges: execution, conditions and bytes
+def spend_bundle_cost(spend_bundle: SpendBundle, constants: ConsensusConstants = DEFAULT_CONSTANTS, height: int = COST_HEIGHT) -> int:
+    return run_spend_bundle(spend_bundle, constants, height).cost
+
+
+# height and timestamp the mempool checks timelocks against, those of the latest transaction block
+async def mempool_peak(node_client: FullNodeRpcClient) -> Tuple[int, int]:
+    state = await node_client.get_blockchain_state()
+    peak = state["peak"]
+    if peak.timestamp is None:
+        peak = await node_client.get_block_record(peak.prev_transaction_block_hash)
+    return (peak.height, peak.timestamp)
+
+
+# runs the spends and checks their conditions against coin state the way push_tx would, returns the exact cost
+async def validate_spend_bundle(node_client: FullNodeRpcClient, spend_bundle: SpendBundle, peak: Tuple[int, int],
+                                constants: ConsensusConstants = DEFAULT_CONSTANTS, height: int = COST_HEIGHT) -> int:
+    (peak_height, peak_timestamp) = peak
+    result = run_spend_bundle(spend_bundle, constants, height)
+    if result.conds.addition_amount > result.conds.removal_amount:
+        raise ValueError(f'Spend bundle creates {result.conds.addition_amount} mojos from {result.conds.removal_amount}')
+    additions = dict()
+    for spend in result.conds.spends:
+        for (puzzle_hash, amount, hint) in spend.create_coin:
+            coin = Coin(bytes32(spend.coin_id), bytes32(puzzle_hash), uint64(amount))
+            additions[coin.name()] = coin
+
+    coin_records: Dict[bytes32, CoinRecord] = dict()
+    for spend in result.conds.spends:
+        coin_id = bytes32(spend.coin_id)
+        if coin_id in additions:
+            # spent in the same block it is created in
+            coin_records[coin_id] = CoinRecord(additions[coin_id], uint32(peak_height + 1), uint32(0), False, uint64(peak_timestamp))
+            continue
+        coin_record = await node_client.get_coin_record_by_name(coin_id)
+        if coin_record is None:
+            raise ValueError(f'Coin {coin_id.hex()} does not exist')
+        if coin_record.spent:
+            raise ValueError(f'Coin {coin_id.hex()} is already spent')
+        coin_records[coin_id] = coin_record
+
+    error = mempool_check_time_locks(coin_records, result.conds, uint32(peak_height), uint64(peak_timestamp))
+    if error in IMMATURE_ERRORS:
+        raise SpendNotYetValid(f'Spend bundle is not valid yet: {error.name}')
+    if error is not None:
+        raise ValueError(f'Spend bundle failed a timelock: {error.name}')
+    return result.cost
+
+
+def batch_cost_limit(constants: ConsensusConstants = DEFAULT_CONSTANTS, fraction: float = BATCH_COST_FRACTION) -> int:
+    return int(constants.MAX_BLOCK_COST_CLVM * fraction)
+
+
+# in order, a new batch whenever the next item would go over max_cost or max_items
+def pack_by_cost(items: List[T], costs: List[int], max_cost: int, max_items: Optional[int] = None) -> List[List[T]]:
+    batches = []
+    batch = []
+    total = 0
+    for item, cost in zip(items, costs):
+        if len(batch) > 0 and (total + cost > max_cost or len(batch) == max_items):
+            batches.append(batch)
+            batch = []
+            total = 0
+        batch.append(item)
+        total += cost
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+# the request never changes, so a CoinStateCache answers it once per peak
+async def fee_for_cost(node_client: FullNodeRpcClient, cost: int, min_fee: int = 0, max_fee: Optional[int] = None, target_seconds: int = FEE_TARGET_SECONDS) -> uint64:
+    estimate = await node_client.get_fee_estimate([target_seconds], FEE_ESTIMATE_COST)
+    fee = max(min_fee, math.ceil(estimate["estimates"][0] * cost / FEE_ESTIMATE_COST))
+    if max_fee is not None:
+        fee = min(fee, max_fee)
+    return uint64(fee)
@@ -0,0 +1,229 @@
+##################################################################
+#
+# Spend pipeline - builds, signs and pushes spends as separate stages
+#                  so each runs at its own pace, on its own host if needed
+#
+#   SPEND_EXPORT=unsigned.jsonl python3 wallet_repair.py ...
+#   python3 spend_pipeline.py sign unsigned.jsonl signed.jsonl <WALLET_FINGERPRINT...>
+#   python3 spend_pipeline.py push signed.jsonl <optional:OFFERS_DIRECTORY>
+#
+##################################################################
+
+import asyncio
+import gzip
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from blspy import G2Element
+
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.types.blockchain_format.coin import Coin
+from chia.types.coin_spend import CoinSpend
+from chia.types.spend_bundle import SpendBundle
+from chia.util.config import load_config
+from chia.util.default_root import DEFAULT_ROOT_PATH
+from chia.wallet.trading.offer import Offer
+
+from rpc_session import RpcSession
+from signer import SIGNER_SOCKET, LocalSigner, SignerClient, load_additional_data, load_key_indexes
+
+# SPEND_EXPORT - when set, drivers write their bundles to this file unsigned instead of signing and pushing them
+SPEND_EXPORT = os.environ.get("SPEND_EXPORT")
+# SIGN_BATCH - bundles the batch signer signs per call, one round trip when signing through a signer daemon
+SIGN_BATCH = int(os.environ.get("SIGN_BATCH", 100))
+# PUSH_BATCH - bundles the pusher has in flight at once
+PUSH_BATCH = int(os.environ.get("PUSH_BATCH", 10))
+
+
+# json lines of {name, coin_spends} before signing and {name, spend_bundle} after, offers carry {name, offer} in both
+# bundles paying fees from a fee coin pool also list those coin ids as fee_coins
+def open_spend_file(path: Path, mode: str):
+    path = Path(path)
+    if ".gz" in path.suffixes:
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
+
+
+def read_spend_file(path: Path) -> Iterator[Dict[str, Any]]:
+    with open_spend_file(path, "r") as f:
+        for line in f:
+            if line.strip() != "":
+                yield json.loads(line)
+
+
+class SpendExport:
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open_spend_file(self.path, "a")
+        self.count = 0
+
+
+    # stands in for the signer, so a driver builds its bundles without touching private keys
+    async def sign_coin_spends(self, coin_spends: List[CoinSpend]) -> SpendBundle:
+        return SpendBundle(coin_spends, G2Element())
+
+
+    async def sign_bundles(self, bundles: List[List[CoinSpend]]) -> List[SpendBundle]:
+        return [await self.sign_coin_spends(coin_spends) for coin_spends in bundles]
+
+
+    # in place of push_tx, one line per bundle and flushed so a stopped run keeps what it built
+    # fee_coins are pool coins the bundle pays its fee with, they leave the pool with the export
+    def write(self, spend_bundle: SpendBundle, name: Optional[str] = None, fee_coins: List[Coin] = ()):
+        record = {"name": name or spend_bundle.name().hex(), "coin_spends": [coin_spend.to_json_dict() for coin_spend in spend_bundle.coin_spends]}
+        if len(fee_coins) > 0:
+            record["fee_coins"] = [coin.name().hex() for coin in fee_coins]
+        self.write_record(record)
+
+
+    # in place of writing the offer file, the pusher writes it once the offer is signed
+    def write_offer(self, offer: Offer, name: str):
+        self.write_record({"name": name, "offer": offer.to_bech32()})
+
+
+    def write_record(self, record: Dict[str, Any]):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        self.count += 1
+
+
+    async def close(self):
+        self.file.close()
+        print(f'Exported {self.count} unsigned bundle(s) to {self.path}')
+
+
+# the driver pushes, unless it is only exporting
+async def push_or_export(node_client: FullNodeRpcClient, signer, spend_bundle: SpendBundle, fee_coins: List[Coin] = ()) -> Dict[str, Any]:
+    if isinstance(signer, SpendExport):
+        signer.write(spend_bundle, fee_coins=fee_coins)
+        return {"status": "EXPORTED", "success": True}
+    return await node_client.push_tx(spend_bundle)
+
+
+def record_coin_spends(record: Dict[str, Any]) -> List[CoinSpend]:
+    if "offer" in record:
+        return Offer.from_bech32(record["offer"]).coin_spends()
+    return [CoinSpend.from_json_dict(coin_spend) for coin_spend in record["coin_spends"]]
+
+
+def signed_record(record: Dict[str, Any], spend_bundle: SpendBundle) -> Dict[str, Any]:
+    if "offer" in record:
+        offer = Offer.from_bech32(record["offer"])
+        return {"name": record["name"], "offer": Offer(offer.requested_payments, spend_bundle, offer.driver_dict).to_bech32()}
+    signed = {"name": record["name"], "spend_bundle": spend_bundle.to_json_dict(include_legacy_keys=False, exclude_modern_keys=False)}
+    if "fee_coins" in record:
+        signed["fee_coins"] = record["fee_coins"]
+    return signed
+
+
+# SIGN_BATCH bundles per call to the signer, written out atomically once all are signed
+async def sign_spend_file(signer, source: Path, target: Path, batch: int = SIGN_BATCH) -> int:
+    target = Path(target)
+    partial = target.with_name(target.name + ".partial")
+    count = 0
+    records: List[Dict[str, Any]] = []
+    with open_spend_file(partial, "w") as f:
+        for record in read_spend_file(source):
+            records.append(record)
+            if len(records) == batch:
+                count += await sign_records(signer, records, f)
+                records = []
+        if len(records) > 0:
+            count += await sign_records(signer, records, f)
+    os.replace(partial, target)
+    return count
+
+
+async def sign_records(signer, records: List[Dict[str, Any]], f) -> int:
+    spend_bundles = await signer.sign_bundles([record_coin_spends(record) for record in records])
+    for record, spend_bundle in zip(records, spend_bundles):
+        f.write(json.dumps(signed_record(record, spend_bundle)) + "\n")
+    print(f'Signed {len(records)} bundle(s)')
+    return len(records)
+
+
+# pushes keep going past a failed bundle, returns how many went through and how many failed
+async def push_spend_file(node_client: FullNodeRpcClient, source: Path, offers_path: Optional[Path] = None, batch: int = PUSH_BATCH) -> Tuple[int, int]:
+    pushed = 0
+    failed = 0
+    records: List[Dict[str, Any]] = []
+    for record in read_spend_file(source):
+        if "offer" in record:
+            if offers_path is None:
+                raise ValueError(f'{record["name"]} is an offer, give an offers directory to write it to')
+            Path(offers_path).mkdir(parents=True, exist_ok=True)
+            with open(Path(offers_path) / record["name"], "w") as f:
+                f.write(record["offer"])
+            pushed += 1
+            continue
+        records.append(record)
+        if len(records) == batch:
+            done = await push_records(node_client, records)
+            pushed += done
+            failed += len(records) - done
+            records = []
+    if len(records) > 0:
+        done = await push_records(node_client, records)
+        pushed += done
+        failed += len(records) - done
+    return (pushed, failed)
+
+
+async def push_records(node_client: FullNodeRpcClient, records: List[Dict[str, Any]]) -> int:
+    async def push(record: Dict[str, Any]) -> bool:
+        try:
+            status = await node_client.push_tx(SpendBundle.from_json_dict(record["spend_bundle"]))
+            print(f'Pushed {record["name"]}: {status.get("status")}')
+            return True
+        except Exception as e:
+            print(f'Failed to push {record["name"]}: {repr(e)}')
+            return False
+
+    return sum(await asyncio.gather(*[push(record) for record in records]))
+
+
+def usage():
+    print("Usage: python3 spend_pipeline.py sign <UNSIGNED_FILE> <SIGNED_FILE> <WALLET_FINGERPRINT> <optional:MORE_WALLET_FINGERPRINTS...>")
+    print("       python3 spend_pipeline.py push <SIGNED_FILE> <optional:OFFERS_DIRECTORY>")
+    print("       SPEND_EXPORT=<file> makes a driver write unsigned bundles there instead of signing and pushing them")
+    print("       SIGNER_SOCKET=<path> signs through a running signer.py instead of loading the keychain")
+    exit(1)
+
+
+async def main():
+    if len(sys.argv) < 3:
+        usage()
+
+    command = sys.argv[1]
+    if command == "sign":
+        if SIGNER_SOCKET is not None:
+            print(f'Signing through signer daemon at {SIGNER_SOCKET}')
+            signer = SignerClient(SIGNER_SOCKET)
+        elif len(sys.argv) > 4:
+            signer = LocalSigner(load_key_indexes([int(fingerprint) for fingerprint in sys.argv[4:]]), load_additional_data())
+        else:
+            usage()
+        try:
+            count = await sign_spend_file(signer, Path(sys.argv[2]), Path(sys.argv[3]))
+            print(f'Signed {count} bundle(s) into {sys.argv[3]}')
+        finally:
+            await signer.close()
+    elif command == "push" and len(sys.argv) <= 4:
+        offers_path = Path(sys.argv[3]) if len(sys.argv) == 4 else None
+        rpc = await RpcSession.create(load_config(DEFAULT_ROOT_PATH, "config.yaml"))
+        try:
+            (pushed, failed) = await push_spend_file(rpc.node_client, Path(sys.argv[2]), offers_path)
+            print(f'Pushed {pushed} bundle(s), {failed} failed')
+        finally:
+            await rpc.close()
+    else:
+        usage()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,168 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from chia.full_node.mempool_manager import MEMPOOL_MIN_FEE_INCREASE
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint64
+
+from coin_lookup import LOOKUP_CHUNK, chunks
+
+# SUBMISSION_CONFIRM_BLOCKS - blocks a pushed bundle may go unconfirmed before it is pushed again with a higher fee
+SUBMISSION_CONFIRM_BLOCKS = int(os.environ.get("SUBMISSION_CONFIRM_BLOCKS", 6))
+# SUBMISSION_FEE_BUMP - factor the fee grows by on each rebroadcast, the mempool also wants at least MEMPOOL_MIN_FEE_INCREASE more to replace it
+SUBMISSION_FEE_BUMP = float(os.environ.get("SUBMISSION_FEE_BUMP", 1.5))
+# SUBMISSION_MAX_ATTEMPTS - rebroadcasts of one bundle before it is given up on, a later run finds its coins again
+SUBMISSION_MAX_ATTEMPTS = int(os.environ.get("SUBMISSION_MAX_ATTEMPTS", 5))
+# MAX_REBROADCAST_FEE - most mojos a rebroadcast bundle pays in fees, a bundle already at the cap is pushed again unchanged
+# the default leaves room for two minimum increases on top of a first fee of up to MEMPOOL_MIN_FEE_INCREASE
+MAX_REBROADCAST_FEE = int(os.environ.get("MAX_REBROADCAST_FEE", 3 * MEMPOOL_MIN_FEE_INCREASE))
+# SUBMISSION_POLL_INTERVAL - seconds between confirmation polls while waiting for pushed bundles
+SUBMISSION_POLL_INTERVAL = float(os.environ.get("SUBMISSION_POLL_INTERVAL", 10))
+
+# (node_client, spend bundle without fees, fee coins, least fee) -> signed spend bundle spending those fee coins and more if the fee outgrew them
+Rebuild = Callable[[FullNodeRpcClient, SpendBundle, List[Coin], uint64], Awaitable[SpendBundle]]
+
+
+class Submission:
+
+    # unpaid is the bundle before fee spends were added, a rebroadcast adds them again
+    def __init__(self, spend_bundle: SpendBundle, unpaid: SpendBundle):
+        self.spend_bundle = spend_bundle
+        self.unpaid = unpaid
+        self.height: Optional[int] = None
+        self.attempts = 0
+
+
+    def coin_ids(self) -> List[bytes32]:
+        return [coin_spend.coin.name() for coin_spend in self.spend_bundle.coin_spends]
+
+
+    def fee_coins(self) -> List[Coin]:
+        unpaid = set(coin_spend.coin.name() for coin_spend in self.unpaid.coin_spends)
+        return [coin_spend.coin for coin_spend in self.spend_bundle.coin_spends if coin_spend.coin.name() not in unpaid]
+
+
+class SubmissionTracker:
+
+    # release gets the fee coins of a bundle that is done with, those still unspent and those spent
+    def __init__(self, rebuild: Rebuild = None, release: Callable[[List[Coin], List[Coin]], None] = None, confirm_blocks: int = SUBMISSION_CONFIRM_BLOCKS,
+                 fee_bump: float = SUBMISSION_FEE_BUMP, max_attempts: int = SUBMISSION_MAX_ATTEMPTS, max_fee: int = MAX_REBROADCAST_FEE):
+        self.rebuild = rebuild
+        self.release = release
+        self.confirm_blocks = confirm_blocks
+        self.fee_bump = fee_bump
+        self.max_attempts = max_attempts
+        self.max_fee = max_fee
+        self.submissions: List[Submission] = []
+        if rebuild is not None and max_fee < MEMPOOL_MIN_FEE_INCREASE:
+            print(f'MAX_REBROADCAST_FEE of {max_fee} is below the minimum fee increase of {MEMPOOL_MIN_FEE_INCREASE}, stuck bundles are pushed again unchanged')
+
+
+    async def push(self, node_client: FullNodeRpcClient, spend_bundle: SpendBundle, unpaid: SpendBundle = None) -> Dict[str, Any]:
+        try:
+            # blocks until a rebroadcast count from the peak the bundle was pushed at
+            state = await node_client.get_blockchain_state()
+            status = await node_client.push_tx(spend_bundle)
+        except Exception:
+            self.abandon(spend_bundle, unpaid)
+            raise
+        submission = Submission(spend_bundle, spend_bundle if unpaid is None else unpaid)
+        if state["peak"] is not None:
+            submission.height = state["peak"].height
+        self.submissions.append(submission)
+        return status
+
+
+    # never reached the node, its fee coins can go in another bundle
+    def abandon(self, spend_bundle: SpendBundle, unpaid: SpendBundle = None):
+        if self.release is not None and unpaid is not None:
+            self.release(Submission(spend_bundle, unpaid).fee_coins(), [])
+
+
+    # fee coins of bundles still waiting to confirm, not to be picked for another bundle
+    def fee_coins(self) -> List[Coin]:
+        return [coin for submission in self.submissions for coin in submission.fee_coins()]
+
+
+    # every coin spent by a bundle still waiting to confirm
+    def coins(self) -> List[Coin]:
+        return [coin_spend.coin for submission in self.submissions for coin_spend in submission.spend_bundle.coin_spends]
+
+
+    # one bulk coin lookup for every bundle being tracked, returns how many are still waiting
+    async def poll(self, node_client: FullNodeRpcClient) -> int:
+        if len(self.submissions) == 0:
+            return 0
+        state = await node_client.get_blockchain_state()
+        if state["peak"] is None:
+            return len(self.submissions)
+        height = state["peak"].height
+
+        spent = set()
+        names = [coin.name() for coin in self.coins()]
+        for chunk in chunks(names, LOOKUP_CHUNK):
+            for coin_record in await node_client.get_coin_records_by_names(chunk, include_spent_coins=True):
+                if coin_record.spent:
+                    spent.add(coin_record.name)
+
+        waiting = []
+        for submission in self.submissions:
+            name = submission.spend_bundle.name().hex()
+            spent_count = len([coin_id for coin_id in submission.coin_ids() if coin_id in spent])
+            if spent_count == len(submission.coin_ids()):
+                print(f'Confirmed {name}')
+            elif spent_count > 0:
+                print(f'Dropping {name}, another bundle spent some of its coins')
+            elif submission.height is None or height - submission.height < self.confirm_blocks:
+                # pushed while the node had no peak
+                if submission.height is None:
+                    submission.height = height
+                waiting.append(submission)
+                continue
+            elif submission.attempts >= self.max_attempts:
+                # the node may still hold it, its fee coins stay reserved until the pool reservation runs out
+                print(f'Giving up on {name} after {submission.attempts} rebroadcasts')
+                continue
+            else:
+                await self.rebroadcast(node_client, submission, height)
+                waiting.append(submission)
+                continue
+            if self.release is not None:
+                fee_coins = submission.fee_coins()
+                self.release([coin for coin in fee_coins if coin.name() not in spent], [coin for coin in fee_coins if coin.name() in spent])
+        self.submissions = waiting
+        return len(waiting)
+
+
+    # the same coins again, so the node replaces the old bundle if it still holds it
+    async def rebroadcast(self, node_client: FullNodeRpcClient, submission: Submission, height: int):
+        submission.attempts += 1
+        submission.height = height
+        spend_bundle = submission.spend_bundle
+        fee_coins = submission.fee_coins()
+        added_fee_coins = []
+        try:
+            fees = spend_bundle.fees()
+            min_fees = min(max(int(fees * self.fee_bump), fees + MEMPOOL_MIN_FEE_INCREASE), self.max_fee)
+            # below the least increase the mempool accepts a replacement would only be rejected
+            if self.rebuild is not None and len(fee_coins) > 0 and min_fees >= fees + MEMPOOL_MIN_FEE_INCREASE:
+                spend_bundle = await self.rebuild(node_client, submission.unpaid, fee_coins, uint64(min_fees))
+                spent_before = set(coin.name() for coin in fee_coins)
+                added_fee_coins = [coin for coin in Submission(spend_bundle, submission.unpaid).fee_coins() if coin.name() not in spent_before]
+            print(f'Rebroadcasting {submission.spend_bundle.name().hex()} as {spend_bundle.name().hex()} with fees of {spend_bundle.fees()}')
+            await node_client.push_tx(spend_bundle)
+            submission.spend_bundle = spend_bundle
+        except Exception as e:
+            print(f'Rebroadcast of {submission.spend_bundle.name().hex()} failed: {repr(e)}')
+            # the tracked bundle stays the old one, fee coins reserved for the rebuild can go in another bundle
+            if self.release is not None and len(added_fee_coins) > 0:
+                self.release(added_fee_coins, [])
+
+
+    async def wait(self, node_client: FullNodeRpcClient, interval: float = SUBMISSION_POLL_INTERVAL):
+        while await self.poll(node_client) > 0:
+            await asyncio.sleep(interval)
@@ -0,0 +1,111 @@
+import csv
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from chia.util.default_root import DEFAULT_ROOT_PATH
+
+TAIL_DATABASE_URL = os.environ.get("TAIL_DATABASE_URL", "https://mainnet-api.taildatabase.com/tails")
+
+# TAIL_REGISTRY_PATH - local copy of the tail database, refreshed at most every TAIL_REGISTRY_TTL seconds
+TAIL_REGISTRY_PATH = Path(os.environ.get("TAIL_REGISTRY_PATH", DEFAULT_ROOT_PATH / "runtime_data" / "tails.json"))
+TAIL_REGISTRY_TTL = int(os.environ.get("TAIL_REGISTRY_TTL", 24 * 60 * 60))
+
+# TAIL_REGISTRY_OFFLINE=1 - never touch the network, use whatever is cached
+TAIL_REGISTRY_OFFLINE = os.environ.get("TAIL_REGISTRY_OFFLINE", "0") == "1"
+
+# TAIL_CSV - extra <code>,<asset id> files, separated by os.pathsep
+TAIL_CSV = [Path(path) for path in os.environ.get("TAIL_CSV", "").split(os.pathsep) if path != ""]
+
+
+class TailRegistry:
+
+    def __init__(self, path: Path = TAIL_REGISTRY_PATH, url: str = TAIL_DATABASE_URL, ttl: int = TAIL_REGISTRY_TTL, offline: bool = TAIL_REGISTRY_OFFLINE):
+        self.path = Path(path)
+        self.url = url
+        self.ttl = ttl
+        self.offline = offline
+        self.state = self.read()
+
+
+    def read(self) -> Dict[str, Any]:
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                return json.load(f)
+        return {"fetched": 0, "etag": None, "last_modified": None, "tails": {}}
+
+
+    def write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+
+    def is_stale(self) -> bool:
+        return time.time() - self.state["fetched"] >= self.ttl
+
+
+    # conditional GET, an unchanged database costs one 304
+    def fetch(self):
+        headers = {"User-Agent": "chialisp-tail-registry"}
+        if self.state["etag"] is not None:
+            headers["If-None-Match"] = self.state["etag"]
+        if self.state["last_modified"] is not None:
+            headers["If-Modified-Since"] = self.state["last_modified"]
+
+        try:
+            with urlopen(Request(self.url, headers=headers), timeout=30) as response:
+                tails = json.loads(response.read())
+                self.state["tails"] = {tail["code"]: tail["hash"] for tail in tails}
+                self.state["etag"] = response.headers.get("ETag")
+                self.state["last_modified"] = response.headers.get("Last-Modified")
+        except HTTPError as e:
+            if e.code != 304:
+                raise
+        self.state["fetched"] = time.time()
+        self.write()
+
+
+    def refresh(self):
+        if self.offline or not self.is_stale():
+            return
+        try:
+            self.fetch()
+        except (URLError, OSError, ValueError, KeyError) as e:
+            print(f'Could not refresh tails from {self.url} ({repr(e)}), using {len(self.state["tails"])} cached tails')
+
+
+    def tails(self) -> Dict[str, str]:
+        self.refresh()
+        return dict(self.state["tails"])
+
+
+def read_tail_csv(path: Path) -> Dict[str, str]:
+    tails = dict()
+    with open(path, "r") as f:
+        for row in csv.reader(f, delimiter=",", quotechar='"'):
+            if len(row) < 2 or row[0].startswith("#"):
+                continue
+            (code, asset_id) = (row[0].strip(), row[1].strip())
+            if len(asset_id) != 64:
+                continue
+            tails[code] = asset_id
+    return tails
+
+
+# later sources win: hard-coded CATS, then the tail database, then CSVs
+def load_cats(cats: Optional[Dict[str, str]] = None, registry: Optional[TailRegistry] = None, csv_paths: List[Path] = TAIL_CSV) -> Dict[str, str]:
+    if registry is None:
+        registry = TailRegistry()
+    merged = dict(cats or {})
+    merged.update(registry.tails())
+    for path in csv_paths:
+        merged.update(read_tail_csv(path))
+    print(f'Loaded {len(merged)} CAT tails')
+    return merged
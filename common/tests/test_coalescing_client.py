@@ -0,0 +1,89 @@
+import asyncio
+
+from coalescing_client import CoalescingClient
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.ints import uint64
+
+import pytest
+
+
+class FakeNodeClient:
+
+    def __init__(self):
+        self.requests = []
+        self.failures = 0
+
+    async def get_coin_record_by_name(self, name):
+        self.requests.append(("get_coin_record_by_name", name))
+        await asyncio.sleep(0.01)
+        if self.failures > 0:
+            self.failures -= 1
+            raise ValueError("node busy")
+        return {"name": name, "request": len(self.requests)}
+
+    async def get_blockchain_state(self):
+        self.requests.append(("get_blockchain_state",))
+        return {"peak": len(self.requests)}
+
+    async def push_tx(self, spend_bundle):
+        return {"success": True}
+
+
+class FakeSpendBundle:
+
+    def __init__(self, removals):
+        self._removals = removals
+
+    def removals(self):
+        return self._removals
+
+
+class TestCoalescingClient:
+
+    @pytest.mark.asyncio
+    async def test_concurrent_lookups_share_one_request(self):
+        node_client = FakeNodeClient()
+        client = CoalescingClient(node_client)
+        name = bytes32(b'\x01' * 32)
+
+        results = await asyncio.gather(*[client.get_coin_record_by_name(name) for _ in range(5)])
+        assert all(result is results[0] for result in results)
+        assert await client.get_coin_record_by_name(name) is results[0]
+        assert len(node_client.requests) == 1
+        assert (client.hits, client.misses) == (5, 1)
+        assert client.report() == 'Coalesced 5 of 6 node lookups (83% hit rate)'
+
+    @pytest.mark.asyncio
+    async def test_other_methods_pass_through(self):
+        node_client = FakeNodeClient()
+        client = CoalescingClient(node_client)
+        assert await client.get_blockchain_state() != await client.get_blockchain_state()
+        assert client.hit_rate() == 0.0
+
+    @pytest.mark.asyncio
+    async def test_failures_are_not_memoized(self):
+        node_client = FakeNodeClient()
+        node_client.failures = 1
+        client = CoalescingClient(node_client)
+        name = bytes32(b'\x01' * 32)
+
+        with pytest.raises(ValueError):
+            await client.get_coin_record_by_name(name)
+        assert (await client.get_coin_record_by_name(name))["name"] == name
+        assert len(node_client.requests) == 2
+
+    @pytest.mark.asyncio
+    async def test_push_forgets_spent_coins(self):
+        node_client = FakeNodeClient()
+        client = CoalescingClient(node_client)
+        coin = Coin(bytes32(b'\x02' * 32), bytes32(b'\x03' * 32), uint64(1))
+        other = bytes32(b'\x04' * 32)
+        await client.get_coin_record_by_name(coin.name())
+        await client.get_coin_record_by_name(other)
+
+        await client.push_tx(FakeSpendBundle([coin]))
+        await client.get_coin_record_by_name(coin.name())
+        await client.get_coin_record_by_name(other)
+        assert [request[1] for request in node_client.requests] == [coin.name(), other, coin.name()]
@@ -0,0 +1,76 @@
+import pytest
+
+import coin_lookup
+from coin_lookup import get_coin_records_by_hints, get_coin_records_by_puzzle_hashes
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.util.ints import uint32, uint64
+
+
+def coin_record(puzzle_hash: bytes32, amount: int) -> CoinRecord:
+    coin = Coin(bytes32(b'\x01' * 32), puzzle_hash, uint64(amount))
+    return CoinRecord(coin, uint32(1), uint32(0), False, uint64(0))
+
+
+class FakeNodeClient:
+
+    def __init__(self, coin_records, hints, bulk_hints=True):
+        self.coin_records = coin_records
+        self.hints = hints
+        self.bulk_hints = bulk_hints
+        self.requests = []
+
+    async def get_coin_records_by_puzzle_hashes(self, puzzle_hashes, include_spent_coins=True, start_height=None, end_height=None):
+        self.requests.append(("get_coin_records_by_puzzle_hashes", len(puzzle_hashes)))
+        return [cr for cr in self.coin_records if cr.coin.puzzle_hash in puzzle_hashes]
+
+    async def get_coin_records_by_hint(self, hint, include_spent_coins=True, start_height=None, end_height=None):
+        self.requests.append(("get_coin_records_by_hint", 1))
+        return [cr for cr in self.coin_records if self.hints.get(cr.coin.name()) == hint]
+
+    async def fetch(self, path, request_json):
+        self.requests.append((path, len(request_json["hints"])))
+        if not self.bulk_hints:
+            raise ValueError({"success": False, "error": f"No route: {path}"})
+        hints = [bytes32.from_hexstr(hint) for hint in request_json["hints"]]
+        return {"coin_records": [dict(cr.to_json_dict(), spent=cr.spent) for cr in self.coin_records if self.hints.get(cr.coin.name()) in hints]}
+
+
+class TestCoinLookup:
+
+    @pytest.fixture(autouse=True)
+    def bulk_hints(self, monkeypatch):
+        monkeypatch.setattr(coin_lookup, "bulk_hints_supported", True)
+
+    @pytest.mark.asyncio
+    async def test_puzzle_hashes_are_chunked_and_mapped_back(self):
+        puzzle_hashes = [bytes32(bytes([i]) * 32) for i in range(5)]
+        node_client = FakeNodeClient([coin_record(puzzle_hashes[1], 10), coin_record(puzzle_hashes[4], 20), coin_record(puzzle_hashes[4], 30)], {})
+
+        coin_records = await get_coin_records_by_puzzle_hashes(node_client, puzzle_hashes, chunk_size=2)
+        assert node_client.requests == [("get_coin_records_by_puzzle_hashes", 2)] * 2 + [("get_coin_records_by_puzzle_hashes", 1)]
+        assert list(coin_records.keys()) == puzzle_hashes
+        assert [cr.coin.amount for cr in coin_records[puzzle_hashes[4]]] == [20, 30]
+        assert coin_records[puzzle_hashes[0]] == []
+
+    @pytest.mark.asyncio
+    async def test_hints_in_bulk(self):
+        hint = bytes32(b'\x02' * 32)
+        hinted = coin_record(bytes32(b'\x03' * 32), 1)
+        node_client = FakeNodeClient([hinted, coin_record(bytes32(b'\x04' * 32), 2)], {hinted.coin.name(): hint})
+
+        assert await get_coin_records_by_hints(node_client, [hint, hint, bytes32(b'\x05' * 32)]) == [hinted]
+        assert node_client.requests == [("get_coin_records_by_hints", 2)]
+
+    @pytest.mark.asyncio
+    async def test_hints_fall_back_to_one_request_each(self):
+        hint = bytes32(b'\x02' * 32)
+        hinted = coin_record(bytes32(b'\x03' * 32), 1)
+        node_client = FakeNodeClient([hinted], {hinted.coin.name(): hint}, bulk_hints=False)
+
+        assert await get_coin_records_by_hints(node_client, [hint, bytes32(b'\x05' * 32)]) == [hinted]
+        assert await get_coin_records_by_hints(node_client, [hint]) == [hinted]
+        # the bulk endpoint is only tried once
+        assert [path for path, _ in node_client.requests] == ["get_coin_records_by_hints"] + ["get_coin_records_by_hint"] * 3
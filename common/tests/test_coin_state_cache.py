@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+
+from coin_state_cache import CoinStateCache
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.util.ints import uint32, uint64
+
+import pytest
+
+PUZZLE_HASH = bytes32(b'\x03' * 32)
+
+
+def coin_record(parent: int, spent_block_index: int = 0) -> CoinRecord:
+    coin = Coin(bytes32(bytes([parent]) * 32), PUZZLE_HASH, uint64(1))
+    return CoinRecord(coin, uint32(1), uint32(spent_block_index), False, uint64(0))
+
+
+class FakeNodeClient:
+
+    def __init__(self, coin_records):
+        self.height = 10
+        self.coin_records = {coin_record.coin.name(): coin_record for coin_record in coin_records}
+        self.requests = []
+
+    async def get_blockchain_state(self):
+        return {"peak": SimpleNamespace(height=self.height)}
+
+    async def get_coin_record_by_name(self, name):
+        self.requests.append(name)
+        return self.coin_records[name]
+
+    async def get_coin_records_by_puzzle_hashes(self, puzzle_hashes, include_spent_coins=True, start_height=None, end_height=None):
+        self.requests.append(tuple(puzzle_hashes))
+        return [cr for cr in self.coin_records.values() if cr.coin.puzzle_hash in puzzle_hashes]
+
+    async def get_fee_estimate(self, target_times, cost):
+        self.requests.append(("fee", self.height))
+        return {"estimates": [cost * 5 for _ in target_times]}
+
+    async def push_tx(self, spend_bundle):
+        return {"success": True}
+
+
+class FakeSpendBundle:
+
+    def __init__(self, removals, additions):
+        self._removals = removals
+        self._additions = additions
+
+    def removals(self):
+        return self._removals
+
+    def additions(self):
+        return self._additions
+
+
+class TestCoinStateCache:
+
+    @pytest.mark.asyncio
+    async def test_unspent_records_last_until_the_next_peak(self):
+        unspent = coin_record(1)
+        node_client = FakeNodeClient([unspent])
+        cache = CoinStateCache(node_client, peak_check_interval=0)
+
+        await cache.get_coin_record_by_name(unspent.coin.name())
+        await cache.get_coin_records_by_puzzle_hashes([PUZZLE_HASH], False)
+        await cache.get_coin_record_by_name(unspent.coin.name())
+        await cache.get_coin_records_by_puzzle_hashes([PUZZLE_HASH], False)
+        assert len(node_client.requests) == 2
+
+        node_client.height = 11
+        await cache.get_coin_record_by_name(unspent.coin.name())
+        await cache.get_coin_records_by_puzzle_hashes([PUZZLE_HASH], False)
+        assert len(node_client.requests) == 4
+        assert cache.peak_height == 11
+
+    @pytest.mark.asyncio
+    async def test_spent_records_are_permanent(self):
+        spent = coin_record(2, spent_block_index=5)
+        node_client = FakeNodeClient([spent])
+        cache = CoinStateCache(node_client, peak_check_interval=0)
+
+        await cache.get_coin_record_by_name(spent.coin.name())
+        node_client.height = 12
+        assert await cache.get_coin_record_by_name(spent.coin.name()) == spent
+        assert node_client.requests == [spent.coin.name()]
+
+    @pytest.mark.asyncio
+    async def test_push_forgets_touched_coins(self):
+        pushed = coin_record(1)
+        other = Coin(bytes32(b'\x04' * 32), bytes32(b'\x05' * 32), uint64(1))
+        node_client = FakeNodeClient([pushed, CoinRecord(other, uint32(1), uint32(0), False, uint64(0))])
+        cache = CoinStateCache(node_client)
+
+        await cache.get_blockchain_state()
+        await cache.get_coin_record_by_name(pushed.coin.name())
+        await cache.get_coin_record_by_name(other.name())
+        await cache.get_coin_records_by_puzzle_hashes([PUZZLE_HASH], False)
+        await cache.push_tx(FakeSpendBundle([pushed.coin], []))
+
+        await cache.get_coin_record_by_name(pushed.coin.name())
+        await cache.get_coin_record_by_name(other.name())
+        await cache.get_coin_records_by_puzzle_hashes([PUZZLE_HASH], False)
+        assert node_client.requests == [pushed.coin.name(), other.name(), (PUZZLE_HASH,), pushed.coin.name(), (PUZZLE_HASH,)]
+
+    @pytest.mark.asyncio
+    async def test_fee_estimates_last_until_the_next_peak(self):
+        node_client = FakeNodeClient([])
+        cache = CoinStateCache(node_client, peak_check_interval=0)
+
+        await cache.get_fee_estimate([120], 1000)
+        await cache.push_tx(FakeSpendBundle([], []))
+        await cache.get_fee_estimate([120], 1000)
+        node_client.height = 11
+        await cache.get_fee_estimate([120], 1000)
+        assert node_client.requests == [("fee", 10), ("fee", 11)]
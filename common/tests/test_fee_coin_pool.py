@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+from fee_coin_pool import FeeCoinPool
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+
+import pytest
+
+PUZZLE_HASH = bytes32(b'\x03' * 32)
+
+
+def split_coins(pool: FeeCoinPool):
+    return [Coin(bytes32(b'\x01' * 32), payment.puzzle_hash, payment.amount) for payment in pool.split_payments(PUZZLE_HASH)]
+
+
+class FakeNodeClient:
+
+    def __init__(self, unspent, spent):
+        self.unspent = set(coin.name() for coin in unspent)
+        self.spent = set(coin.name() for coin in spent)
+
+    async def get_coin_records_by_names(self, names, include_spent_coins=True, start_height=None, end_height=None):
+        return [SimpleNamespace(name=name, spent=name in self.spent) for name in names if name in self.unspent | self.spent]
+
+
+class TestFeeCoinPool:
+
+    def test_split_coins_are_distinct(self, tmp_path):
+        pool = FeeCoinPool("test", tmp_path, size=5, coin_amount=100)
+        coins = split_coins(pool)
+        assert len(set(coin.name() for coin in coins)) == 5
+        assert sorted(coin.amount for coin in coins) == [100, 101, 102, 103, 104]
+
+    def test_reservations_do_not_overlap_and_persist(self, tmp_path):
+        pool = FeeCoinPool("test", tmp_path, size=5, coin_amount=100)
+        pool.add(split_coins(pool), confirmed=True)
+
+        first = pool.reserve(150)
+        second = pool.reserve(50)
+        assert [coin.amount for coin in first] == [100, 101]
+        assert [coin.amount for coin in second] == [102]
+
+        # another run sees the same reservations
+        reloaded = FeeCoinPool("test", tmp_path, size=5, coin_amount=100)
+        assert sorted(coin.amount for coin in reloaded.free()) == [103, 104]
+        with pytest.raises(ValueError):
+            reloaded.reserve(300)
+
+        reloaded.release(first[:1], first[1:])
+        assert sorted(coin.amount for coin in reloaded.free()) == [100, 103, 104]
+        assert len(reloaded.coins()) == 4
+
+    @pytest.mark.asyncio
+    async def test_refresh_follows_the_chain(self, tmp_path):
+        pool = FeeCoinPool("test", tmp_path, size=4, coin_amount=100, low_water=3, reservation_seconds=60)
+        coins = split_coins(pool)
+        pool.add(coins)
+        assert pool.free() == []
+        assert not pool.needs_split()
+
+        # the split confirmed and one coin was spent since
+        await pool.refresh(FakeNodeClient(coins[1:], coins[:1]))
+        assert pool.free() == coins[1:]
+        reserved = pool.reserve(1)
+        assert pool.needs_split()
+
+        # reservations left behind by a run that stopped run out
+        pool.entries[reserved[0].name().hex()]["reserved"] -= 60
+        pool.save()
+        await pool.refresh(FakeNodeClient(coins[1:], coins[:1]))
+        assert pool.free() == coins[1:]
+
+    @pytest.mark.asyncio
+    async def test_splits_that_never_confirm_are_forgotten(self, tmp_path):
+        pool = FeeCoinPool("test", tmp_path, size=2, coin_amount=100, reservation_seconds=60)
+        pool.add(split_coins(pool))
+        await pool.refresh(FakeNodeClient([], []))
+        assert len(pool.coins()) == 2
+
+        for entry in pool.entries.values():
+            entry["since"] -= 60
+        pool.save()
+        await pool.refresh(FakeNodeClient([], []))
+        assert pool.coins() == []
+
+    def test_runs_sharing_the_pool_see_each_others_reservations(self, tmp_path):
+        ours = FeeCoinPool("test", tmp_path, size=3, coin_amount=100)
+        theirs = FeeCoinPool("test", tmp_path, size=3, coin_amount=100)
+        coins = split_coins(ours)
+        ours.add(coins, confirmed=True)
+
+        # theirs was loaded before the coins were added and still reserves from the file
+        assert theirs.reserve(100) == coins[:1]
+        assert ours.reserve(100) == coins[1:2]
+        theirs.release(coins[:1])
+        assert sorted(coin.amount for coin in FeeCoinPool("test", tmp_path).free()) == [100, 102]
+        assert sorted(coin.amount for coin in ours.free()) == [100, 102]
@@ -0,0 +1,233 @@
+from types import SimpleNamespace
+
+from fee_coin_pool import FeeCoinPool
+from fee_payer import FeePayer
+from spend_cost import spend_bundle_cost
+from spend_pipeline import SpendExport, read_spend_file
+
+from blspy import AugSchemeMPL, G2Element
+
+from chia.types.announcement import Announcement
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.types.condition_opcodes import ConditionOpcode
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint64
+from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import puzzle_for_pk
+from chia.wallet.util.tx_config import CoinSelectionConfig
+
+import pytest
+
+FEE_PUZZLE = puzzle_for_pk(AugSchemeMPL.key_gen(bytes(32)).get_g1())
+ANNOUNCE = Program.to([[ConditionOpcode.CREATE_COIN_ANNOUNCEMENT, b'']])
+
+
+def fee_coin(n: int, amount: int, puzzle: Program = FEE_PUZZLE) -> Coin:
+    return Coin(bytes32(bytes([n]) * 32), puzzle.get_tree_hash(), uint64(amount))
+
+
+# one announcing spend of an anyone-can-spend coin, the shape of a royalty or timelock spend
+def unpaid_spend(n: int = 1, amount: int = 1) -> SpendBundle:
+    puzzle = Program.to(1)
+    return SpendBundle([CoinSpend(Coin(bytes32(bytes([n]) * 32), puzzle.get_tree_hash(), uint64(amount)), puzzle, ANNOUNCE)], G2Element())
+
+
+async def sign_coin_spends(coin_spends):
+    return SpendBundle(coin_spends, G2Element())
+
+
+def estimates(per_cost: int):
+    async def get_fee_estimate(target_times, cost):
+        return {"estimates": [per_cost * cost for _ in target_times]}
+    return SimpleNamespace(get_fee_estimate=get_fee_estimate)
+
+
+class FakeWalletClient:
+
+    def __init__(self, coins):
+        self.coins = coins
+        self.configs = []
+
+    # same signature as WalletRpcClient.select_coins, anything else is rejected
+    async def select_coins(self, amount: int, wallet_id: int, coin_selection_config: CoinSelectionConfig):
+        self.configs.append(coin_selection_config)
+        excluded = set(coin_selection_config.excluded_coin_ids)
+        return [coin for coin in self.coins if coin.name() not in excluded][:1]
+
+
+@pytest.fixture
+def fee_payer(tmp_path):
+    fee_payer = FeePayer("test", SimpleNamespace(get=lambda puzzle_hash: FEE_PUZZLE), 1, 100000000, fee_coin_pool=FeeCoinPool("test", tmp_path))
+    fee_payer.signer = SimpleNamespace(sign_coin_spends=sign_coin_spends)
+    return fee_payer
+
+
+class TestFeePayer:
+
+    def test_fee_spend_asserts_every_peer_spend(self, fee_payer):
+        peer_coin_spends = [
+            CoinSpend(Coin(bytes32(bytes([n]) * 32), bytes32(b'\x02' * 32), uint64(n)), Program.to(1), Program.to([]))
+            for n in range(1, 4)
+        ]
+
+        change_spend = fee_payer.calculate_change_spend(fee_coin(7, 100), uint64(10), peer_coin_spends)
+        conditions = change_spend.puzzle_reveal.to_program().run(change_spend.solution.to_program()).as_python()
+        asserted = [condition[1] for condition in conditions if condition[0] == ConditionOpcode.ASSERT_COIN_ANNOUNCEMENT]
+        assert asserted == [Announcement(coin_spend.coin.name(), b'').name() for coin_spend in peer_coin_spends]
+
+    @pytest.mark.asyncio
+    async def test_fees_pay_for_the_fee_spend_too(self, fee_payer):
+        fee_payer.fee_coin_pool.add([fee_coin(7, 100000000)], confirmed=True)
+
+        async def select_coins(**kwargs):
+            raise AssertionError("fee coins come from the pool")
+
+        unpaid = unpaid_spend()
+        spend_bundle = await fee_payer.add_fees_and_sign_spend_bundle(unpaid, estimates(1), SimpleNamespace(select_coins=select_coins))
+        assert fee_payer.fee_coin_pool.free() == []
+        fees = spend_bundle.fees()
+        # one mojo per cost, on the cost of the whole bundle rather than just the unpaid spend
+        assert fees > spend_bundle_cost(unpaid) * 2
+        assert abs(fees - spend_bundle_cost(spend_bundle)) < 100000
+
+    @pytest.mark.asyncio
+    async def test_fees_are_paid_from_a_change_spend(self, fee_payer):
+        fee_payer.fee_coin_pool.add([fee_coin(3, 100000)], confirmed=True)
+
+        spend_bundle = await fee_payer.add_fees_and_sign_spend_bundle(unpaid_spend(amount=0), estimates(0), None, min_fees=2000)
+        assert spend_bundle.fees() == 2000
+        # the rest of the fee coin comes back as change to the same puzzle hash
+        assert [(coin.puzzle_hash, coin.amount) for coin in spend_bundle.additions()] == [(FEE_PUZZLE.get_tree_hash(), 98000)]
+        assert fee_payer.fee_coin_pool.free() == []
+
+    @pytest.mark.asyncio
+    async def test_fee_change_goes_back_in_the_pool(self, fee_payer):
+        fee_payer.fee_coin_pool.add([fee_coin(3, 100000)], confirmed=True)
+
+        async def get_blockchain_state():
+            return {"peak": SimpleNamespace(height=10)}
+
+        async def push_tx(spend_bundle):
+            return {"success": True}
+
+        node_client = SimpleNamespace(get_fee_estimate=estimates(0).get_fee_estimate, get_blockchain_state=get_blockchain_state, push_tx=push_tx)
+        unpaid = unpaid_spend(amount=0)
+        spend_bundle = await fee_payer.add_fees_and_sign_spend_bundle(unpaid, node_client, None, min_fees=2000)
+        await fee_payer.push_spend_bundle(node_client, spend_bundle, unpaid)
+
+        change = Coin(fee_coin(3, 100000).name(), FEE_PUZZLE.get_tree_hash(), uint64(98000))
+        assert sorted(coin.amount for coin in fee_payer.fee_coin_pool.coins()) == [98000, 100000]
+        # only handed out once the bundle confirms and a refresh sees the change coin
+        assert change in fee_payer.fee_coin_pool.coins()
+        assert fee_payer.fee_coin_pool.free() == []
+
+    @pytest.mark.asyncio
+    async def test_rebuilds_reserve_more_coins_when_the_fee_outgrows_them(self, fee_payer):
+        spent_fee_coin = fee_coin(7, 1000)
+        fee_payer.fee_coin_pool.add([spent_fee_coin], confirmed=True, reserved=True)
+        unpaid = unpaid_spend()
+
+        # nothing free in the pool and no wallet to ask, the rebuild fails rather than paying less
+        with pytest.raises(ValueError):
+            await fee_payer.rebuild_with_fees(estimates(0), unpaid, [spent_fee_coin], uint64(3000))
+
+        fee_payer.fee_coin_pool.add([fee_coin(8, 5000)], confirmed=True)
+        spend_bundle = await fee_payer.rebuild_with_fees(estimates(0), unpaid, [spent_fee_coin], uint64(3000))
+        # the unpaid coin's own mojo goes to fees too
+        assert spend_bundle.fees() == 3001
+        # the replacement still spends the coin of the bundle it replaces
+        assert [coin_spend.coin for coin_spend in spend_bundle.coin_spends[1:]] == [spent_fee_coin, fee_coin(8, 5000)]
+        assert fee_payer.fee_coin_pool.free() == []
+
+    @pytest.mark.asyncio
+    async def test_wallet_coins_skip_the_pool_and_pending_bundles(self, fee_payer):
+        pooled = fee_coin(1, 10)
+        fee_payer.fee_coin_pool.add([pooled], confirmed=True, reserved=True)
+        wallet_client = FakeWalletClient([pooled, fee_coin(2, 1000)])
+
+        assert await fee_payer.reserve_fee_coins(wallet_client, 500) == [fee_coin(2, 1000)]
+        assert wallet_client.configs[0].excluded_coin_ids == [pooled.name()]
+        # the wallet coin is now held by the pool for this bundle
+        assert fee_payer.fee_coin_pool.free() == []
+        assert fee_coin(2, 1000) in fee_payer.fee_coin_pool.coins()
+
+    @pytest.mark.asyncio
+    async def test_exported_bundles_take_their_fee_coins_out_of_the_pool(self, fee_payer, tmp_path):
+        puzzle = Program.to(1)
+        exported_fee_coin = fee_coin(7, 1000, puzzle)
+        fee_payer.fee_coin_pool.add([exported_fee_coin], confirmed=True, reserved=True)
+        fee_payer.signer = SpendExport(tmp_path / "unsigned.jsonl")
+        unpaid = SpendBundle([CoinSpend(fee_coin(1, 1, puzzle), puzzle, Program.to([]))], G2Element())
+        spend_bundle = SpendBundle(unpaid.coin_spends + [CoinSpend(exported_fee_coin, puzzle, Program.to([]))], G2Element())
+
+        status = await fee_payer.push_spend_bundle(None, spend_bundle, unpaid)
+        await fee_payer.signer.close()
+        assert status["status"] == "EXPORTED"
+        # nothing on the node to track, the export file holds the fee coin from now on
+        assert fee_payer.submissions.submissions == []
+        assert fee_payer.fee_coin_pool.coins() == []
+        assert next(read_spend_file(tmp_path / "unsigned.jsonl"))["fee_coins"] == [exported_fee_coin.name().hex()]
+
+    @pytest.mark.asyncio
+    async def test_exported_bundles_never_share_a_wallet_fee_coin(self, fee_payer, tmp_path):
+        fee_payer.signer = SpendExport(tmp_path / "unsigned.jsonl")
+        wallet_client = FakeWalletClient([fee_coin(2, 100000), fee_coin(3, 100000)])
+
+        for n in (1, 2):
+            unpaid = unpaid_spend(n)
+            spend_bundle = await fee_payer.add_fees_and_sign_spend_bundle(unpaid, estimates(0), wallet_client, min_fees=2000)
+            await fee_payer.push_spend_bundle(None, spend_bundle, unpaid)
+        await fee_payer.signer.close()
+
+        # nothing was pushed, the first bundle's fee coin is still unspent as far as the wallet knows
+        assert [record["fee_coins"] for record in read_spend_file(tmp_path / "unsigned.jsonl")] == [[fee_coin(2, 100000).name().hex()], [fee_coin(3, 100000).name().hex()]]
+        assert fee_payer.fee_coin_pool.coins() == []
+
+    def test_split_spends_create_the_fee_coins(self, fee_payer, tmp_path):
+        funding_coins = [fee_coin(n, 300) for n in (1, 2)]
+        payments = FeeCoinPool("split", tmp_path, size=3, coin_amount=100).split_payments(FEE_PUZZLE.get_tree_hash())
+
+        spend_bundle = SpendBundle(fee_payer.calculate_split_spends(funding_coins, payments), G2Element())
+        spend_bundle_cost(spend_bundle)
+        assert sorted(coin.amount for coin in spend_bundle.additions()) == [100, 101, 102, 297]
+        assert spend_bundle.fees() == 0
+
+    @pytest.mark.asyncio
+    async def test_top_up_splits_a_wallet_coin_into_the_pool(self, fee_payer, monkeypatch):
+        fee_payer.fee_coin_pool.size = 3
+        fee_payer.fee_coin_pool.coin_amount = 100
+        pushed = []
+
+        async def push_tx(spend_bundle):
+            pushed.append(spend_bundle)
+            return {"success": True}
+
+        async def get_blockchain_state():
+            return {"peak": SimpleNamespace(height=10)}
+
+        async def refresh(node_client):
+            pass
+
+        monkeypatch.setattr(fee_payer.fee_coin_pool, "refresh", refresh)
+        wallet_client = FakeWalletClient([fee_coin(4, 1000)])
+        await fee_payer.top_up_fee_coins(SimpleNamespace(push_tx=push_tx, get_blockchain_state=get_blockchain_state), wallet_client)
+
+        assert len(pushed) == 1
+        assert isinstance(wallet_client.configs[0], CoinSelectionConfig)
+        assert sorted(coin.amount for coin in pushed[0].additions()) == [100, 101, 102, 697]
+        assert sorted(coin.amount for coin in fee_payer.fee_coin_pool.coins()) == [100, 101, 102]
+
+    @pytest.mark.asyncio
+    async def test_exporting_runs_do_not_split_fee_coins(self, fee_payer, tmp_path):
+        fee_payer.signer = SpendExport(tmp_path / "unsigned.jsonl")
+        wallet_client = FakeWalletClient([fee_coin(4, 1000)])
+
+        await fee_payer.top_up_fee_coins(None, wallet_client)
+        await fee_payer.signer.close()
+
+        # the funding coin is never picked, nor written out for a split that could fund nothing this run
+        assert wallet_client.configs == []
+        assert list(read_spend_file(tmp_path / "unsigned.jsonl")) == []
+        assert fee_payer.fee_coin_pool.coins() == []
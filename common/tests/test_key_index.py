@@ -0,0 +1,186 @@
+from blspy import AugSchemeMPL
+
+import key_index
+from key_index import KeyIndex, PuzzleReveals
+
+from chia.wallet.derive_keys import master_sk_to_wallet_sk, master_sk_to_wallet_sk_unhardened
+from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
+    DEFAULT_HIDDEN_PUZZLE_HASH,
+    calculate_synthetic_secret_key,
+    puzzle_for_pk,
+    puzzle_hash_for_pk,
+)
+
+import pytest
+
+MASTER_SK = AugSchemeMPL.key_gen(bytes([7] * 32))
+OTHER_MASTER_SK = AugSchemeMPL.key_gen(bytes([8] * 32))
+
+class TestKeyIndex:
+
+    def test_entries_match_wallet_derivation(self, tmp_path):
+        index = KeyIndex(MASTER_SK, tmp_path)
+        index.load(5, hardened=False)
+        index.load(5, hardened=True)
+
+        entries = list(index.entries())
+        assert len(entries) == 10
+        for entry in entries:
+            if entry.hardened:
+                sk = master_sk_to_wallet_sk(MASTER_SK, entry.index)
+            else:
+                sk = master_sk_to_wallet_sk_unhardened(MASTER_SK, entry.index)
+            assert entry.public_key() == sk.get_g1()
+            assert entry.puzzle_hash == puzzle_hash_for_pk(sk.get_g1())
+            assert index.secret_key(entry) == sk
+        index.close()
+
+    def test_warm_start_only_derives_missing_tail(self, tmp_path, monkeypatch):
+        index = KeyIndex(MASTER_SK, tmp_path)
+        assert index.load(4) == 4
+        index.close()
+
+        ranges = []
+        derive_records = key_index.derive_records
+        def recording_derive_records(master_sk, hardened, start, end):
+            ranges.append((start, end))
+            return derive_records(master_sk, hardened, start, end)
+        monkeypatch.setattr(key_index, "derive_records", recording_derive_records)
+
+        index = KeyIndex(MASTER_SK, tmp_path)
+        assert index.load(4) == 0
+        assert index.load(7) == 3
+        assert ranges == [(4, 7)]
+        assert [entry.index for entry in index.entries()] == list(range(7))
+        index.close()
+
+    def test_concurrent_indexes_do_not_append_twice(self, tmp_path):
+        # both opened before either derived anything, as two processes starting at once would be
+        first = KeyIndex(MASTER_SK, tmp_path)
+        second = KeyIndex.observer(MASTER_SK.get_g1(), tmp_path)
+        first.load(0)
+        second.load(0)
+
+        assert first.load(5) == 5
+        assert second.load(5) == 0
+        assert second.load(6) == 1
+        assert (tmp_path / f"{first.fingerprint}_unhardened.idx").stat().st_size == key_index.HEADER.size + 6 * key_index.RECORD.size
+        assert [entry.index for entry in second.entries()] == list(range(6))
+        first.close()
+        second.close()
+
+    def test_index_for_other_key_is_discarded(self, tmp_path):
+        index = KeyIndex(MASTER_SK, tmp_path)
+        index.load(3)
+        index.close()
+
+        # same file name, different master key
+        (tmp_path / f"{OTHER_MASTER_SK.get_g1().get_fingerprint()}_unhardened.idx").write_bytes((tmp_path / f"{index.fingerprint}_unhardened.idx").read_bytes())
+        other = KeyIndex(OTHER_MASTER_SK, tmp_path)
+        assert other.load(3) == 3
+        assert next(other.entries()).public_key() == master_sk_to_wallet_sk_unhardened(OTHER_MASTER_SK, 0).get_g1()
+        other.close()
+
+    def test_torn_record_is_dropped(self, tmp_path):
+        index = KeyIndex(MASTER_SK, tmp_path)
+        index.load(3)
+        index.close()
+        path = tmp_path / f"{index.fingerprint}_unhardened.idx"
+        path.write_bytes(path.read_bytes()[:-10])
+
+        index = KeyIndex(MASTER_SK, tmp_path)
+        assert index.load(3) == 1
+        assert [entry.index for entry in index.entries()] == [0, 1, 2]
+        index.close()
+
+    def test_parallel_derivation_matches_serial(self):
+        for hardened in (False, True):
+            serial = key_index.derive_records(MASTER_SK, hardened, 3, 20)
+            parallel = key_index.derive_records_parallel(MASTER_SK, hardened, 3, 20, workers=2, chunk_size=4)
+            assert parallel == serial
+
+    def test_find_synthetic_secret_key(self, tmp_path):
+        index = KeyIndex(MASTER_SK, tmp_path)
+        index.load(3)
+        synth_sk = calculate_synthetic_secret_key(master_sk_to_wallet_sk_unhardened(MASTER_SK, 2), DEFAULT_HIDDEN_PUZZLE_HASH)
+        assert index.find_synthetic_secret_key(synth_sk.get_g1()) == synth_sk
+        assert index.find_synthetic_secret_key(OTHER_MASTER_SK.get_g1()) is None
+        index.close()
+
+    def test_find_synthetic_secret_key_after_extending(self, tmp_path, monkeypatch):
+        index = KeyIndex(MASTER_SK, tmp_path)
+        index.load(3, hardened=False)
+        index.load(3, hardened=True)
+        hardened_sk = calculate_synthetic_secret_key(master_sk_to_wallet_sk(MASTER_SK, 5), DEFAULT_HIDDEN_PUZZLE_HASH)
+        assert index.find_synthetic_secret_key(hardened_sk.get_g1()) is None
+
+        index.load(6, hardened=True)
+        assert index.find_synthetic_secret_key(hardened_sk.get_g1()) == hardened_sk
+
+        # second lookup is served from the memoized map
+        monkeypatch.setattr(index, "secret_key", None)
+        assert index.find_synthetic_secret_key(hardened_sk.get_g1()) == hardened_sk
+        index.close()
+
+    def test_entry_for_puzzle_hash(self, tmp_path):
+        index = KeyIndex(MASTER_SK, tmp_path)
+        index.load(4)
+        puzzle_hash = puzzle_hash_for_pk(master_sk_to_wallet_sk_unhardened(MASTER_SK, 3).get_g1())
+        entry = index.entry_for_puzzle_hash(puzzle_hash)
+        assert entry.index == 3 and not entry.hardened
+        assert entry.puzzle_hash == puzzle_hash
+        index.close()
+
+    def test_puzzle_reveals_across_key_indexes(self, tmp_path):
+        index = KeyIndex(MASTER_SK, tmp_path)
+        index.load(2)
+        other = KeyIndex(OTHER_MASTER_SK, tmp_path)
+        other.load(2)
+        puzzle_reveals = PuzzleReveals([index, other])
+
+        pk = master_sk_to_wallet_sk_unhardened(OTHER_MASTER_SK, 1).get_g1()
+        puzzle = puzzle_reveals.get(puzzle_hash_for_pk(pk))
+        assert puzzle == puzzle_for_pk(pk)
+        assert puzzle_reveals[puzzle_hash_for_pk(pk)] is puzzle
+
+        unknown = puzzle_hash_for_pk(master_sk_to_wallet_sk_unhardened(MASTER_SK, 2).get_g1())
+        assert puzzle_reveals.get(unknown) is None
+        assert unknown not in puzzle_reveals
+        with pytest.raises(KeyError):
+            puzzle_reveals[unknown]
+
+        index.load(3)
+        assert unknown in puzzle_reveals
+        index.close()
+        other.close()
+
+    def test_observer_index_matches_private_key_index(self, tmp_path):
+        index = KeyIndex(MASTER_SK, tmp_path / "private")
+        index.load(6)
+        observer = KeyIndex.observer(MASTER_SK.get_g1(), tmp_path / "observer")
+        assert observer.is_observer
+        observer.load(6)
+        assert list(observer.entries()) == list(index.entries())
+
+        with pytest.raises(RuntimeError):
+            observer.load(1, hardened=True)
+        with pytest.raises(RuntimeError):
+            observer.secret_key(next(observer.entries()))
+        index.close()
+        observer.close()
+
+    def test_observer_parallel_derivation_matches_serial(self):
+        serial = key_index.derive_records(MASTER_SK, False, 0, 9)
+        parallel = key_index.derive_records_parallel(MASTER_SK.get_g1(), False, 0, 9, workers=2, chunk_size=4)
+        assert parallel == serial
+
+    def test_observer_reads_hardened_keys_indexed_by_private_key(self, tmp_path):
+        index = KeyIndex(MASTER_SK, tmp_path)
+        index.load(4, hardened=True)
+        observer = KeyIndex.observer(MASTER_SK.get_g1(), tmp_path)
+        assert observer.load(4, hardened=True) == 0
+        assert list(observer.entries(hardened=True)) == list(index.entries(hardened=True))
+        with pytest.raises(RuntimeError):
+            observer.load(5, hardened=True)
+        index.close()
+        observer.close()
@@ -0,0 +1,113 @@
+from lineage_cache import RECORD, LineageProofCache
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.types.coin_spend import CoinSpend
+from chia.util.ints import uint32, uint64
+from chia.wallet.cat_wallet.cat_utils import CAT_MOD, construct_cat_puzzle
+from chia.wallet.lineage_proof import LineageProof
+
+import pytest
+
+TAIL = bytes32(b'\x05' * 32)
+
+
+class FakeNodeClient:
+
+    def __init__(self):
+        self.inner_puzzles = dict()
+        self.coin_records = dict()
+        self.requests = 0
+
+    def add_parent(self, n: int) -> bytes32:
+        inner_puzzle = Program.to(n)
+        coin = Coin(bytes32(bytes([n]) * 32), construct_cat_puzzle(CAT_MOD, TAIL, inner_puzzle).get_tree_hash(), uint64(n * 1000))
+        self.inner_puzzles[coin.name()] = inner_puzzle
+        self.coin_records[coin.name()] = CoinRecord(coin, uint32(1), uint32(2), False, uint64(0))
+        return coin.name()
+
+    def expected(self, parent_coin_id: bytes32) -> LineageProof:
+        coin = self.coin_records[parent_coin_id].coin
+        return LineageProof(coin.parent_coin_info, self.inner_puzzles[parent_coin_id].get_tree_hash(), coin.amount)
+
+    async def get_coin_record_by_name(self, name):
+        self.requests += 1
+        return self.coin_records[name]
+
+    async def get_puzzle_and_solution(self, coin_id, height):
+        self.requests += 1
+        coin = self.coin_records[coin_id].coin
+        return CoinSpend(coin, construct_cat_puzzle(CAT_MOD, TAIL, self.inner_puzzles[coin_id]), Program.to([]))
+
+
+class TestLineageProofCache:
+
+    @pytest.mark.asyncio
+    async def test_parents_are_fetched_once(self, tmp_path):
+        node_client = FakeNodeClient()
+        parent_coin_id = node_client.add_parent(1)
+        cache = LineageProofCache(tmp_path / "lineage.bin")
+
+        assert await cache.lineage_proof(node_client, parent_coin_id) == node_client.expected(parent_coin_id)
+        assert await cache.lineage_proof(node_client, parent_coin_id) == node_client.expected(parent_coin_id)
+        assert node_client.requests == 2
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    @pytest.mark.asyncio
+    async def test_rerun_reads_from_disk(self, tmp_path):
+        node_client = FakeNodeClient()
+        parent_coin_ids = [node_client.add_parent(n) for n in range(1, 4)]
+        cache = LineageProofCache(tmp_path / "lineage.bin")
+        for parent_coin_id in parent_coin_ids:
+            await cache.lineage_proof(node_client, parent_coin_id)
+
+        node_client.requests = 0
+        cache = LineageProofCache(tmp_path / "lineage.bin", size=2)
+        for parent_coin_id in parent_coin_ids:
+            assert await cache.lineage_proof(node_client, parent_coin_id) == node_client.expected(parent_coin_id)
+        assert node_client.requests == 0
+        # least recently used proof was evicted from memory, still on disk
+        assert list(cache.proofs.keys()) == parent_coin_ids[1:]
+        assert cache.get(parent_coin_ids[0]) == node_client.expected(parent_coin_ids[0])
+
+    @pytest.mark.asyncio
+    async def test_torn_record_is_replaced(self, tmp_path):
+        node_client = FakeNodeClient()
+        first = node_client.add_parent(1)
+        second = node_client.add_parent(2)
+        path = tmp_path / "lineage.bin"
+        await LineageProofCache(path).lineage_proof(node_client, first)
+        await LineageProofCache(path).lineage_proof(node_client, second)
+        path.write_bytes(path.read_bytes()[:-10])
+
+        cache = LineageProofCache(path)
+        assert cache.get(second) is None
+        await cache.lineage_proof(node_client, second)
+        assert path.stat().st_size == 2 * RECORD.size
+        assert LineageProofCache(path).get(second) == node_client.expected(second)
+        assert LineageProofCache(path).get(first) == node_client.expected(first)
+
+    @pytest.mark.asyncio
+    async def test_concurrent_writers_keep_their_offsets(self, tmp_path):
+        node_client = FakeNodeClient()
+        first = node_client.add_parent(1)
+        second = node_client.add_parent(2)
+        path = tmp_path / "lineage.bin"
+        # both caches index the empty file before either appends
+        ours = LineageProofCache(path)
+        theirs = LineageProofCache(path)
+        ours.offsets()
+        theirs.offsets()
+        await ours.lineage_proof(node_client, first)
+        await theirs.lineage_proof(node_client, second)
+
+        assert LineageProofCache(path).get(first) == node_client.expected(first)
+        assert LineageProofCache(path).get(second) == node_client.expected(second)
+
+        # a stale offset pointing at someone else's record is a miss, not a wrong proof
+        stale = LineageProofCache(path, size=0)
+        stale.offsets()[second] = 0
+        assert stale.get(second) is None
+        assert second not in stale.offsets()
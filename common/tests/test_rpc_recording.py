@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+from rpc_recording import RpcRecorder, RpcReplay
+
+from chia.rpc.full_node_rpc_client import FullNodeRpcClient
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.util.ints import uint32, uint64
+
+import pytest
+
+COIN_RECORD = CoinRecord(Coin(bytes32(b'\x01' * 32), bytes32(b'\x02' * 32), uint64(1)), uint32(1), uint32(0), False, uint64(0))
+
+
+class FakeNode:
+
+    def __init__(self):
+        self.height = 10
+
+    async def fetch(self, path, request_json):
+        if path == "get_blockchain_state":
+            self.height += 1
+            return {"success": True, "blockchain_state": {"peak": None, "height": self.height}}
+        if path == "get_coin_record_by_name" and request_json["name"] == COIN_RECORD.coin.name().hex():
+            return {"success": True, "coin_record": dict(COIN_RECORD.to_json_dict(), spent=False)}
+        raise ValueError({"success": False, "error": f"{path} failed"})
+
+
+async def record_node(path):
+    node_client = FullNodeRpcClient()
+    node_client.fetch = FakeNode().fetch
+    recorder = RpcRecorder(path)
+    recorder.record("full_node", node_client)
+
+    assert await node_client.get_coin_record_by_name(COIN_RECORD.coin.name()) == COIN_RECORD
+    assert (await node_client.fetch("get_blockchain_state", {}))["blockchain_state"]["height"] == 11
+    assert (await node_client.fetch("get_blockchain_state", {}))["blockchain_state"]["height"] == 12
+    with pytest.raises(ValueError):
+        await node_client.fetch("get_coin_records_by_hints", {"hints": []})
+    recorder.save()
+
+
+class TestRpcRecording:
+
+    @pytest.mark.asyncio
+    async def test_replay_serves_recorded_answers(self, tmp_path):
+        await record_node(tmp_path / "node.jsonl.gz")
+        node_client = RpcReplay(tmp_path / "node.jsonl.gz").node_client()
+
+        assert await node_client.get_coin_record_by_name(COIN_RECORD.coin.name()) == COIN_RECORD
+        assert await node_client.get_coin_record_by_name(COIN_RECORD.coin.name()) == COIN_RECORD
+        # repeated requests answer in recorded order, then stay on the last answer
+        heights = [(await node_client.fetch("get_blockchain_state", {}))["blockchain_state"]["height"] for _ in range(3)]
+        assert heights == [11, 12, 12]
+        with pytest.raises(ValueError):
+            await node_client.fetch("get_coin_records_by_hints", {"hints": []})
+        with pytest.raises(LookupError):
+            await node_client.fetch("get_coin_record_by_name", {"name": "04" * 32})
+
+    @pytest.mark.asyncio
+    async def test_replay_latency_overlaps(self, tmp_path):
+        await record_node(tmp_path / "node.jsonl.gz")
+        node_client = RpcReplay(tmp_path / "node.jsonl.gz", latency=0.05).node_client()
+
+        start = time.monotonic()
+        await asyncio.gather(*[node_client.get_coin_record_by_name(COIN_RECORD.coin.name()) for _ in range(10)])
+        assert 0.05 <= time.monotonic() - start < 0.5
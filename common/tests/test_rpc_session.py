@@ -0,0 +1,57 @@
+import asyncio
+
+from rpc_session import RpcSession
+
+import pytest
+
+
+class FakeClient:
+
+    # shared across clients so the bound can be checked for the whole session
+    in_flight = 0
+    max_in_flight = 0
+
+    def __init__(self):
+        self.closed = False
+
+    async def fetch(self, path, request_json):
+        FakeClient.in_flight += 1
+        FakeClient.max_in_flight = max(FakeClient.max_in_flight, FakeClient.in_flight)
+        await asyncio.sleep(0.01)
+        FakeClient.in_flight -= 1
+        return {"success": True, "path": path}
+
+    async def get_blockchain_state(self):
+        return await self.fetch("get_blockchain_state", {})
+
+    def close(self):
+        self.closed = True
+
+    async def await_closed(self):
+        pass
+
+
+class TestRpcSession:
+
+    @pytest.mark.asyncio
+    async def test_requests_are_bounded_across_clients(self):
+        FakeClient.max_in_flight = 0
+        node_client = FakeClient()
+        wallet_client = FakeClient()
+        rpc = RpcSession(node_client, wallet_client, max_in_flight=3)
+
+        results = await asyncio.gather(*[client.get_blockchain_state() for client in [node_client, wallet_client] * 5])
+        assert all(result["path"] == "get_blockchain_state" for result in results)
+        assert FakeClient.max_in_flight == 3
+
+        await rpc.close()
+        assert node_client.closed and wallet_client.closed
+
+    @pytest.mark.asyncio
+    async def test_node_only(self):
+        node_client = FakeClient()
+        rpc = RpcSession(node_client)
+        assert rpc.clients() == [node_client]
+        assert rpc.node_client.client is node_client
+        await rpc.close()
+        assert node_client.closed
@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+from scan_checkpoints import ScanCheckpoints
+
+from chia.types.blockchain_format.sized_bytes import bytes32
+
+import pytest
+
+FIRST = bytes32(b'\x01' * 32)
+SECOND = bytes32(b'\x02' * 32)
+
+
+class FakeNodeClient:
+
+    def __init__(self, height):
+        self.height = height
+        self.spent = set()
+
+    async def get_blockchain_state(self):
+        return {"peak": SimpleNamespace(height=self.height)}
+
+    async def get_coin_records_by_names(self, names, include_spent_coins=True):
+        return [SimpleNamespace(name=name, spent=name in self.spent) for name in names]
+
+
+class TestScanCheckpoints:
+
+    @pytest.mark.asyncio
+    async def test_later_runs_start_after_the_checkpoint(self, tmp_path):
+        checkpoints = ScanCheckpoints("test", tmp_path, reorg_depth=10)
+        checkpoints.done([FIRST])
+        # nothing is recorded without knowing the peak the scan covered
+        assert checkpoints.heights == {}
+
+        assert await checkpoints.begin(FakeNodeClient(1000)) == 1000
+        assert checkpoints.start_height([FIRST]) == 0
+        checkpoints.done([FIRST])
+        checkpoints.save()
+
+        checkpoints = ScanCheckpoints("test", tmp_path, reorg_depth=10)
+        assert checkpoints.start_height([FIRST]) == 991
+        # a puzzle hash never scanned drags the whole lookup back to height 0
+        assert checkpoints.start_height([FIRST, SECOND]) == 0
+        assert ScanCheckpoints("other", tmp_path).start_height([FIRST]) == 0
+        assert ScanCheckpoints("test", tmp_path, full_scan=True).start_height([FIRST]) == 0
+
+    @pytest.mark.asyncio
+    async def test_lookups_share_the_lowest_start_height(self, tmp_path):
+        checkpoints = ScanCheckpoints("test", tmp_path, reorg_depth=0)
+        await checkpoints.begin(FakeNodeClient(50))
+        checkpoints.done([FIRST])
+        await checkpoints.begin(FakeNodeClient(80))
+        checkpoints.done([SECOND])
+        assert checkpoints.start_height([FIRST, SECOND]) == 51
+        assert checkpoints.start_height([SECOND]) == 81
+
+    @pytest.mark.asyncio
+    async def test_pushed_coins_hold_the_checkpoint_until_spent(self, tmp_path):
+        coin_ids = [bytes32(b'\x03' * 32), bytes32(b'\x04' * 32)]
+        node_client = FakeNodeClient(100)
+        checkpoints = ScanCheckpoints("test", tmp_path, reorg_depth=0)
+        await checkpoints.begin(node_client)
+        checkpoints.done([FIRST])
+        checkpoints.save()
+
+        node_client.height = 200
+        checkpoints = ScanCheckpoints("test", tmp_path, reorg_depth=0)
+        await checkpoints.begin(node_client)
+        checkpoints.done([FIRST], coin_ids)
+        checkpoints.done([SECOND], coin_ids[:1])
+        checkpoints.save()
+        assert checkpoints.start_height([FIRST]) == 101
+
+        # one of the spends never confirmed, its puzzle hash is scanned again from the old checkpoint
+        node_client.height = 300
+        node_client.spent = {coin_ids[0]}
+        checkpoints = ScanCheckpoints("test", tmp_path, reorg_depth=0)
+        await checkpoints.begin(node_client)
+        assert checkpoints.start_height([FIRST]) == 101
+        assert checkpoints.start_height([SECOND]) == 201
+        assert checkpoints.pending == {}
+
+    def test_older_checkpoint_files_still_load(self, tmp_path):
+        (tmp_path / "test.json").write_text('{"%s": 50}' % FIRST.hex())
+        assert ScanCheckpoints("test", tmp_path, reorg_depth=0).start_height([FIRST]) == 51
@@ -0,0 +1,89 @@
+from blspy import AugSchemeMPL
+
+import pytest
+
+from key_index import KeyIndex
+from signer import LocalSigner, SignerClient, SignerDaemon
+
+from chia.consensus.default_constants import DEFAULT_CONSTANTS
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.util.ints import uint64
+from chia.wallet.derive_keys import master_sk_to_wallet_sk, master_sk_to_wallet_sk_unhardened
+from chia.wallet.payment import Payment
+from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import puzzle_for_pk
+from chia.wallet.wallet import Wallet
+
+MASTER_SK = AugSchemeMPL.key_gen(bytes([5] * 32))
+ADDITIONAL_DATA = DEFAULT_CONSTANTS.AGG_SIG_ME_ADDITIONAL_DATA
+
+def standard_coin_spend(wallet_sk, amount: int = 1000) -> CoinSpend:
+    puzzle = puzzle_for_pk(wallet_sk.get_g1())
+    coin = Coin(bytes32(bytes([amount % 256]) * 32), puzzle.get_tree_hash(), uint64(amount))
+    solution = Wallet().make_solution(primaries=[Payment(puzzle.get_tree_hash(), uint64(amount), [])])
+    return CoinSpend(coin, puzzle, solution)
+
+class TestSigner:
+
+    @pytest.fixture
+    def key_index(self, tmp_path):
+        index = KeyIndex(MASTER_SK, tmp_path)
+        index.load(5, hardened=False)
+        index.load(5, hardened=True)
+        yield index
+        index.close()
+
+    @pytest.mark.asyncio
+    async def test_local_signer(self, key_index):
+        signer = LocalSigner([key_index], ADDITIONAL_DATA)
+        coin_spends = [standard_coin_spend(master_sk_to_wallet_sk_unhardened(MASTER_SK, 3)), standard_coin_spend(master_sk_to_wallet_sk(MASTER_SK, 4), 7)]
+        spend_bundle = await signer.sign_coin_spends(coin_spends)
+        assert spend_bundle.coin_spends == coin_spends
+
+    @pytest.mark.asyncio
+    async def test_local_signer_unknown_key(self, key_index):
+        signer = LocalSigner([key_index], ADDITIONAL_DATA)
+        with pytest.raises(ValueError):
+            await signer.sign_coin_spends([standard_coin_spend(master_sk_to_wallet_sk_unhardened(MASTER_SK, 6))])
+
+    @pytest.mark.asyncio
+    async def test_daemon_round_trip(self, key_index, tmp_path):
+        local_signer = LocalSigner([key_index], ADDITIONAL_DATA)
+        daemon = SignerDaemon(local_signer)
+        await daemon.start(tmp_path / "signer.sock")
+        client = SignerClient(tmp_path / "signer.sock")
+        try:
+            assert await client.get_public_keys() == [MASTER_SK.get_g1()]
+
+            bundles = [[standard_coin_spend(master_sk_to_wallet_sk_unhardened(MASTER_SK, i), 100 + i)] for i in range(3)]
+            spend_bundles = await client.sign_bundles(bundles)
+            assert spend_bundles == [await local_signer.sign_coin_spends(bundle) for bundle in bundles]
+
+            with pytest.raises(RuntimeError):
+                await client.sign_coin_spends([standard_coin_spend(master_sk_to_wallet_sk_unhardened(MASTER_SK, 9))])
+
+            # the connection survives a failed request
+            assert await client.sign_coin_spends(bundles[0]) == spend_bundles[0]
+        finally:
+            await client.close()
+            await daemon.close()
+
+    @pytest.mark.asyncio
+    async def test_daemon_socket_is_private_and_client_reconnects(self, key_index, tmp_path):
+        daemon = SignerDaemon(LocalSigner([key_index], ADDITIONAL_DATA))
+        await daemon.start(tmp_path / "signer.sock")
+        client = SignerClient(tmp_path / "signer.sock")
+        try:
+            assert (tmp_path / "signer.sock").stat().st_mode & 0o777 == 0o600
+            assert await client.get_public_keys() == [MASTER_SK.get_g1()]
+
+            # the daemon restarted, the old connection is gone
+            client.writer.transport.abort()
+            await daemon.close()
+            daemon = SignerDaemon(LocalSigner([key_index], ADDITIONAL_DATA))
+            await daemon.start(tmp_path / "signer.sock")
+            assert await client.get_public_keys() == [MASTER_SK.get_g1()]
+        finally:
+            await client.close()
+            await daemon.close()
@@ -0,0 +1,111 @@
+from spend_cost import FEE_ESTIMATE_COST, SpendNotYetValid, fee_for_cost, pack_by_cost, spend_bundle_cost, validate_spend_bundle
+
+from blspy import G2Element
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.types.coin_spend import CoinSpend
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint32, uint64
+
+import pytest
+
+PUZZLE = Program.to(1)
+
+
+def spend_bundle(n: int, conditions) -> SpendBundle:
+    coin = Coin(bytes32(bytes([n]) * 32), PUZZLE.get_tree_hash(), uint64(5))
+    return SpendBundle([CoinSpend(coin, PUZZLE, Program.to(conditions))], G2Element())
+
+
+class CoinStateNodeClient:
+
+    def __init__(self, coin_records):
+        self.coin_records = {coin_record.name: coin_record for coin_record in coin_records}
+
+    async def get_coin_record_by_name(self, name):
+        return self.coin_records.get(name)
+
+
+class FeeEstimateNodeClient:
+
+    def __init__(self, mojos_per_cost):
+        self.mojos_per_cost = mojos_per_cost
+
+    async def get_fee_estimate(self, target_times, cost):
+        return {"estimates": [int(self.mojos_per_cost * cost) for _ in target_times]}
+
+
+def confirmed(spend_bundle: SpendBundle, height: int, spent: bool = False) -> CoinRecord:
+    return CoinRecord(spend_bundle.coin_spends[0].coin, uint32(height), uint32(height + 1 if spent else 0), False, uint64(900))
+
+
+class TestSpendCost:
+
+    def test_costs_add_up(self):
+        first = spend_bundle(1, [[51, b'\x03' * 32, 5]])
+        second = spend_bundle(2, [[51, b'\x03' * 32, 5]])
+        # a CREATE_COIN alone costs 1800000
+        assert spend_bundle_cost(first) > 1800000
+        # summing the parts never underestimates the aggregate
+        assert 2 * spend_bundle_cost(first) - 100000 < spend_bundle_cost(SpendBundle.aggregate([first, second])) <= 2 * spend_bundle_cost(first)
+
+    def test_invalid_spend_does_not_run(self):
+        with pytest.raises(ValueError):
+            spend_bundle_cost(spend_bundle(1, [[51, b'\x03' * 32]]))
+
+    def test_pack_by_cost(self):
+        assert pack_by_cost(list("abcde"), [4, 4, 9, 1, 2], 8) == [["a", "b"], ["c"], ["d", "e"]]
+        assert pack_by_cost([], [], 8) == []
+
+
+class TestValidateSpendBundle:
+
+    @pytest.mark.asyncio
+    async def test_valid_spend_costs_what_it_runs_for(self):
+        bundle = spend_bundle(1, [[51, b'\x03' * 32, 5]])
+        node_client = CoinStateNodeClient([confirmed(bundle, 5)])
+        assert await validate_spend_bundle(node_client, bundle, (10, 1000)) == spend_bundle_cost(bundle)
+
+    @pytest.mark.asyncio
+    async def test_immature_timelock_is_not_valid_yet(self):
+        # ASSERT_HEIGHT_RELATIVE 10 on a coin confirmed at 5
+        bundle = spend_bundle(1, [[82, 10], [51, b'\x03' * 32, 5]])
+        node_client = CoinStateNodeClient([confirmed(bundle, 5)])
+        with pytest.raises(SpendNotYetValid):
+            await validate_spend_bundle(node_client, bundle, (10, 1000))
+        assert await validate_spend_bundle(node_client, bundle, (15, 1000)) > 0
+
+    @pytest.mark.asyncio
+    async def test_spent_or_unknown_coins_are_invalid(self):
+        bundle = spend_bundle(1, [[51, b'\x03' * 32, 5]])
+        for node_client in (CoinStateNodeClient([confirmed(bundle, 5, spent=True)]), CoinStateNodeClient([])):
+            with pytest.raises(ValueError) as e:
+                await validate_spend_bundle(node_client, bundle, (10, 1000))
+            assert e.type is ValueError
+
+    @pytest.mark.asyncio
+    async def test_ephemeral_coins_need_no_coin_record(self):
+        parent = spend_bundle(1, [[51, PUZZLE.get_tree_hash(), 5]])
+        child = Coin(parent.coin_spends[0].coin.name(), PUZZLE.get_tree_hash(), uint64(5))
+        bundle = SpendBundle.aggregate([parent, SpendBundle([CoinSpend(child, PUZZLE, Program.to([[51, b'\x03' * 32, 5]]))], G2Element())])
+        node_client = CoinStateNodeClient([confirmed(parent, 5)])
+        assert await validate_spend_bundle(node_client, bundle, (10, 1000)) > 0
+
+
+class TestFeeForCost:
+
+    @pytest.mark.asyncio
+    async def test_fee_scales_with_cost(self):
+        node_client = FeeEstimateNodeClient(2.5)
+        assert await fee_for_cost(node_client, 1000) == 2500
+        assert await fee_for_cost(node_client, 10 * 1000) == 25000
+        # rounded up, never a mojo short
+        assert await fee_for_cost(FeeEstimateNodeClient(1 / FEE_ESTIMATE_COST), 1) == 1
+
+    @pytest.mark.asyncio
+    async def test_fee_is_clamped(self):
+        assert await fee_for_cost(FeeEstimateNodeClient(0), 1000, min_fee=1) == 1
+        assert await fee_for_cost(FeeEstimateNodeClient(100), 1000, min_fee=1, max_fee=50000) == 50000
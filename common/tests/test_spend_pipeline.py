@@ -0,0 +1,115 @@
+from blspy import AugSchemeMPL, G2Element
+
+import pytest
+
+from key_index import KeyIndex
+from signer import LocalSigner
+from spend_pipeline import SpendExport, push_or_export, push_spend_file, read_spend_file, sign_spend_file
+
+from chia.consensus.default_constants import DEFAULT_CONSTANTS
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint64
+from chia.wallet.derive_keys import master_sk_to_wallet_sk_unhardened
+from chia.wallet.payment import Payment
+from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import puzzle_for_pk
+from chia.wallet.trading.offer import Offer
+from chia.wallet.wallet import Wallet
+
+MASTER_SK = AugSchemeMPL.key_gen(bytes([7] * 32))
+ADDITIONAL_DATA = DEFAULT_CONSTANTS.AGG_SIG_ME_ADDITIONAL_DATA
+
+
+def standard_coin_spend(index: int) -> CoinSpend:
+    puzzle = puzzle_for_pk(master_sk_to_wallet_sk_unhardened(MASTER_SK, index).get_g1())
+    coin = Coin(bytes32(bytes([index]) * 32), puzzle.get_tree_hash(), uint64(1000))
+    solution = Wallet().make_solution(primaries=[Payment(puzzle.get_tree_hash(), uint64(1000), [])])
+    return CoinSpend(coin, puzzle, solution)
+
+
+class FakeNodeClient:
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.pushed = []
+
+    async def push_tx(self, spend_bundle):
+        if spend_bundle.name() in self.fail:
+            raise ValueError("DOUBLE_SPEND")
+        self.pushed.append(spend_bundle)
+        return {"status": "SUCCESS", "success": True}
+
+
+class TestSpendPipeline:
+
+    @pytest.fixture
+    def key_index(self, tmp_path):
+        index = KeyIndex(MASTER_SK, tmp_path / "keys")
+        index.load(5, hardened=False)
+        yield index
+        index.close()
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("suffix", [".jsonl", ".jsonl.gz"])
+    async def test_export_sign_push(self, key_index, tmp_path, suffix):
+        export = SpendExport(tmp_path / f"unsigned{suffix}")
+        node_client = FakeNodeClient()
+        for i in range(5):
+            spend_bundle = await export.sign_coin_spends([standard_coin_spend(i)])
+            assert spend_bundle.aggregated_signature == G2Element()
+            assert (await push_or_export(node_client, export, spend_bundle))["status"] == "EXPORTED"
+        await export.close()
+        assert node_client.pushed == []
+
+        signer = LocalSigner([key_index], ADDITIONAL_DATA)
+        assert await sign_spend_file(signer, tmp_path / f"unsigned{suffix}", tmp_path / f"signed{suffix}", batch=2) == 5
+        assert not (tmp_path / f"signed{suffix}.partial").exists()
+
+        expected = [await signer.sign_coin_spends([standard_coin_spend(i)]) for i in range(5)]
+        assert await push_spend_file(node_client, tmp_path / f"signed{suffix}", batch=2) == (5, 0)
+        assert node_client.pushed == expected
+
+    @pytest.mark.asyncio
+    async def test_fee_coins_are_recorded_through_signing(self, key_index, tmp_path):
+        export = SpendExport(tmp_path / "unsigned.jsonl")
+        fee_coin_spend = standard_coin_spend(4)
+        spend_bundle = await export.sign_coin_spends([standard_coin_spend(1), fee_coin_spend])
+        await push_or_export(FakeNodeClient(), export, spend_bundle, [fee_coin_spend.coin])
+        await export.close()
+
+        assert next(read_spend_file(tmp_path / "unsigned.jsonl"))["fee_coins"] == [fee_coin_spend.coin.name().hex()]
+        await sign_spend_file(LocalSigner([key_index], ADDITIONAL_DATA), tmp_path / "unsigned.jsonl", tmp_path / "signed.jsonl")
+        assert next(read_spend_file(tmp_path / "signed.jsonl"))["fee_coins"] == [fee_coin_spend.coin.name().hex()]
+
+    @pytest.mark.asyncio
+    async def test_failed_pushes_do_not_stop_the_rest(self, key_index, tmp_path):
+        signer = LocalSigner([key_index], ADDITIONAL_DATA)
+        export = SpendExport(tmp_path / "unsigned.jsonl")
+        for i in range(3):
+            export.write(await export.sign_coin_spends([standard_coin_spend(i)]))
+        await export.close()
+        await sign_spend_file(signer, tmp_path / "unsigned.jsonl", tmp_path / "signed.jsonl")
+
+        failing = await signer.sign_coin_spends([standard_coin_spend(1)])
+        node_client = FakeNodeClient([failing.name()])
+        assert await push_spend_file(node_client, tmp_path / "signed.jsonl") == (2, 1)
+        assert len(node_client.pushed) == 2
+
+    @pytest.mark.asyncio
+    async def test_offers_are_signed_and_written_out(self, key_index, tmp_path):
+        export = SpendExport(tmp_path / "unsigned.jsonl")
+        unsigned = Offer({}, await export.sign_coin_spends([standard_coin_spend(2)]), {})
+        export.write_offer(unsigned, "old.offer")
+        await export.close()
+
+        signer = LocalSigner([key_index], ADDITIONAL_DATA)
+        await sign_spend_file(signer, tmp_path / "unsigned.jsonl", tmp_path / "signed.jsonl")
+        assert [record["name"] for record in read_spend_file(tmp_path / "signed.jsonl")] == ["old.offer"]
+
+        with pytest.raises(ValueError):
+            await push_spend_file(FakeNodeClient(), tmp_path / "signed.jsonl")
+        assert await push_spend_file(FakeNodeClient(), tmp_path / "signed.jsonl", tmp_path / "offers") == (1, 0)
+        offer = Offer.from_bech32((tmp_path / "offers" / "old.offer").read_text())
+        assert offer.to_spend_bundle() == SpendBundle.aggregate([await signer.sign_coin_spends([standard_coin_spend(2)])])
@@ -0,0 +1,241 @@
+from types import SimpleNamespace
+
+from submission_tracker import SubmissionTracker
+
+from blspy import G2Element
+
+from chia.full_node.mempool_manager import MEMPOOL_MIN_FEE_INCREASE
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_spend import CoinSpend
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint64
+
+import pytest
+
+PUZZLE = Program.to(1)
+
+
+def coin(n: int, amount: int = 100) -> Coin:
+    return Coin(bytes32(bytes([n]) * 32), PUZZLE.get_tree_hash(), uint64(amount))
+
+
+# sends its whole amount on, so the bundle only pays what the fee coins pay
+def royalty_spend(n: int) -> SpendBundle:
+    return SpendBundle([CoinSpend(coin(n), PUZZLE, Program.to([[51, b'\x03' * 32, 100]]))], G2Element())
+
+
+# pays fee mojos out of the fee coins, in order
+def paid(unpaid: SpendBundle, fee_coins, fee: int) -> SpendBundle:
+    coin_spends = list(unpaid.coin_spends)
+    for fee_coin in fee_coins:
+        fee_amount = min(fee, fee_coin.amount)
+        fee -= fee_amount
+        coin_spends.append(CoinSpend(fee_coin, PUZZLE, Program.to([[51, b'\x03' * 32, fee_coin.amount - fee_amount]])))
+    return SpendBundle(coin_spends, G2Element())
+
+
+class FakeNodeClient:
+
+    def __init__(self):
+        self.height = 10
+        self.spent = set()
+        self.pushed = []
+        self.lookups = 0
+
+    async def get_blockchain_state(self):
+        return {"peak": SimpleNamespace(height=self.height)}
+
+    async def get_coin_records_by_names(self, names, include_spent_coins=True, start_height=None, end_height=None):
+        self.lookups += 1
+        return [SimpleNamespace(name=name, spent=name in self.spent) for name in names]
+
+    async def push_tx(self, spend_bundle):
+        self.pushed.append(spend_bundle)
+        return {"success": True}
+
+
+class TestSubmissionTracker:
+
+    @pytest.mark.asyncio
+    async def test_confirmed_bundles_release_their_fee_coins(self):
+        released = []
+        tracker = SubmissionTracker(release=lambda unspent, spent: released.append((unspent, spent)), confirm_blocks=3)
+        node_client = FakeNodeClient()
+        unpaid = royalty_spend(1)
+        spend_bundle = paid(unpaid, [coin(2)], 10)
+
+        await tracker.push(node_client, spend_bundle, unpaid)
+        assert tracker.fee_coins() == [coin(2)]
+        assert await tracker.poll(node_client) == 1
+        assert released == []
+
+        node_client.spent = {coin(1).name(), coin(2).name()}
+        assert await tracker.poll(node_client) == 0
+        assert released == [([], [coin(2)])]
+        assert tracker.fee_coins() == []
+
+    @pytest.mark.asyncio
+    async def test_stuck_bundles_are_rebuilt_with_a_higher_fee(self):
+        rebuilds = []
+
+        async def rebuild(node_client, unpaid, fee_coins, min_fees):
+            rebuilds.append((fee_coins, min_fees))
+            return paid(unpaid, fee_coins, min_fees)
+
+        tracker = SubmissionTracker(rebuild=rebuild, confirm_blocks=3, fee_bump=2, max_fee=MEMPOOL_MIN_FEE_INCREASE * 4)
+        node_client = FakeNodeClient()
+        unpaid = royalty_spend(1)
+        fee_coins = [coin(2, MEMPOOL_MIN_FEE_INCREASE * 4)]
+        await tracker.push(node_client, paid(unpaid, fee_coins, 10), unpaid)
+
+        await tracker.poll(node_client)
+        node_client.height = 12
+        await tracker.poll(node_client)
+        assert rebuilds == []
+
+        node_client.height = 13
+        assert await tracker.poll(node_client) == 1
+        # the mempool only replaces a bundle for a big enough fee increase
+        assert rebuilds == [(fee_coins, 10 + MEMPOOL_MIN_FEE_INCREASE)]
+        assert node_client.pushed[-1].fees() == 10 + MEMPOOL_MIN_FEE_INCREASE
+        assert node_client.pushed[-1].removals() == node_client.pushed[0].removals()
+
+        node_client.height = 16
+        await tracker.poll(node_client)
+        assert rebuilds[-1] == (fee_coins, 2 * (10 + MEMPOOL_MIN_FEE_INCREASE))
+        assert node_client.lookups == 4
+
+    @pytest.mark.asyncio
+    async def test_rebroadcast_fees_stop_at_the_cap(self):
+        rebuilds = []
+
+        async def rebuild(node_client, unpaid, fee_coins, min_fees):
+            rebuilds.append(min_fees)
+            return paid(unpaid, fee_coins, min_fees)
+
+        max_fee = 10 + 2 * MEMPOOL_MIN_FEE_INCREASE
+        tracker = SubmissionTracker(rebuild=rebuild, confirm_blocks=1, fee_bump=2, max_fee=max_fee)
+        node_client = FakeNodeClient()
+        unpaid = royalty_spend(1)
+        await tracker.push(node_client, paid(unpaid, [coin(2, max_fee * 4)], 10), unpaid)
+        await tracker.poll(node_client)
+
+        for height in range(11, 14):
+            node_client.height = height
+            await tracker.poll(node_client)
+        # the second bump is clamped, the third would not raise the fee enough to replace it
+        assert rebuilds == [10 + MEMPOOL_MIN_FEE_INCREASE, max_fee]
+        assert [spend_bundle.fees() for spend_bundle in node_client.pushed] == [10, 10 + MEMPOOL_MIN_FEE_INCREASE, max_fee, max_fee]
+        assert node_client.pushed[-1] == node_client.pushed[-2]
+
+    @pytest.mark.asyncio
+    async def test_the_default_cap_leaves_room_for_a_bump(self, capsys):
+        rebuilds = []
+
+        async def rebuild(node_client, unpaid, fee_coins, min_fees):
+            rebuilds.append(min_fees)
+            return paid(unpaid, fee_coins, min_fees)
+
+        tracker = SubmissionTracker(rebuild=rebuild, confirm_blocks=1)
+        node_client = FakeNodeClient()
+        unpaid = royalty_spend(1)
+        # a first fee at the MAX_FEE default of the spend tools
+        await tracker.push(node_client, paid(unpaid, [coin(2, 100000000)], 50000), unpaid)
+        await tracker.poll(node_client)
+
+        for height in range(11, 14):
+            node_client.height = height
+            await tracker.poll(node_client)
+        # two minimum increases fit under the cap, a third would pass it
+        assert rebuilds == [50000 + MEMPOOL_MIN_FEE_INCREASE, 50000 + 2 * MEMPOOL_MIN_FEE_INCREASE]
+        assert node_client.pushed[-1].fees() == 50000 + 2 * MEMPOOL_MIN_FEE_INCREASE
+        assert "below the minimum fee increase" not in capsys.readouterr().out
+
+    def test_a_cap_below_the_minimum_increase_is_reported(self, capsys):
+        async def rebuild(node_client, unpaid, fee_coins, min_fees):
+            return unpaid
+
+        SubmissionTracker(rebuild=rebuild, max_fee=50000)
+        assert "MAX_REBROADCAST_FEE of 50000 is below the minimum fee increase" in capsys.readouterr().out
+
+    @pytest.mark.asyncio
+    async def test_blocks_count_from_the_push(self):
+        rebuilds = []
+
+        async def rebuild(node_client, unpaid, fee_coins, min_fees):
+            rebuilds.append(min_fees)
+            return paid(unpaid, fee_coins, min_fees)
+
+        tracker = SubmissionTracker(rebuild=rebuild, confirm_blocks=3)
+        node_client = FakeNodeClient()
+        unpaid = royalty_spend(1)
+        await tracker.push(node_client, paid(unpaid, [coin(2, MEMPOOL_MIN_FEE_INCREASE * 2)], 10), unpaid)
+        assert tracker.submissions[0].height == 10
+
+        # no poll in between, the first one already sees the bundle stuck
+        node_client.height = 13
+        await tracker.poll(node_client)
+        assert rebuilds == [10 + MEMPOOL_MIN_FEE_INCREASE]
+
+    @pytest.mark.asyncio
+    async def test_failed_rebroadcasts_release_the_coins_added_for_them(self):
+        released = []
+
+        async def rebuild(node_client, unpaid, fee_coins, min_fees):
+            return paid(unpaid, fee_coins + [coin(5, MEMPOOL_MIN_FEE_INCREASE * 2)], min_fees)
+
+        tracker = SubmissionTracker(rebuild=rebuild, release=lambda unspent, spent: released.append((unspent, spent)), confirm_blocks=1)
+        node_client = FakeNodeClient()
+        unpaid = royalty_spend(1)
+        await tracker.push(node_client, paid(unpaid, [coin(2, 100)], 10), unpaid)
+
+        async def push_tx(spend_bundle):
+            raise ValueError("MEMPOOL_CONFLICT")
+
+        node_client.push_tx = push_tx
+        node_client.height = 11
+        assert await tracker.poll(node_client) == 1
+        # the old bundle is still the one tracked, only the coin the rebuild added goes back
+        assert released == [([coin(5, MEMPOOL_MIN_FEE_INCREASE * 2)], [])]
+        assert tracker.fee_coins() == [coin(2, 100)]
+
+    @pytest.mark.asyncio
+    async def test_conflicting_and_abandoned_bundles_are_dropped(self):
+        released = []
+        tracker = SubmissionTracker(release=lambda unspent, spent: released.extend(unspent), confirm_blocks=1, max_attempts=1)
+        node_client = FakeNodeClient()
+        conflicted = royalty_spend(1)
+        abandoned = royalty_spend(3)
+        await tracker.push(node_client, paid(conflicted, [coin(2)], 10), conflicted)
+        await tracker.push(node_client, paid(abandoned, [coin(4)], 10), abandoned)
+        await tracker.poll(node_client)
+
+        # the royalty coin went in another bundle, the fee coin never got spent
+        node_client.spent = {coin(1).name()}
+        node_client.height = 11
+        assert await tracker.poll(node_client) == 1
+        assert released == [coin(2)]
+
+        node_client.height = 12
+        assert await tracker.poll(node_client) == 0
+        # the given up bundle may still be in the mempool, its fee coin is not handed out again
+        assert released == [coin(2)]
+        # without a rebuild the same bundle is pushed again
+        assert len(node_client.pushed) == 3
+
+    @pytest.mark.asyncio
+    async def test_failed_pushes_release_their_fee_coins(self):
+        released = []
+        tracker = SubmissionTracker(release=lambda unspent, spent: released.extend(unspent))
+        node_client = FakeNodeClient()
+
+        async def push_tx(spend_bundle):
+            raise ValueError("DOUBLE_SPEND")
+
+        node_client.push_tx = push_tx
+        with pytest.raises(ValueError):
+            await tracker.push(node_client, paid(royalty_spend(1), [coin(2)], 10), royalty_spend(1))
+        assert released == [coin(2)]
+        assert tracker.submissions == []
@@ -0,0 +1,87 @@
+import io
+import json
+import time
+from urllib.error import HTTPError, URLError
+
+import tail_registry
+from tail_registry import TailRegistry, load_cats, read_tail_csv
+
+import pytest
+
+LKY8 = "e5a8af7124c2737283838e6797b0f0a5293fc81aca1ffd2720f8506c23f2ad88"
+SBX = "a628c1c2c6fcb74d53746157e438e108eab5c0bb3e5c80ff9b1910b3e4832913"
+USDS = "6d95dae356e32a71db5ddcb42224754a02524c615c5fc35f568c2af04774e589"
+
+
+class FakeResponse(io.BytesIO):
+
+    def __init__(self, body, headers):
+        super().__init__(json.dumps(body).encode())
+        self.headers = headers
+
+
+class FakeTailDatabase:
+
+    def __init__(self, tails, etag="v1"):
+        self.tails = tails
+        self.etag = etag
+        self.requests = []
+        self.offline = False
+
+    def urlopen(self, request, timeout=None):
+        self.requests.append(dict(request.header_items()))
+        if self.offline:
+            raise URLError("offline")
+        if request.get_header("If-none-match") == self.etag:
+            raise HTTPError(request.full_url, 304, "Not Modified", {}, None)
+        return FakeResponse([{"code": code, "hash": asset_id} for code, asset_id in self.tails.items()], {"ETag": self.etag})
+
+
+class TestTailRegistry:
+
+    @pytest.fixture
+    def tail_database(self, monkeypatch):
+        tail_database = FakeTailDatabase({"LKY8": LKY8, "SBX": SBX})
+        monkeypatch.setattr(tail_registry, "urlopen", tail_database.urlopen)
+        return tail_database
+
+    def test_fresh_registry_is_not_refetched(self, tmp_path, tail_database):
+        assert TailRegistry(tmp_path / "tails.json", ttl=60).tails() == {"LKY8": LKY8, "SBX": SBX}
+        assert TailRegistry(tmp_path / "tails.json", ttl=60).tails() == {"LKY8": LKY8, "SBX": SBX}
+        assert len(tail_database.requests) == 1
+
+    def test_stale_registry_refreshes_conditionally(self, tmp_path, tail_database):
+        registry = TailRegistry(tmp_path / "tails.json", ttl=0)
+        registry.tails()
+        fetched = registry.state["fetched"]
+        time.sleep(0.01)
+
+        # unchanged upstream answers 304, the cached tails stay and the clock restarts
+        assert registry.tails() == {"LKY8": LKY8, "SBX": SBX}
+        assert tail_database.requests[1]["If-none-match"] == "v1"
+        assert registry.state["fetched"] > fetched
+
+        tail_database.tails["USDS"] = USDS
+        tail_database.etag = "v2"
+        assert registry.tails()["USDS"] == USDS
+        assert TailRegistry(tmp_path / "tails.json").state["etag"] == "v2"
+
+    def test_offline_uses_cache_only(self, tmp_path, tail_database):
+        TailRegistry(tmp_path / "tails.json").tails()
+        assert TailRegistry(tmp_path / "tails.json", ttl=0, offline=True).tails() == {"LKY8": LKY8, "SBX": SBX}
+        assert TailRegistry(tmp_path / "empty.json", offline=True).tails() == {}
+        assert len(tail_database.requests) == 1
+
+    def test_unreachable_database_falls_back_to_cache(self, tmp_path, tail_database):
+        TailRegistry(tmp_path / "tails.json").tails()
+        tail_database.offline = True
+        assert TailRegistry(tmp_path / "tails.json", ttl=0).tails() == {"LKY8": LKY8, "SBX": SBX}
+
+    def test_load_cats_merges_sources(self, tmp_path, tail_database):
+        csv_path = tmp_path / "tails.csv"
+        csv_path.write_text(f"#code,hash\nUSDS,{USDS}\nSBX,{LKY8}\nBROKEN,abc\n")
+        assert read_tail_csv(csv_path) == {"USDS": USDS, "SBX": LKY8}
+
+        registry = TailRegistry(tmp_path / "tails.json")
+        cats = load_cats({"TEST": USDS, "LKY8": SBX}, registry, [csv_path])
+        assert cats == {"TEST": USDS, "LKY8": LKY8, "SBX": LKY8, "USDS": USDS}
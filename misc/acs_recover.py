@@ -38,6 +38,12 @@ from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
 from chia.wallet.sign_coin_spends import sign_coin_spends
 from chia.wallet.wallet import Wallet
 
+# modules shared by every tool live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from lineage_cache import LineageProofCache
+from rpc_session import RpcSession
+from scan_checkpoints import ScanCheckpoints
+
 ACS: Program = Program.to(1)
 
 config = load_config(DEFAULT_ROOT_PATH, "config.yaml")
@@ -60,29 +66,27 @@ DERIVATIONS = int(os.environ.get('DERIVATIONS', 8150))
 wallet = Wallet()
 
 puzzle_reveals = dict()
+lineage_proofs = LineageProofCache()
 
-async def migrate_coins(current_puzzlehash, new_puzzlehash, cat_asset_id: str = None):
-    try:
-        print(f"Migrating coins from {current_puzzlehash.hex()} to {new_puzzlehash.hex()}")
-        node_client = await FullNodeRpcClient.create(self_hostname, uint16(full_node_rpc_port), DEFAULT_ROOT_PATH, config)
-        all_coins_by_hash = await node_client.get_coin_records_by_puzzle_hash(current_puzzlehash, False, 0)
-        print(f"Found {len(all_coins_by_hash)} coins")
-        sum_by_hash = 0
-        for coin_record in all_coins_by_hash:
-            sum_by_hash += int(coin_record.coin.amount)
-
-        if sum_by_hash > 0:
-            print(f'Hash found {sum_by_hash}. Will migrate {len(all_coins_by_hash)} coins.')
+async def migrate_coins(node_client: FullNodeRpcClient, current_puzzlehash, new_puzzlehash, cat_asset_id: str = None, checkpoints: ScanCheckpoints = None):
+    print(f"Migrating coins from {current_puzzlehash.hex()} to {new_puzzlehash.hex()}")
+    start_height = 0 if checkpoints is None else checkpoints.start_height([current_puzzlehash])
+    all_coins_by_hash = await node_client.get_coin_records_by_puzzle_hash(current_puzzlehash, False, start_height)
+    print(f"Found {len(all_coins_by_hash)} coins")
+    sum_by_hash = 0
+    for coin_record in all_coins_by_hash:
+        sum_by_hash += int(coin_record.coin.amount)
 
-        for coin_record in all_coins_by_hash:
-            await spend_coin(node_client, coin_record, new_puzzlehash, address_puzzlehash=current_puzzlehash, cat_asset_id=cat_asset_id)
+    if sum_by_hash > 0:
+        print(f'Hash found {sum_by_hash}. Will migrate {len(all_coins_by_hash)} coins.')
 
-    finally:
-        node_client.close()
-        await node_client.await_closed()
+    spent = [await spend_coin(node_client, coin_record, new_puzzlehash, address_puzzlehash=current_puzzlehash, cat_asset_id=cat_asset_id) for coin_record in all_coins_by_hash]
+    if checkpoints is not None and all(spent):
+        # the checkpoint moves once the migrated coins are seen spent
+        checkpoints.done([current_puzzlehash], [coin_record.name for coin_record in all_coins_by_hash])
 
 
-async def spend_coin(node_client, coin_record: CoinRecord, hint_puzzlehash: bytes32, address_puzzlehash: bytes32 = None, cat_asset_id = None):
+async def spend_coin(node_client, coin_record: CoinRecord, hint_puzzlehash: bytes32, address_puzzlehash: bytes32 = None, cat_asset_id = None) -> bool:
     print(f'spend_coin: {coin_record.coin.name().hex()}')
 
     if address_puzzlehash is None:
@@ -95,6 +99,7 @@ async def spend_coin(node_client, coin_record: CoinRecord, hint_puzzlehash: byte
 
     if puzzle_reveal is None:
         print("WARNING: Checked all known keys for valid puzzle reveal. Failed to find any.")
+        return False
     else:
         spend_bundle: SpendBundle = None
         primaries = [Payment(hint_puzzlehash, coin_record.coin.amount, [hint_puzzlehash])]
@@ -113,26 +118,18 @@ async def spend_coin(node_client, coin_record: CoinRecord, hint_puzzlehash: byte
             spend_bundle = SpendBundle([coin_spend], G2Element())
 
         await node_client.push_tx(spend_bundle)
+        return True
 
 
 async def calculate_cat_spend_bundle(coin_record: CoinRecord, node_client: FullNodeRpcClient, cat_asset_id: str, address_puzzlehash: bytes32, puzzle: Program, inner_solution: Program) -> SpendBundle:
     coin: Coin = coin_record.coin
-    parent_coin_record: CoinRecord = await node_client.get_coin_record_by_name(coin.parent_coin_info)
-
-    parent_coin: Coin = parent_coin_record.coin
 
     # cross-check cat puzzle hash
     cat_puzzle = construct_cat_puzzle(CAT_MOD, bytes.fromhex(cat_asset_id), puzzle)
 
     assert cat_puzzle.get_tree_hash() == address_puzzlehash
     assert coin.puzzle_hash == cat_puzzle.get_tree_hash()
-    parent_coin_spend: CoinSpend = await node_client.get_puzzle_and_solution(parent_coin.name(), parent_coin_record.spent_block_index)
-
-    parent_puzzle_reveal: SerializedProgram = parent_coin_spend.puzzle_reveal
-    _, curried_args = parent_puzzle_reveal.uncurry()
-    list_args = list(curried_args.as_iter())
-    parent_inner_puzzlehash: bytes32 = list_args[-1].get_tree_hash()
-    lineage_proof = LineageProof(parent_coin.parent_coin_info, parent_inner_puzzlehash, parent_coin.amount)
+    lineage_proof = await lineage_proofs.lineage_proof(node_client, coin.parent_coin_info)
 
     spendable_cat = SpendableCAT(coin, bytes.fromhex(cat_asset_id), puzzle, inner_solution, Program.to([]), lineage_proof, 0)
 
@@ -178,7 +175,14 @@ async def main():
     puzzlehash = ACS.get_tree_hash()
     address = encode_puzzle_hash(puzzlehash, PREFIX)
     new_puzzlehash = decode_puzzle_hash(new_xch_address)
-    await migrate_coins(puzzlehash, new_puzzlehash)
+    rpc = await RpcSession.create(config)
+    checkpoints = ScanCheckpoints("acs_recover")
+    try:
+        await checkpoints.begin(rpc.node_client)
+        await migrate_coins(rpc.node_client, puzzlehash, new_puzzlehash, checkpoints=checkpoints)
+    finally:
+        checkpoints.save()
+        await rpc.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+
+from blspy import AugSchemeMPL
+
+# modules shared by every tool live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from key_index import DERIVATION_WORKERS, derive_records, derive_records_parallel
+
+
+def usage():
+    print('Usage: DERIVATION_WORKERS=<processes> python bench_key_derivation.py <optional:DERIVATIONS>')
+    exit(1)
+
+
+def main():
+    argc = len(sys.argv)
+    if argc > 2:
+        usage()
+
+    derivations = int(sys.argv[1]) if argc == 2 else 10000
+
+    # throwaway key, nothing here touches the keychain
+    master_sk = AugSchemeMPL.key_gen(os.urandom(32))
+
+    for hardened in (False, True):
+        label = 'hardened' if hardened else 'unhardened'
+
+        start = time.perf_counter()
+        serial = derive_records(master_sk, hardened, 0, derivations)
+        serial_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parallel = derive_records_parallel(master_sk, hardened, 0, derivations)
+        parallel_time = time.perf_counter() - start
+
+        assert parallel == serial
+        print(f'{derivations} {label} keys: serial {serial_time:.2f}s, parallel ({DERIVATION_WORKERS} workers) {parallel_time:.2f}s, speedup {serial_time / parallel_time:.1f}x')
+
+
+if __name__ == "__main__":
+    main()
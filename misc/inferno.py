@@ -54,6 +54,13 @@ from chia.wallet.sign_coin_spends import sign_coin_spends
 from chia.wallet.trading.offer import Offer, NotarizedPayment, OFFER_MOD_HASH
 from chia.wallet.wallet import Wallet
 
+# modules shared by every tool live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from key_index import KeyIndex, PuzzleReveals
+from rpc_session import RpcSession
+from signer import SIGNER_SOCKET, LocalSigner, SignerClient
+from spend_pipeline import SPEND_EXPORT, SpendExport
+
 from typing import Dict, List, Optional, Set, Tuple
 
 MAX_BLOCK_COST_CLVM = DEFAULT_CONSTANTS.MAX_BLOCK_COST_CLVM
@@ -80,8 +87,9 @@ if PREFIX == 'txch':
         logger.warning(f"Tried loading AGG_SIG_ME_ADDITIONAL_DATA from config. Exception {e}")
 AGG_SIG_ME_ADDITIONAL_DATA = agg_sig_config or DEFAULT_CONSTANTS.AGG_SIG_ME_ADDITIONAL_DATA
 
-puzzle_reveals = {}
-wallet_keys = []
+puzzle_reveals = PuzzleReveals()
+key_index: Optional[KeyIndex] = None
+signer = None
 
 class Inferno:
 
@@ -90,13 +98,26 @@ class Inferno:
         logger.info(f"Will write to: {self.target}")
         self.wallet_client = wallet_client
         self.node_client = node_client
-        self.load_keys(FINGERPRINT)
 
 
-    def load_keys(self, fingerprint: int):
+    async def load_keys(self, fingerprint: int):
+        global key_index, signer
+
+        if key_index is not None:
+            logger.info(f"Found pre-loaded key index for fingerprint {key_index.fingerprint}, skipping")
+            return
 
-        if len(wallet_keys) > 0:
-            logger.info(f"Found {len(wallet_keys)} pre-loaded wallet keys, skipping")
+        if SIGNER_SOCKET is not None:
+            logger.info(f"Signing through signer daemon at {SIGNER_SOCKET}, fingerprint {fingerprint}")
+            signer = SignerClient(SIGNER_SOCKET)
+            master_pks = [pk for pk in await signer.get_public_keys() if pk.get_fingerprint() == fingerprint]
+            assert len(master_pks) == 1, f"Signer daemon does not hold fingerprint {fingerprint}"
+            # the daemon has already indexed the hardened keys, so reading them needs no private key
+            key_index = KeyIndex.observer(master_pks[0])
+            key_index.load(DERIVATIONS, hardened=False)
+            key_index.load(DERIVATIONS, hardened=True)
+            puzzle_reveals.key_indexes.append(key_index)
+            await self.export_spends()
             return
 
         logger.info(f"Loading private key for spend bundle signing (fee support and private spends), fingerprint {fingerprint}")
@@ -106,18 +127,23 @@ class Inferno:
         sk = keychain.get_private_key_by_fingerprint(fingerprint)
         assert sk is not None
         
-        logger.info(f'Deriving {DERIVATIONS} synthetic private keys')
-        for i in range(DERIVATIONS):
-            wk1 = master_sk_to_wallet_sk_unhardened(sk[0], i)
-            wk2 = master_sk_to_wallet_sk(sk[0], i)
-            wallet_keys.append(wk1)
-            wallet_keys.append(wk2)
-
-        logger.info(f'Caching {len(wallet_keys)} wallet keys')
-        for wallet_key in wallet_keys:
-            pk = wallet_key.get_g1()
-            puzzle = puzzle_for_pk(pk)
-            puzzle_reveals[puzzle.get_tree_hash()] = puzzle
+        logger.info(f'Loading {DERIVATIONS} hardened and unhardened wallet keys from key index')
+        key_index = KeyIndex(sk[0])
+        key_index.load(DERIVATIONS, hardened=False)
+        key_index.load(DERIVATIONS, hardened=True)
+        puzzle_reveals.key_indexes.append(key_index)
+        signer = LocalSigner([key_index], AGG_SIG_ME_ADDITIONAL_DATA, MAX_BLOCK_COST_CLVM)
+        await self.export_spends()
+
+
+    # offers are then written unsigned to SPEND_EXPORT, spend_pipeline.py signs them and writes the offer files
+    async def export_spends(self):
+        global signer
+        if SPEND_EXPORT is None:
+            return
+        logger.info(f"Exporting unsigned offers to {SPEND_EXPORT}, sign them with spend_pipeline.py")
+        await signer.close()
+        signer = SpendExport(SPEND_EXPORT)
 
 
     async def make_burn_offer(self, old_ids: List[str], new_ids: List[str], fee: int=0) -> Offer:
@@ -166,6 +192,9 @@ class Inferno:
     
 
     async def write_offer(self, offer: Offer, name: str, path: str):
+        if isinstance(signer, SpendExport):
+            signer.write_offer(offer, name)
+            return
         with open(path + "/" + name, "w") as f:
             f.write(offer.to_bech32())
 
@@ -216,11 +245,6 @@ class Inferno:
         return driver_dict
     
 
-    async def get_synthetic_private_key_for_puzzle_hash(self, puzzle_hash: bytes32):
-        # TODO new API from upstream...implement if needed
-        return None
-
-
     # transfer an NFT, held by the wallet for this app, to a new destination
     async def make_transfer_nft_spend_bundle(self, nft_launcher_id: bytes32, recipient_puzzlehash: bytes32, announcements_to_assert: Set[bytes], fee:int=0) -> Tuple[SpendBundle, bytes32]:
         logger.debug(f"Preparing spend bundle for transfer of NFT {encode_puzzle_hash(nft_launcher_id, 'nft')} to {encode_puzzle_hash(recipient_puzzlehash, PREFIX)}")
@@ -277,9 +301,7 @@ class Inferno:
             singleton_solution = Program.to([lineage_proof.to_program(), 1, nft_layer_solution])
             coin_spend = CoinSpend(coin_record.coin, full_puzzle, singleton_solution)
 
-            nft_spend_bundle = await sign_coin_spends([coin_spend], wallet_keyf,
-                                    self.get_synthetic_private_key_for_puzzle_hash,
-                                    AGG_SIG_ME_ADDITIONAL_DATA, MAX_BLOCK_COST_CLVM, [puzzle_hash_for_synthetic_public_key])
+            nft_spend_bundle = await signer.sign_coin_spends([coin_spend])
 
             return nft_spend_bundle, inner_puzzle.get_tree_hash()
         else:
@@ -301,11 +323,12 @@ async def main():
     if not os.path.isfile(csv_file):
         usage()
 
-    wallet_client = await WalletRpcClient.create(self_hostname, uint16(wallet_rpc_port), DEFAULT_ROOT_PATH, config)
-    node_client = await FullNodeRpcClient.create(self_hostname, uint16(full_node_rpc_port), DEFAULT_ROOT_PATH, config)
+    # repeated lookups (launchers, parents) are only sent to the node once
+    rpc = await RpcSession.create(config, wallet=True)
 
     try:
-        inferno = Inferno(target, wallet_client, node_client)
+        inferno = Inferno(target, rpc.wallet_client, rpc.node_client)
+        await inferno.load_keys(FINGERPRINT)
 
         logger.info(f"Loading CSV from: {csv_file}")
 
@@ -319,20 +342,9 @@ async def main():
                     offer: Offer = await inferno.make_burn_offer(old_ids, new_ids, fee)
                     await inferno.write_offer(offer, "_".join(old_ids) + ".offer", target)
     finally:
-        wallet_client.close()
-        node_client.close()
-        await wallet_client.await_closed()
-        await node_client.await_closed()
-
-
-def wallet_keyf(pk):
-    logger.info(f'Looking for wallet keys to sign spend, PK: {pk}')
-    for wallet_key in wallet_keys:
-        synth_key = calculate_synthetic_secret_key(wallet_key, DEFAULT_HIDDEN_PUZZLE_HASH)
-        if synth_key.get_g1() == pk:
-            logger.info('Found key!')
-            return synth_key
-    raise RuntimeError("Evaluated all keys without finding PK match!")
+        await rpc.close()
+        if signer is not None:
+            await signer.close()
 
 
 def usage():
@@ -1,8 +1,8 @@
 import asyncio
 import json
+import os
 import sys
 
-from chia.rpc.full_node_rpc_client import FullNodeRpcClient
 from chia.types.blockchain_format.program import Program, SerializedProgram
 from chia.types.blockchain_format.sized_bytes import bytes32
 from chia.types.coin_spend import CoinSpend
@@ -12,62 +12,79 @@ from chia.util.default_root import DEFAULT_ROOT_PATH
 from chia.util.ints import uint16, uint64
 from chia.wallet.nft_wallet.uncurry_nft import UncurriedNFT
 
+# modules shared by every tool live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from key_index import KeyIndex, observer_master_pk
+from rpc_session import RpcSession
+
 config = load_config(DEFAULT_ROOT_PATH, "config.yaml")
 self_hostname = "localhost"
 full_node_rpc_port = config["full_node"]["rpc_port"] # 8555
 wallet_rpc_port = config["wallet"]["rpc_port"] # 9256
 prefix = "xch"
 
-async def list_nfts(address, puzzle_hash):  
-    try:
-        node_client = await FullNodeRpcClient.create(self_hostname, uint16(full_node_rpc_port), DEFAULT_ROOT_PATH, config)
-        all_coins = await node_client.get_coin_records_by_hint(puzzle_hash, False, 0)
+# DERIVATIONS - how many unhardened addresses to list when scanning a whole wallet
+DERIVATIONS = int(os.environ.get('DERIVATIONS', 1000))
 
-        print("************************************************************************************************************************************")
-        print(f"* searching {len(all_coins)} unspent coins in address {address} *")
-        print("************************************************************************************************************************************")
-        for coin_record in all_coins:
-            try:
-                if coin_record.coin.puzzle_hash != puzzle_hash:
-                    parent_coin_record = await node_client.get_coin_record_by_name(coin_record.coin.parent_coin_info)
-                    assert parent_coin_record is not None
-                    puzzle_and_solution: CoinSpend = await node_client.get_puzzle_and_solution(coin_id=coin_record.coin.parent_coin_info, height=parent_coin_record.spent_block_index)
-                    parent_puzzle_reveal = puzzle_and_solution.puzzle_reveal
+async def list_nfts(node_client, address, puzzle_hash):  
+    all_coins = await node_client.get_coin_records_by_hint(puzzle_hash, False, 0)
 
-                    try:
-                        nft_program = Program.from_bytes(bytes(parent_puzzle_reveal))
-                        nft = UncurriedNFT.uncurry(*nft_program.uncurry())
+    print("************************************************************************************************************************************")
+    print(f"* searching {len(all_coins)} unspent coins in address {address} *")
+    print("************************************************************************************************************************************")
+    for coin_record in all_coins:
+        try:
+            if coin_record.coin.puzzle_hash != puzzle_hash:
+                parent_coin_record = await node_client.get_coin_record_by_name(coin_record.coin.parent_coin_info)
+                assert parent_coin_record is not None
+                puzzle_and_solution: CoinSpend = await node_client.get_puzzle_and_solution(coin_id=coin_record.coin.parent_coin_info, height=parent_coin_record.spent_block_index)
+                parent_puzzle_reveal = puzzle_and_solution.puzzle_reveal
 
-                        if nft is not None and nft.transfer_program_curry_params:
-                            nft_puzzle_hash = bytes32.from_bytes(nft.transfer_program_curry_params.as_python()[0][1])
-                            print(f"{nft_puzzle_hash.hex()} -> {encode_puzzle_hash(nft_puzzle_hash, 'nft')}")
-                            print(f"\t last solution: '{puzzle_and_solution.solution}'\n\n")
-                    except Exception as e:
-                        print(f"Probably not an NFT? {repr(e)}")
-                        pass 
-            except Exception as e: 
-                print('Failed on: ')
-                print(repr(e))
-                print('\r\n...Continuing to next coin')
-    finally:
-        node_client.close()
-        await node_client.await_closed()
+                try:
+                    nft_program = Program.from_bytes(bytes(parent_puzzle_reveal))
+                    nft = UncurriedNFT.uncurry(*nft_program.uncurry())
+
+                    if nft is not None and nft.transfer_program_curry_params:
+                        nft_puzzle_hash = bytes32.from_bytes(nft.transfer_program_curry_params.as_python()[0][1])
+                        print(f"{nft_puzzle_hash.hex()} -> {encode_puzzle_hash(nft_puzzle_hash, 'nft')}")
+                        print(f"\t last solution: '{puzzle_and_solution.solution}'\n\n")
+                except Exception as e:
+                    print(f"Probably not an NFT? {repr(e)}")
+                    pass 
+        except Exception as e: 
+            print('Failed on: ')
+            print(repr(e))
+            print('\r\n...Continuing to next coin')
 
 def usage():
     print(f"Usage: python list_nfts.py <ADDRESS>\r\n")
+    print(f"       MASTER_PUBLIC_KEY=<hex> python list_nfts.py (lists every unhardened address of the wallet, no keychain needed)\r\n")
     exit(-1)
 
+async def list_wallet_nfts(node_client, master_pk):
+    key_index = KeyIndex.observer(master_pk)
+    key_index.load(DERIVATIONS)
+    for entry in key_index.entries():
+        await list_nfts(node_client, encode_puzzle_hash(entry.puzzle_hash, prefix), entry.puzzle_hash)
+
 async def main():
     arg_count = len(sys.argv)
-    
-    if(arg_count != 2):
+
+    master_pk = observer_master_pk()
+    if (arg_count != 1 or master_pk is None) and arg_count != 2:
         usage()
         exit(1)
 
-    address = sys.argv[1]
-    puzzle_hash = decode_puzzle_hash(address)
-
-    await list_nfts(address, puzzle_hash)
+    rpc = await RpcSession.create(config)
+    try:
+        if arg_count == 1:
+            await list_wallet_nfts(rpc.node_client, master_pk)
+        else:
+            address = sys.argv[1]
+            puzzle_hash = decode_puzzle_hash(address)
+            await list_nfts(rpc.node_client, address, puzzle_hash)
+    finally:
+        await rpc.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
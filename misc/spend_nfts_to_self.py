@@ -1,6 +1,5 @@
 from blspy import G2Element
 
-from chia.rpc.full_node_rpc_client import FullNodeRpcClient
 from chia.types.blockchain_format.program import Program, SerializedProgram
 from chia.types.blockchain_format.sized_bytes import bytes32
 from chia.types.coin_record import CoinRecord
@@ -18,9 +17,14 @@ from chia.wallet.nft_wallet.uncurry_nft import UncurriedNFT
 
 import asyncio
 import json
+import os
 import sys
 import traceback
 
+# modules shared by every tool live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from rpc_session import RpcSession
+
 config = load_config(DEFAULT_ROOT_PATH, "config.yaml")
 self_hostname = "localhost"
 full_node_rpc_port = config["full_node"]["rpc_port"] # 8555
@@ -31,8 +35,9 @@ def print_json(dict):
     print(json.dumps(dict, sort_keys=True, indent=4))
 
 async def spend_nfts(address, puzzle_hash):  
+    rpc = await RpcSession.create(config)
     try:
-        node_client = await FullNodeRpcClient.create(self_hostname, uint16(full_node_rpc_port), DEFAULT_ROOT_PATH, config)
+        node_client = rpc.node_client
         all_coins = await node_client.get_coin_records_by_hint(puzzle_hash, False, 0)
 
         print("************************************************************************************************************************************")
@@ -141,8 +146,7 @@ async def spend_nfts(address, puzzle_hash):
                 #print(repr(e))
                 print('\r\n...Continuing to next coin')
     finally:
-        node_client.close()
-        await node_client.await_closed()
+        await rpc.close()
 
 def usage():
     print(f"Usage: python spend_nfts_to_self.py <ADDRESS>\r\n")
@@ -0,0 +1,105 @@
+import functools
+
+import pytest
+
+from blspy import AugSchemeMPL
+
+import wallet_repair
+from key_index import KeyIndex
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.util.ints import uint32, uint64
+
+MASTER_SK = AugSchemeMPL.key_gen(bytes([9] * 32))
+
+
+class FakeNodeClient:
+
+    def __init__(self, used_puzzlehashes):
+        self.used_puzzlehashes = set(used_puzzlehashes)
+        self.queries = 0
+        self.request_sizes = []
+
+    async def get_coin_records_by_puzzle_hashes(self, puzzle_hashes, include_spent_coins=True, start_height=None, end_height=None):
+        self.queries += 1
+        self.request_sizes.append(len(puzzle_hashes))
+        coin_records = []
+        for puzzle_hash in puzzle_hashes:
+            if puzzle_hash in self.used_puzzlehashes:
+                coin = Coin(bytes32(b'\x01' * 32), puzzle_hash, uint64(1))
+                coin_records.append(CoinRecord(coin, uint32(1), uint32(0), False, uint64(0)))
+        return coin_records
+
+
+class TestWalletRepair:
+
+    @pytest.fixture
+    def key_index(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(wallet_repair, "SCAN_STATE_PATH", tmp_path / "state")
+        monkeypatch.setattr(wallet_repair, "GAP_LIMIT", 10)
+        monkeypatch.setattr(wallet_repair, "SCAN_WINDOW", 5)
+        monkeypatch.setattr(wallet_repair, "CATS", {})
+        index = KeyIndex(MASTER_SK, tmp_path / "keys")
+        yield index
+        index.close()
+
+    @pytest.mark.asyncio
+    async def test_scan_stops_after_gap_limit(self, key_index):
+        key_index.load(20, hardened=True)
+        node_client = FakeNodeClient([key_index.entry(3, True).puzzle_hash, key_index.entry(12, True).puzzle_hash])
+
+        assert await wallet_repair.scan_derivations(node_client, key_index) == 13
+        # windows 0-4, 5-9, 10-14, 15-19, 20-24 -> gap of 12 after index 12
+        assert node_client.queries == 5
+        assert wallet_repair.load_high_water_mark(key_index.fingerprint) == 12
+
+    @pytest.mark.asyncio
+    async def test_scan_resumes_from_high_water_mark(self, key_index):
+        wallet_repair.save_high_water_mark(key_index.fingerprint, 30)
+        node_client = FakeNodeClient([])
+
+        assert await wallet_repair.scan_derivations(node_client, key_index) == 31
+        # windows 31-35 and 36-40 reach the gap limit
+        assert node_client.queries == 2
+
+    @pytest.mark.asyncio
+    async def test_scan_windows_are_chunked(self, key_index, monkeypatch):
+        monkeypatch.setattr(wallet_repair, "get_coin_records_by_puzzle_hashes", functools.partial(wallet_repair.get_coin_records_by_puzzle_hashes, chunk_size=4))
+        key_index.load(5, hardened=False)
+        key_index.load(5, hardened=True)
+        node_client = FakeNodeClient([key_index.entry(3, True).puzzle_hash])
+
+        assert await wallet_repair.find_used_derivations(node_client, key_index, 0, 5) == {3}
+        assert node_client.request_sizes == [4, 4, 2]
+
+    @pytest.mark.asyncio
+    async def test_unused_wallet(self, key_index):
+        node_client = FakeNodeClient([])
+        assert await wallet_repair.scan_derivations(node_client, key_index) == 0
+
+    @pytest.mark.asyncio
+    async def test_observer_scan_uses_unhardened_keys_only(self, key_index, tmp_path):
+        key_index.load(5)
+        observer = KeyIndex.observer(MASTER_SK.get_g1(), tmp_path / "keys")
+        node_client = FakeNodeClient([key_index.entry(4, False).puzzle_hash])
+
+        assert await wallet_repair.scan_derivations(node_client, observer) == 5
+        assert list(observer._files.keys()) == [False]
+        observer.close()
+
+    @pytest.mark.asyncio
+    async def test_signer_daemon_scan_reads_indexed_hardened_keys(self, key_index, tmp_path, monkeypatch):
+        monkeypatch.setattr(wallet_repair, "hardened_indexed", True)
+        key_index.load(5)
+        key_index.load(5, hardened=True)
+        observer = KeyIndex.observer(MASTER_SK.get_g1(), tmp_path / "keys")
+        observer.load(5)
+        observer.load(5, hardened=True)
+
+        assert await wallet_repair.find_used_derivations(FakeNodeClient([key_index.entry(2, True).puzzle_hash]), observer, 0, 5) == {2}
+        # deeper than the daemon indexed fails loudly rather than skipping hardened addresses
+        with pytest.raises(RuntimeError):
+            observer.load(6, hardened=True)
+        observer.close()
@@ -1,6 +1,9 @@
 import asyncio
+import json
 import os
 import sys
+from pathlib import Path
+from typing import Dict, Set, Tuple
 
 from chia.consensus.coinbase import create_puzzlehash_for_pk
 from chia.consensus.default_constants import DEFAULT_CONSTANTS
@@ -34,9 +37,18 @@ from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
     calculate_synthetic_secret_key,
     puzzle_for_pk
 )
-from chia.wallet.sign_coin_spends import sign_coin_spends
 from chia.wallet.wallet import Wallet
 
+# modules shared by every tool live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from coin_lookup import get_coin_records_by_hints, get_coin_records_by_puzzle_hashes
+from key_index import KeyIndex, PuzzleReveals, observer_master_pk
+from lineage_cache import LineageProofCache
+from rpc_session import RpcSession
+from scan_checkpoints import ScanCheckpoints
+from signer import SIGNER_SOCKET, LocalSigner, SignerClient
+from spend_pipeline import SPEND_EXPORT, SpendExport, push_or_export
+
 
 config = load_config(DEFAULT_ROOT_PATH, "config.yaml")
 self_hostname = "localhost"
@@ -55,88 +67,92 @@ CATS = {
 # DERIVATIONS - how deep to look in the wallet
 DERIVATIONS = int(os.environ.get('DERIVATIONS', 8150))
 
-global wallet_keys
-wallet_keys = []
-
-wallet = Wallet()
-
-puzzle_reveals = dict()
-
-def wallet_keyf(pk):
-    print(f'Looking for wallet keys to sign spend, PK: {pk}')
-    for wallet_key in wallet_keys:
-        synth_key = calculate_synthetic_secret_key(wallet_key, DEFAULT_HIDDEN_PUZZLE_HASH)
-        if synth_key.get_g1() == pk:
-            return synth_key
-    raise Exception("Evaluated all keys without finding PK match!")
-
-async def fix_unhinted_coins(address, hint_puzzlehash, actual_puzzlehash, cat_asset_id: str = None):
-    try:
-        coin_records = dict()
-        node_client = await FullNodeRpcClient.create(self_hostname, uint16(full_node_rpc_port), DEFAULT_ROOT_PATH, config)
-        all_coins_by_hash = await node_client.get_coin_records_by_puzzle_hash(actual_puzzlehash, False, 0)
-        sum_by_hash = 0
-        for coin_record in all_coins_by_hash:
-            coin: Coin = coin_record.coin
-            coin_records[coin.name().hex()] = coin_record
-            sum_by_hash += int(coin.amount)
-
-        sum_by_hint = 0
-        all_coins_by_hint = await node_client.get_coin_records_by_hint(hint=hint_puzzlehash)
-        for coin_record in all_coins_by_hint:
-            coin: Coin = coin_record.coin
-            sum_by_hint += int(coin.amount)
-
-        if sum_by_hash > sum_by_hint:
-            hash_coin_ids = set(map(lambda x: x.coin.name().hex(), all_coins_by_hash))
-            hint_coin_ids = set(map(lambda x: x.coin.name().hex(), all_coins_by_hint))
-            difference = hash_coin_ids.difference(hint_coin_ids)
-            print(f'Address: {address}.  Hash found {sum_by_hash}, hint found {sum_by_hint}, difference is coins: {difference}')
+# GAP_LIMIT - when set, derive and query SCAN_WINDOW indices at a time and stop after
+# GAP_LIMIT unused indices in a row instead of always looking DERIVATIONS deep
+GAP_LIMIT = int(os.environ.get('GAP_LIMIT', 0))
+SCAN_WINDOW = int(os.environ.get('SCAN_WINDOW', 200))
+SCAN_STATE_PATH = Path(os.environ.get('SCAN_STATE_PATH', DEFAULT_ROOT_PATH / "runtime_data" / "wallet_repair"))
 
-            for coin_id in difference:
-                coin_record = coin_records[coin_id]
-                await spend_coin(node_client, coin_record, hint_puzzlehash, address_puzzlehash=actual_puzzlehash, cat_asset_id=cat_asset_id)
-
-        #if len(all_coins_by_hash) > 0:
-        #    print(f'Found {len(all_coins_by_hash)} coins by hash')
-
-    finally:
-        node_client.close()
-        await node_client.await_closed()
+global key_index
+key_index: KeyIndex = None
 
+wallet = Wallet()
 
-async def migrate_coins(current_address, new_puzzlehash, current_actual_puzzlehash, cat_asset_id: str = None):  
-    try:
-        node_client = await FullNodeRpcClient.create(self_hostname, uint16(full_node_rpc_port), DEFAULT_ROOT_PATH, config)
-        all_coins_by_hash = await node_client.get_coin_records_by_puzzle_hash(current_actual_puzzlehash, False, 0)
+puzzle_reveals = PuzzleReveals()
+lineage_proofs = LineageProofCache()
+
+# set when a signer daemon has indexed the hardened keys an observer key index can't derive
+hardened_indexed = False
+
+# LocalSigner over the keychain, SignerClient when SIGNER_SOCKET is set, or SpendExport when SPEND_EXPORT is set. None in observer mode
+signer = None
+
+async def fix_unhinted_coins(node_client: FullNodeRpcClient, addresses: Dict[bytes32, Tuple[str, bytes32]], cat_asset_id: str = None, checkpoints: ScanCheckpoints = None):
+    # addresses maps each actual puzzle hash to its (address, hint puzzle hash)
+    start_height = None if checkpoints is None else checkpoints.start_height(list(addresses.keys()))
+    coin_records_by_hash = await get_coin_records_by_puzzle_hashes(node_client, list(addresses.keys()), start_height=start_height)
+    if checkpoints is not None:
+        checkpoints.done([puzzlehash for puzzlehash, coin_records in coin_records_by_hash.items() if len(coin_records) == 0])
+    coin_records_by_hash = {puzzlehash: coin_records for puzzlehash, coin_records in coin_records_by_hash.items() if len(coin_records) > 0}
+    if len(coin_records_by_hash) == 0:
+        return
+
+    # only addresses actually holding coins need their hints checked
+    all_coins_by_hint = await get_coin_records_by_hints(node_client, [addresses[puzzlehash][1] for puzzlehash in coin_records_by_hash], start_height=start_height)
+    hint_coin_ids = set(map(lambda x: x.coin.name(), all_coins_by_hint))
+
+    for puzzlehash, all_coins_by_hash in coin_records_by_hash.items():
+        (address, hint_puzzlehash) = addresses[puzzlehash]
+        sum_by_hash = sum(int(coin_record.coin.amount) for coin_record in all_coins_by_hash)
+        unhinted = [coin_record for coin_record in all_coins_by_hash if coin_record.coin.name() not in hint_coin_ids]
+        if len(unhinted) == 0:
+            if checkpoints is not None:
+                checkpoints.done([puzzlehash])
+            continue
+        difference = set(coin_record.coin.name().hex() for coin_record in unhinted)
+        sum_by_hint = sum_by_hash - sum(int(coin_record.coin.amount) for coin_record in unhinted)
+        print(f'Address: {address}.  Hash found {sum_by_hash}, hint found {sum_by_hint}, difference is coins: {difference}')
+
+        if signer is None:
+            print('Observer mode, leaving unhinted coins in place')
+            continue
+
+        spent = [await spend_coin(node_client, coin_record, hint_puzzlehash, address_puzzlehash=puzzlehash, cat_asset_id=cat_asset_id) for coin_record in unhinted]
+        if checkpoints is not None and all(spent) and not isinstance(signer, SpendExport):
+            # the checkpoint moves once the repaired coins are seen spent, exported ones are not spent yet
+            checkpoints.done([puzzlehash], [coin_record.name for coin_record in unhinted])
+
+
+async def migrate_coins(node_client: FullNodeRpcClient, addresses: Dict[bytes32, Tuple[str, bytes32]], new_puzzlehash, cat_asset_id: str = None, checkpoints: ScanCheckpoints = None):
+    start_height = None if checkpoints is None else checkpoints.start_height(list(addresses.keys()))
+    coin_records_by_hash = await get_coin_records_by_puzzle_hashes(node_client, list(addresses.keys()), start_height=start_height)
+    for current_actual_puzzlehash, all_coins_by_hash in coin_records_by_hash.items():
         sum_by_hash = 0
         for coin_record in all_coins_by_hash:
             sum_by_hash += int(coin_record.coin.amount)
 
         if sum_by_hash > 0:
-            print(f'Address: {current_address}.  Hash found {sum_by_hash}. Will migrate {len(all_coins_by_hash)} coins.')
+            print(f'Address: {addresses[current_actual_puzzlehash][0]}.  Hash found {sum_by_hash}. Will migrate {len(all_coins_by_hash)} coins.')
 
-        for coin_record in all_coins_by_hash:
-            await spend_coin(node_client, coin_record, new_puzzlehash, address_puzzlehash=current_actual_puzzlehash, cat_asset_id=cat_asset_id)
-
-    finally:
-        node_client.close()
-        await node_client.await_closed()
+        spent = [await spend_coin(node_client, coin_record, new_puzzlehash, address_puzzlehash=current_actual_puzzlehash, cat_asset_id=cat_asset_id) for coin_record in all_coins_by_hash]
+        if checkpoints is not None and all(spent) and not isinstance(signer, SpendExport):
+            checkpoints.done([current_actual_puzzlehash], [coin_record.name for coin_record in all_coins_by_hash])
 
 
-async def spend_coin(node_client, coin_record: CoinRecord, hint_puzzlehash: bytes32, address_puzzlehash: bytes32 = None, cat_asset_id = None):
+async def spend_coin(node_client, coin_record: CoinRecord, hint_puzzlehash: bytes32, address_puzzlehash: bytes32 = None, cat_asset_id = None) -> bool:
     print(f'spend_coin: {coin_record.coin.name().hex()}')
 
     if address_puzzlehash is None:
         address_puzzlehash = hint_puzzlehash
 
-    puzzle_reveal = puzzle_reveals[coin_record.coin.puzzle_hash]
+    puzzle_reveal = puzzle_reveals.get(coin_record.coin.puzzle_hash)
 
     if puzzle_reveal is None:
-        puzzle_reveal = puzzle_reveals[hint_puzzlehash]
+        puzzle_reveal = puzzle_reveals.get(hint_puzzlehash)
 
     if puzzle_reveal is None:
         print("WARNING: Checked all known keys for valid puzzle reveal. Failed to find any.")
+        return False
     else:
         spend_bundle: SpendBundle = None
         primaries = [{"puzzlehash": hint_puzzlehash, "amount": coin_record.coin.amount, "memos": [hint_puzzlehash]}]
@@ -145,36 +161,28 @@ async def spend_coin(node_client, coin_record: CoinRecord, hint_puzzlehash: byte
         )
         if cat_asset_id is not None:
             spend_bundle = await calculate_cat_spend_bundle(coin_record, node_client, cat_asset_id, address_puzzlehash, puzzle_reveal, inner_solution)
-            spend_bundle = await sign_coin_spends(spend_bundle.coin_spends, wallet_keyf, AGG_SIG_ME_ADDITIONAL_DATA, MAX_BLOCK_COST_CLVM)
+            spend_bundle = await signer.sign_coin_spends(spend_bundle.coin_spends)
         else:
             coin_spend = CoinSpend(
                 coin_record.coin,
                 puzzle_reveal,
                 inner_solution
             )
-            spend_bundle = await sign_coin_spends([coin_spend], wallet_keyf, AGG_SIG_ME_ADDITIONAL_DATA, MAX_BLOCK_COST_CLVM)
+            spend_bundle = await signer.sign_coin_spends([coin_spend])
 
-        await node_client.push_tx(spend_bundle)
+        await push_or_export(node_client, signer, spend_bundle)
+        return True
 
 
 async def calculate_cat_spend_bundle(coin_record: CoinRecord, node_client: FullNodeRpcClient, cat_asset_id: str, address_puzzlehash: bytes32, puzzle: Program, inner_solution: Program) -> SpendBundle:
     coin: Coin = coin_record.coin
-    parent_coin_record: CoinRecord = await node_client.get_coin_record_by_name(coin.parent_coin_info)
-
-    parent_coin: Coin = parent_coin_record.coin
 
     # cross-check cat puzzle hash
     cat_puzzle = construct_cat_puzzle(CAT_MOD, bytes.fromhex(cat_asset_id), puzzle)
 
     assert cat_puzzle.get_tree_hash() == address_puzzlehash
     assert coin.puzzle_hash == cat_puzzle.get_tree_hash()
-    parent_coin_spend: CoinSpend = await node_client.get_puzzle_and_solution(parent_coin.name(), parent_coin_record.spent_block_index)
- 
-    parent_puzzle_reveal: SerializedProgram = parent_coin_spend.puzzle_reveal
-    _, curried_args = parent_puzzle_reveal.uncurry()
-    list_args = list(curried_args.as_iter())
-    parent_inner_puzzlehash: bytes32 = list_args[-1].get_tree_hash()
-    lineage_proof = LineageProof(parent_coin.parent_coin_info, parent_inner_puzzlehash, parent_coin.amount)
+    lineage_proof = await lineage_proofs.lineage_proof(node_client, coin.parent_coin_info)
     
     spendable_cat = SpendableCAT(coin, bytes.fromhex(cat_asset_id), puzzle, inner_solution, Program.to([]), lineage_proof, 0)
 
@@ -198,12 +206,73 @@ def calculate_cat_address(address, asset_id):
     return (encode_puzzle_hash(outer_puzzlehash, prefix), outer_puzzlehash)    
 
 
+def hardened_flags(key_index: KeyIndex):
+    # hardened keys can't be derived from a master public key, only read where a signer daemon indexed them
+    return (False,) if key_index.is_observer and not hardened_indexed else (False, True)
+
+
+def load_high_water_mark(fingerprint: int) -> int:
+    path = SCAN_STATE_PATH / f"{fingerprint}.json"
+    if not path.exists():
+        return -1
+    with open(path, 'r') as f:
+        return json.load(f)["high_water_mark"]
+
+
+def save_high_water_mark(fingerprint: int, high_water_mark: int):
+    SCAN_STATE_PATH.mkdir(parents=True, exist_ok=True)
+    with open(SCAN_STATE_PATH / f"{fingerprint}.json", 'w') as f:
+        json.dump({"high_water_mark": high_water_mark}, f)
+
+
+async def find_used_derivations(node_client: FullNodeRpcClient, key_index: KeyIndex, start: int, end: int) -> Set[int]:
+    # an index is used if any of its hardened/unhardened XCH or CAT puzzle hashes ever held a coin
+    derivation_by_puzzlehash = dict()
+    for i in range(start, end):
+        for hardened in hardened_flags(key_index):
+            puzzlehash = key_index.entry(i, hardened).puzzle_hash
+            derivation_by_puzzlehash[puzzlehash] = i
+            for asset_id in CATS.values():
+                (_, cat_puzzlehash) = calculate_cat_address(encode_puzzle_hash(puzzlehash, PREFIX), asset_id)
+                derivation_by_puzzlehash[cat_puzzlehash] = i
+
+    # a window with many CATs is more puzzle hashes than one request should carry
+    coin_records_by_hash = await get_coin_records_by_puzzle_hashes(node_client, list(derivation_by_puzzlehash.keys()), include_spent_coins=True)
+    return set(derivation_by_puzzlehash[puzzlehash] for puzzlehash, coin_records in coin_records_by_hash.items() if len(coin_records) > 0)
+
+
+async def scan_derivations(node_client: FullNodeRpcClient, key_index: KeyIndex) -> int:
+    high_water_mark = load_high_water_mark(key_index.fingerprint)
+    if high_water_mark >= 0:
+        print(f'Resuming scan after saved high water mark {high_water_mark}')
+
+    last_used = high_water_mark
+    start = high_water_mark + 1
+    while start - last_used - 1 < GAP_LIMIT:
+        end = start + SCAN_WINDOW
+        for hardened in hardened_flags(key_index):
+            key_index.load(end, hardened=hardened)
+        used = await find_used_derivations(node_client, key_index, start, end)
+        if len(used) > 0:
+            last_used = max(used)
+        print(f'Scanned derivations {start}-{end - 1}, {len(used)} used, last used {last_used}')
+        start = end
+
+    save_high_water_mark(key_index.fingerprint, last_used)
+    return last_used + 1
+
+
 def usage():
     print('USAGE: python wallet_repair.py <WALLET_FINGERPRINT_TO_FIX> <optional:NEW XCH ADDRESS>')
+    print('       GAP_LIMIT=<unused indices> scans only as deep as the wallet has been used (DERIVATIONS is ignored)')
+    print('       MASTER_PUBLIC_KEY=<hex> audits unhardened addresses without the keychain and spends nothing')
+    print('       SIGNER_SOCKET=<path> signs through a running signer.py, hardened addresses as deep as it indexed them')
+    print('       SPEND_EXPORT=<file> writes the repair spends there unsigned, for spend_pipeline.py to sign and push')
     exit(1)
 
 
 async def main():
+    global key_index, signer, hardened_indexed
     argc = len(sys.argv)
     if argc < 2 or argc > 3:
         usage()
@@ -217,53 +286,88 @@ async def main():
         if not new_xch_address.startswith(PREFIX) or len(new_xch_address) != 62:
             usage()
 
-    print(f'Loading private keys from keychain for fingerprint {fingerprint}')
-    print(f'Is keychain locked? {Keychain.is_keyring_locked()}')
-    keychain = Keychain()
-    sk = keychain.get_private_key_by_fingerprint(fingerprint)
-
-    print(f'Deriving {DERIVATIONS} addresses (both hardened and unhardened)')
-    addresses = set()
-    for i in range(DERIVATIONS):
-        wk1 = master_sk_to_wallet_sk_unhardened(sk[0], i)
-        wk2 = master_sk_to_wallet_sk(sk[0], i)
-        wallet_keys.append(wk1)
-        wallet_keys.append(wk2)
-        # unhardened
-        ph = create_puzzlehash_for_pk(wk1.get_g1())
-        address = encode_puzzle_hash(ph, PREFIX)
-        addresses.add(address)
-        # hardened
-        ph = create_puzzlehash_for_pk(wk2.get_g1())
-        address = encode_puzzle_hash(ph, PREFIX)
-        addresses.add(address)
-
-    print(f'Caching {len(wallet_keys)} wallet keys')
-    for wallet_key in wallet_keys:
-        pk = wallet_key.get_g1()
-        puzzle = puzzle_for_pk(pk)
-        puzzle_reveals[puzzle.get_tree_hash()] = puzzle
+    master_pk = observer_master_pk()
+    if master_pk is not None:
+        if new_xch_address is not None and SPEND_EXPORT is None:
+            print('Migrating coins needs private keys, unset MASTER_PUBLIC_KEY or set SPEND_EXPORT')
+            usage()
+        if master_pk.get_fingerprint() != fingerprint:
+            print(f'MASTER_PUBLIC_KEY has fingerprint {master_pk.get_fingerprint()}, not {fingerprint}')
+            usage()
+        print(f'Observer mode for fingerprint {fingerprint}: auditing unhardened addresses only')
+        key_index = KeyIndex.observer(master_pk)
+    elif SIGNER_SOCKET is not None:
+        print(f'Signing through signer daemon at {SIGNER_SOCKET}: hardened addresses only as deep as the daemon indexed them')
+        signer = SignerClient(SIGNER_SOCKET)
+        hardened_indexed = True
+        master_pks = [pk for pk in await signer.get_public_keys() if pk.get_fingerprint() == fingerprint]
+        if len(master_pks) != 1:
+            print(f'Signer daemon does not hold fingerprint {fingerprint}')
+            usage()
+        key_index = KeyIndex.observer(master_pks[0])
+    else:
+        print(f'Loading private keys from keychain for fingerprint {fingerprint}')
+        print(f'Is keychain locked? {Keychain.is_keyring_locked()}')
+        keychain = Keychain()
+        sk = keychain.get_private_key_by_fingerprint(fingerprint)
+        key_index = KeyIndex(sk[0])
+        signer = LocalSigner([key_index], AGG_SIG_ME_ADDITIONAL_DATA, MAX_BLOCK_COST_CLVM)
+    if SPEND_EXPORT is not None:
+        # the spends are built from public keys alone, an observer key index is enough
+        print(f'Exporting unsigned repair spends to {SPEND_EXPORT}, sign and push them with spend_pipeline.py')
+        if signer is not None:
+            await signer.close()
+        signer = SpendExport(SPEND_EXPORT)
+
+    # one node connection for the whole run
+    rpc = await RpcSession.create(config)
+    # repairing and migrating leave different coins behind, so they keep separate checkpoints
+    checkpoints = ScanCheckpoints("wallet_repair" if new_xch_address is None else "wallet_repair_migrate")
+    try:
+        await checkpoints.begin(rpc.node_client)
+        derivations = DERIVATIONS
+        if GAP_LIMIT > 0:
+            print(f'Scanning for used addresses with a gap limit of {GAP_LIMIT}')
+            derivations = await scan_derivations(rpc.node_client, key_index)
+
+        print(f'Loading {derivations} addresses from key index')
+        for hardened in hardened_flags(key_index):
+            key_index.load(derivations, hardened=hardened)
+        addresses = set()
+        for entry in key_index.entries():
+            address = encode_puzzle_hash(entry.puzzle_hash, PREFIX)
+            addresses.add(address)
+        puzzle_reveals.key_indexes.append(key_index)
     
-    print('XCH')
-    for address in addresses:
-        puzzlehash = decode_puzzle_hash(address)
-        if new_xch_address is None:
-            await fix_unhinted_coins(address, puzzlehash, puzzlehash)
-        else:
+        new_hint_puzzlehash = None
+        if new_xch_address is not None:
             new_hint_puzzlehash = decode_puzzle_hash(new_xch_address)
-            await migrate_coins(address, new_hint_puzzlehash, puzzlehash)
 
-    for cat, asset_id in CATS.items():
-        print(cat, asset_id)
+        print('XCH')
+        xch_addresses = dict()
         for address in addresses:
-            (cat_address, cat_puzzlehash) = calculate_cat_address(address, asset_id)
-            raw_puzzlehash = decode_puzzle_hash(address)
+            puzzlehash = decode_puzzle_hash(address)
+            xch_addresses[puzzlehash] = (address, puzzlehash)
+        if new_xch_address is None:
+            await fix_unhinted_coins(rpc.node_client, xch_addresses, checkpoints=checkpoints)
+        else:
+            await migrate_coins(rpc.node_client, xch_addresses, new_hint_puzzlehash, checkpoints=checkpoints)
+
+        for cat, asset_id in CATS.items():
+            print(cat, asset_id)
+            cat_addresses = dict()
+            for address in addresses:
+                (cat_address, cat_puzzlehash) = calculate_cat_address(address, asset_id)
+                cat_addresses[cat_puzzlehash] = (cat_address, decode_puzzle_hash(address))
             if new_xch_address is None:
-                await fix_unhinted_coins(cat_address, raw_puzzlehash, cat_puzzlehash, asset_id)
+                await fix_unhinted_coins(rpc.node_client, cat_addresses, asset_id, checkpoints)
             else:
-                new_hint_puzzlehash = decode_puzzle_hash(new_xch_address)
-                await migrate_coins(address, new_hint_puzzlehash, puzzlehash)
-
+                await migrate_coins(rpc.node_client, cat_addresses, new_hint_puzzlehash, asset_id, checkpoints)
+    finally:
+        checkpoints.save()
+        await rpc.close()
+        if signer is not None:
+            await signer.close()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,11 @@
 import asyncio
 from blspy import G2Element
-from collections import deque
+import io
 import json
 import os
 import sys
 import time
-from typing import List
+from typing import Dict, List, TextIO, Tuple
 
 from chia.consensus.default_constants import DEFAULT_CONSTANTS
 AGG_SIG_ME_ADDITIONAL_DATA = DEFAULT_CONSTANTS.AGG_SIG_ME_ADDITIONAL_DATA
@@ -51,6 +51,19 @@ from chia.wallet.util.tx_config import CoinSelectionConfig
 from chia.wallet.wallet import Wallet
 from clvm_tools.clvmc import compile_clvm
 
+# modules shared by every tool live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from coin_lookup import get_coin_records_by_puzzle_hashes
+from fee_payer import FeePayer
+from key_index import KeyIndex, PuzzleReveals
+from lineage_cache import LineageProofCache
+from rpc_session import RpcSession
+from scan_checkpoints import ScanCheckpoints
+from signer import SIGNER_SOCKET, LocalSigner, SignerClient
+from spend_cost import SpendNotYetValid, mempool_peak, validate_spend_bundle
+from spend_pipeline import SPEND_EXPORT, SpendExport
+from tail_registry import load_cats
+
 from pathlib import Path
 
 config = load_config(DEFAULT_ROOT_PATH, "config.yaml")
@@ -59,200 +72,158 @@ full_node_rpc_port = config["full_node"]["rpc_port"] # 8555
 wallet_rpc_port = config["wallet"]["rpc_port"] # 9256
 prefix = "xch"
 
-global wallet_keys
-wallet_keys = []
+global key_indexes
+key_indexes: List[KeyIndex] = []
+puzzle_reveals = PuzzleReveals(key_indexes)
+lineage_proofs = LineageProofCache()
+
+# LocalSigner, SignerClient when a signer daemon is running (SIGNER_SOCKET), or SpendExport when exporting (SPEND_EXPORT)
+signer = None
 
 MIN_FEE = 1
-MAX_FEE = 50000
+# MAX_FEE - most mojos paid in fees for one bundle, however high the node's fee estimate
+MAX_FEE = int(os.environ.get('MAX_FEE', 50000))
 DERIVATIONS = 5000
 
 ASSERT_COIN_ANNOUNCEMENT = os.environ.get('ASSERT_COIN_ANNOUNCEMENT', True) is True
 print(f'ASSERT_COIN_ANNOUNCEMENT: {ASSERT_COIN_ANNOUNCEMENT}')
 
-recent_fee_coin_ids: deque = deque([], 200)
-
-def print_json(dict):
-    print(json.dumps(dict, sort_keys=True, indent=4))
-
-async def spend_unspent_coins(royalty_address, royalty_puzzle_hash, royalty_puzzle: Program, cat_asset_id=None, add_fees=False):  
-    try:
-        if cat_asset_id:
-            print(f"\tTrying address {royalty_address} as CAT with TAIL hash {cat_asset_id}")
-        node_client = await FullNodeRpcClient.create(self_hostname, uint16(full_node_rpc_port), DEFAULT_ROOT_PATH, config)
-        wallet_client = await WalletRpcClient.create(self_hostname, uint16(wallet_rpc_port), DEFAULT_ROOT_PATH, config)
+# fee coin pool, fee spends and pushed bundle tracking, the same machinery as the other tools
+fee_payer = FeePayer("royalty_share_spend", puzzle_reveals, MIN_FEE, MAX_FEE, ASSERT_COIN_ANNOUNCEMENT)
+
+# SPEND_CONCURRENCY - how many royalty coins are built and pushed at once
+SPEND_CONCURRENCY = int(os.environ.get('SPEND_CONCURRENCY', 1))
+
+# BATCH_SPENDS - "1" packs royalty spends into as few bundles as fit under BATCH_COST_FRACTION of a block, each with one fee spend
+BATCH_SPENDS = os.environ.get('BATCH_SPENDS', '0') == '1'
+
+# WAIT_FOR_CONFIRMATION - "1" keeps a one-shot run going until every pushed bundle confirms, stuck ones are pushed again with a higher fee
+WAIT_FOR_CONFIRMATION = os.environ.get('WAIT_FOR_CONFIRMATION', '0') == '1'
+
+# WATCH - keep running and split royalty coins as each new peak arrives, instead of sweeping once
+WATCH = os.environ.get('WATCH', '0') == '1'
+# WATCH_LIST - file of extra "<ROYALTY_ADDRESS> <PATH_TO_CURRIED_ROYALTY_PUZZLE_AS_HEX>" lines to watch
+WATCH_LIST = os.environ.get('WATCH_LIST')
+# WATCH_INTERVAL - seconds between peak checks while watching
+WATCH_INTERVAL = float(os.environ.get('WATCH_INTERVAL', 5))
+# WATCH_RESCAN_BLOCKS - blocks between full rescans while watching, picks up coins whose split failed or was reorged out
+WATCH_RESCAN_BLOCKS = int(os.environ.get('WATCH_RESCAN_BLOCKS', 100))
+# WATCH_MAX_BACKOFF - longest wait in seconds after repeated failures while watching, the wait doubles from WATCH_INTERVAL
+WATCH_MAX_BACKOFF = float(os.environ.get('WATCH_MAX_BACKOFF', 300))
+
+# out is where a spend logs, None for stdout
+def print_json(dict, out: TextIO = None):
+    print(json.dumps(dict, sort_keys=True, indent=4), file=out)
+
+async def spend_unspent_coins(node_client: FullNodeRpcClient, wallet_client: WalletRpcClient, royalty_address, royalty_puzzle_hash, royalty_puzzle: Program, cat_asset_id=None, add_fees=False, all_royalty_coins: List[CoinRecord] = None) -> bool:  
+    if cat_asset_id:
+        print(f"\tTrying address {royalty_address} as CAT with TAIL hash {cat_asset_id}")
+    if all_royalty_coins is None:
         all_royalty_coins = await node_client.get_coin_records_by_puzzle_hash(royalty_puzzle_hash, False, 0)
-        for coin_record in all_royalty_coins:
-            try:
-                coin_record = await node_client.get_coin_record_by_name(coin_record.coin.name())
-                print(f"unspent coin_record: \r\n{coin_record}")    
-                
-                # calculate total number of shares
-                mod, curried_args = royalty_puzzle.uncurry()
-                if mod == CAT_MOD:
-                    mod, curried_args = curried_args.at("rrf").uncurry()
-                payout_scheme = curried_args.first()
-
-                total_shares = 0
-                for entry in payout_scheme.as_iter():
-                    total_shares += entry.rest().first().as_int()
-                
-
-                #Spent Coin
-                coin_spend = CoinSpend(
-                    coin_record.coin,
-                    royalty_puzzle,
-                    Program.to([coin_record.coin.amount, total_shares])
-                )
-                # empty signature i.e., c00000.....
-                signature = G2Element()
-
-                spend_bundle: SpendBundle = None
-
-                if cat_asset_id:
-                    spend_bundle = await calculate_cat_spend_bundle(coin_record, node_client, cat_asset_id, royalty_address, royalty_puzzle)
-                else:
-                    # SpendBundle
-                    spend_bundle = SpendBundle(
-                            # coin spends
-                            [coin_spend],
-                            # aggregated_signature
-                            signature,
-                        )
-
-                if add_fees is True:
-                    print(f'Adding fees: {MIN_FEE}')
-                    spend_bundle = await add_fees_and_sign_spend_bundle(spend_bundle, node_client, wallet_client)
-
-                print(f'{spend_bundle}')
-
-                status = await node_client.push_tx(spend_bundle)
-                print_json(status)
-            except Exception as e: 
-                print('Failed on: ')
-                print(repr(e))
-                print('\r\n...Continuing to next coin')
-    finally:
-        node_client.close()
-        wallet_client.close()
-        await node_client.await_closed()
-
-def wallet_keyf(pk):
-    print(f'Looking for wallet keys to sign spend, PK: {pk}')
-    for wallet_key in wallet_keys:
-        synth_key = calculate_synthetic_secret_key(wallet_key, DEFAULT_HIDDEN_PUZZLE_HASH)
-        if synth_key.get_g1() == pk:
-            return synth_key
-    raise Exception("Evaluated all keys without finding PK match!")
-
-async def estimate_fees_by_mempool(spend_bundle: SpendBundle, node_client: FullNodeRpcClient) -> uint64:
-    mempool_size = len(await node_client.get_all_mempool_tx_ids())
-    huge_mempool = float(400.0)
-    if mempool_size < 10:
-        return uint64(MIN_FEE)
-    elif mempool_size > huge_mempool:
-        return uint64(MAX_FEE)
-    else:
-        return uint64(MAX_FEE * (mempool_size / huge_mempool))
-
-
-async def add_fees_and_sign_spend_bundle(spend_bundle: SpendBundle, node_client: FullNodeRpcClient, wallet_client: WalletRpcClient):
-    updated_coin_spends = []
-    updated_coin_spends.extend(spend_bundle.coin_spends)
-
-    fees_remaining: uint64 = await estimate_fees_by_mempool(spend_bundle, node_client)
-    print(f'Calculated target fees of {fees_remaining} using mempool')
+    if len(all_royalty_coins) == 0:
+        return True
+    # every spend is checked against the same peak before it is pushed
+    peak = await mempool_peak(node_client)
+    if BATCH_SPENDS:
+        return await spend_royalty_batches(node_client, wallet_client, all_royalty_coins, royalty_address, royalty_puzzle, cat_asset_id, add_fees, peak)
+    semaphore = asyncio.Semaphore(SPEND_CONCURRENCY)
+
+    # each coin logs to its own buffer, so concurrent coins still log in order
+    async def spend(coin_record: CoinRecord) -> Tuple[str, bool]:
+        async with semaphore:
+            output = io.StringIO()
+            spent = await spend_royalty_coin(node_client, wallet_client, coin_record, royalty_address, royalty_puzzle, cat_asset_id, add_fees, peak, output)
+            return (output.getvalue(), spent)
+
+    tasks = [asyncio.create_task(spend(coin_record)) for coin_record in all_royalty_coins]
+    all_spent = True
+    # each coin's output comes out in coin order, as soon as it and the coins before it are done
+    for task in tasks:
+        (output, spent) = await task
+        print(output, end='')
+        all_spent = all_spent and spent
+    return all_spent
+
+
+async def royalty_spend_bundle(node_client: FullNodeRpcClient, coin_record: CoinRecord, royalty_address, royalty_puzzle: Program, cat_asset_id=None, out: TextIO = None) -> SpendBundle:
+    coin_record = await node_client.get_coin_record_by_name(coin_record.coin.name())
+    print(f"unspent coin_record: \r\n{coin_record}", file=out)    
     
-    fee_coins = await wallet_client.select_coins(amount=uint64(MAX_FEE), wallet_id=1, 
-                                                 coin_selection_config=CoinSelectionConfig(min_coin_amount=MIN_FEE, max_coin_amount=100000000, excluded_coin_amounts=[0,1], excluded_coin_ids=list(recent_fee_coin_ids)))
-
-    print(f'evaluating {len(fee_coins)} coin(s) for fees')
-    for fee_coin in fee_coins:
-        print(f'{fee_coin}')
-        if fees_remaining <= 0:
-            break
-        if fee_coin.amount >= fees_remaining:
-            recent_fee_coin_ids.append(fee_coin.name())
-            change_spend = await calculate_change_spend(node_client, fee_coin, fees_remaining, spend_bundle.coin_spends)
-            updated_coin_spends.append(change_spend)
-            fees_remaining = 0
-        elif fee_coin.amount < fees_remaining:
-            change_spend = await calculate_change_spend(node_client, fee_coin, fee_coin.amount, spend_bundle.coin_spends)
-            updated_coin_spends.append(change_spend)
-            fees_remaining -= fee_coin.amount
-            recent_fee_coin_ids.append(fee_coin.name())
-
-    return await sign_coin_spends(
-        updated_coin_spends,
-        wallet_keyf,
-        None,
-        AGG_SIG_ME_ADDITIONAL_DATA,
-        MAX_BLOCK_COST_CLVM,
-        [puzzle_hash_for_synthetic_public_key],
-    )
+    # calculate total number of shares
+    mod, curried_args = royalty_puzzle.uncurry()
+    if mod == CAT_MOD:
+        mod, curried_args = curried_args.at("rrf").uncurry()
+    payout_scheme = curried_args.first()
 
+    total_shares = 0
+    for entry in payout_scheme.as_iter():
+        total_shares += entry.rest().first().as_int()
+    
 
-async def calculate_change_spend(node_client: FullNodeRpcClient, fee_coin: Coin, fee_amount: uint64, peer_coin_spends: List[CoinSpend]):
-
-    puzzle_reveal = None
-    for wallet_key in wallet_keys:
-        pk = wallet_key.get_g1()
-        candidate_puzzle_reveal = puzzle_for_pk(pk)
-        if candidate_puzzle_reveal.get_tree_hash() == fee_coin.puzzle_hash:
-            puzzle_reveal = candidate_puzzle_reveal
-            break
-    if puzzle_reveal is None:
-        raise Exception("Checked all known keys for valid puzzle reveal. Failed to find any.")
-
-    change_amount = fee_coin.amount - fee_amount
-    destination_puzzlehash = fee_coin.puzzle_hash
-    primaries = [Payment(destination_puzzlehash, change_amount, [destination_puzzlehash])]
-
-    # FIXME - if we further aggregate spend bundles, we need to assert ALL spends
-    peer_coin_id = peer_coin_spends[0].coin.name()
-
-    if ASSERT_COIN_ANNOUNCEMENT is True:
-        assert_coin_announcement = Announcement(peer_coin_id, b'').name()
-        solution = Wallet().make_solution(
-            primaries=primaries,
-            fee=fee_amount,
-            # make sure our bundles aren't separated
-            coin_announcements_to_assert = [assert_coin_announcement]
-        )
-    else:
-        solution = Wallet().make_solution(
-            primaries=primaries,
-            fee=fee_amount
+    #Spent Coin
+    coin_spend = CoinSpend(
+        coin_record.coin,
+        royalty_puzzle,
+        Program.to([coin_record.coin.amount, total_shares])
+    )
+    # empty signature i.e., c00000.....
+    signature = G2Element()
+
+    if cat_asset_id:
+        return await calculate_cat_spend_bundle(coin_record, node_client, cat_asset_id, royalty_address, royalty_puzzle)
+
+    # SpendBundle
+    return SpendBundle(
+            # coin spends
+            [coin_spend],
+            # aggregated_signature
+            signature,
         )
 
-    print(f'solution: {solution}')
-
-    print(f'Prepping change spend of amount {change_amount} mojos')
 
-    return CoinSpend(fee_coin, puzzle_reveal, solution)
+async def spend_royalty_coin(node_client: FullNodeRpcClient, wallet_client: WalletRpcClient, coin_record: CoinRecord, royalty_address, royalty_puzzle: Program, cat_asset_id=None, add_fees=False, peak: Tuple[int, int] = None, out: TextIO = None) -> bool:
+    try:
+        if peak is None:
+            peak = await mempool_peak(node_client)
+        spend_bundle = await royalty_spend_bundle(node_client, coin_record, royalty_address, royalty_puzzle, cat_asset_id, out)
+        cost = await validate_spend_bundle(node_client, spend_bundle, peak)
+        print(f'Royalty spend cost: {cost}', file=out)
+
+        status = await fee_payer.pay_and_push(node_client, wallet_client, spend_bundle, cost, peak, add_fees, out)
+        print_json(status, out)
+        return True
+    except SpendNotYetValid as e:
+        print(f'Deferring {coin_record.coin.name().hex()}: {e}', file=out)
+        return False
+    except Exception as e: 
+        print('Failed on: ', file=out)
+        print(repr(e), file=out)
+        print('\r\n...Continuing to next coin', file=out)
+        return False
+
+
+# one bundle, and one fee spend, per batch of royalty spends that fits under the batch cost limit
+async def spend_royalty_batches(node_client: FullNodeRpcClient, wallet_client: WalletRpcClient, coin_records: List[CoinRecord], royalty_address, royalty_puzzle: Program, cat_asset_id=None, add_fees=False, peak: Tuple[int, int] = None) -> bool:
+    async def build(coin_record: CoinRecord) -> SpendBundle:
+        return await royalty_spend_bundle(node_client, coin_record, royalty_address, royalty_puzzle, cat_asset_id)
+
+    return await fee_payer.spend_batches(node_client, wallet_client, coin_records, build, "royalty", add_fees, peak)
     
 
 def usage():
     print(f"Usage: python royalty_share_spend.py <ROYALTY_ADDRESS> <PATH_TO_CURRIED_ROYALTY_PUZZLE_AS_HEX> <optional:WALLET_FINGERPRINT_FOR_SIGNED_SPENDS> \r\n")
+    print(f"       WATCH=1 keeps running and splits royalties as new blocks arrive, WATCH_LIST=<FILE> adds more royalty addresses\r\n")
     exit(-1)
 
 async def calculate_cat_spend_bundle(coin_record: CoinRecord, node_client: FullNodeRpcClient, cat_asset_id: str, royalty_address: str, royalty_puzzle: Program) -> SpendBundle:
     coin: Coin = coin_record.coin
-    parent_coin_record: CoinRecord = await node_client.get_coin_record_by_name(coin.parent_coin_info)
-
-    parent_coin: Coin = parent_coin_record.coin
 
     # cross-check cat puzzle hash
     cat_puzzle = construct_cat_puzzle(CAT_MOD, bytes.fromhex(cat_asset_id), royalty_puzzle)
 
     assert cat_puzzle.get_tree_hash() == decode_puzzle_hash(royalty_address)
     assert coin.puzzle_hash == cat_puzzle.get_tree_hash()
-    parent_coin_spend: CoinSpend = await node_client.get_puzzle_and_solution(parent_coin.name(), parent_coin_record.spent_block_index)
- 
-    parent_puzzle_reveal: SerializedProgram = parent_coin_spend.puzzle_reveal
-    prog_final, curried_args = parent_puzzle_reveal.uncurry()
-    list_args = list(curried_args.as_iter())
-    parent_inner_puzzlehash: bytes32 = list_args[-1].get_tree_hash()
-    lineage_proof = LineageProof(parent_coin.parent_coin_info, parent_inner_puzzlehash, parent_coin.amount)
+    lineage_proof = await lineage_proofs.lineage_proof(node_client, coin.parent_coin_info)
     
     # calculate total number of shares
     mod, curried_args = royalty_puzzle.uncurry()
@@ -268,6 +239,23 @@ async def calculate_cat_spend_bundle(coin_record: CoinRecord, node_client: FullN
 
     return unsigned_spend_bundle_for_spendable_cats(CAT_MOD, [spendable_cat])
 
+async def find_cat_royalty_coins(node_client: FullNodeRpcClient, royalty_address, cats: Dict[str, str], checkpoints: ScanCheckpoints = None) -> List[Tuple[str, str, str, bytes32, List[CoinRecord]]]:
+    # every tail's royalty address up front, then a few bulk lookups instead of a request per tail
+    cat_royalty_addresses = dict()
+    for cat, asset_id in cats.items():
+        (cat_royalty_address, cat_royalty_puzzle_hash) = calculate_cat_royalty_address(royalty_address, asset_id)
+        cat_royalty_addresses[cat_royalty_puzzle_hash] = (cat, asset_id, cat_royalty_address)
+
+    start_height = None if checkpoints is None else checkpoints.start_height(list(cat_royalty_addresses.keys()))
+    coin_records_by_hash = await get_coin_records_by_puzzle_hashes(node_client, list(cat_royalty_addresses.keys()), start_height=start_height)
+    funded = [(*cat_royalty_addresses[puzzle_hash], puzzle_hash, coin_records) for puzzle_hash, coin_records in coin_records_by_hash.items() if len(coin_records) > 0]
+    if checkpoints is not None:
+        # nothing to spend means nothing left behind
+        checkpoints.done([puzzle_hash for puzzle_hash, coin_records in coin_records_by_hash.items() if len(coin_records) == 0])
+    print(f'Found coins at {len(funded)} of {len(cat_royalty_addresses)} CAT royalty addresses')
+    return funded
+
+
 def calculate_cat_royalty_address(royalty_address, asset_id):
     inner_puzzlehash_bytes32: bytes32 = decode_puzzle_hash(royalty_address)
     prefix = royalty_address[: royalty_address.rfind("1")]
@@ -283,6 +271,86 @@ def calculate_cat_royalty_address(royalty_address, asset_id):
 
     return (encode_puzzle_hash(outer_puzzlehash, prefix), outer_puzzlehash)    
 
+
+def load_royalty_puzzle(path) -> Program:
+    with open(path, 'r') as f:
+        text = f.readlines()[0]
+    clvm_blob = bytes.fromhex(text)
+    sp = SerializedProgram.from_bytes(clvm_blob)
+    return Program.from_bytes(bytes(sp))
+
+
+def read_watch_list(path) -> List[Tuple[str, Program]]:
+    royalties = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            (royalty_address, royalty_puzzle_path) = line.split()
+            royalties.append((royalty_address, load_royalty_puzzle(royalty_puzzle_path)))
+    return royalties
+
+
+def watched_puzzle_hashes(royalties: List[Tuple[str, Program]], cats: Dict[str, str]) -> Dict[bytes32, Tuple[str, Program, str]]:
+    watched = dict()
+    for (royalty_address, royalty_puzzle) in royalties:
+        watched[decode_puzzle_hash(royalty_address)] = (royalty_address, royalty_puzzle, None)
+        for asset_id in cats.values():
+            (cat_royalty_address, cat_royalty_puzzle_hash) = calculate_cat_royalty_address(royalty_address, asset_id)
+            watched[cat_royalty_puzzle_hash] = (cat_royalty_address, royalty_puzzle, asset_id)
+    return watched
+
+
+async def split_royalties(node_client: FullNodeRpcClient, wallet_client: WalletRpcClient, watched: Dict[bytes32, Tuple[str, Program, str]], start_height: int, add_fees=False) -> int:
+    coin_records_by_hash = await get_coin_records_by_puzzle_hashes(node_client, list(watched.keys()), start_height=start_height)
+    found = 0
+    for puzzle_hash, coin_records in coin_records_by_hash.items():
+        if len(coin_records) == 0:
+            continue
+        (royalty_address, royalty_puzzle, asset_id) = watched[puzzle_hash]
+        found += len(coin_records)
+        # fees only go on XCH splits, same as the one-shot sweep
+        await spend_unspent_coins(node_client, wallet_client, royalty_address, puzzle_hash, royalty_puzzle, asset_id, add_fees=add_fees and asset_id is None, all_royalty_coins=coin_records)
+    return found
+
+
+# one get_blockchain_state per interval while idle, one bulk lookup of the new blocks per peak
+async def watch_royalties(node_client: FullNodeRpcClient, wallet_client: WalletRpcClient, watched: Dict[bytes32, Tuple[str, Program, str]], add_fees=False,
+                          interval: float = WATCH_INTERVAL, rescan_blocks: int = WATCH_RESCAN_BLOCKS, max_backoff: float = WATCH_MAX_BACKOFF):
+    print(f'Watching {len(watched)} royalty puzzle hashes')
+    scanned_height = None
+    rescanned_height = None
+    delay = interval
+    while True:
+        try:
+            state = await node_client.get_blockchain_state()
+            peak = state["peak"]
+            if peak is not None and state["sync"]["synced"] and peak.height != scanned_height:
+                await fee_payer.submissions.poll(node_client)
+                if add_fees:
+                    await fee_payer.top_up_fee_coins(node_client, wallet_client)
+                if rescanned_height is None or peak.height - rescanned_height >= rescan_blocks:
+                    start_height = 0
+                    rescan = True
+                else:
+                    # a reorg to a lower peak rescans from the new peak
+                    start_height = min(scanned_height + 1, peak.height)
+                    rescan = False
+                found = await split_royalties(node_client, wallet_client, watched, start_height, add_fees)
+                if found > 0:
+                    print(f'Split {found} royalty coin(s) found from height {start_height} to peak {peak.height}')
+                # only a finished scan moves on, a failed one is retried from the same height
+                if rescan:
+                    rescanned_height = peak.height
+                scanned_height = peak.height
+            delay = interval
+        except Exception as e:
+            # a node restart or dropped connection should not end the watch
+            delay = min(delay * 2, max_backoff)
+            print(f'Watch failed: {repr(e)}, retrying in {delay} seconds')
+        await asyncio.sleep(delay)
+
 async def main():
     arg_count = len(sys.argv)
     
@@ -292,21 +360,21 @@ async def main():
 
     royalty_address = sys.argv[1]
     royalty_puzzle_hash = decode_puzzle_hash(sys.argv[1])
-    royalty_puzzle = None
+    royalty_puzzle = load_royalty_puzzle(sys.argv[2])
     wallet_fingerprint = None
-    text: str = None
-
-    with open(sys.argv[2], 'r') as f:
-        text = f.readlines()[0]
 
     if arg_count == 4:
         wallet_fingerprint = sys.argv[3]
 
-    clvm_blob = bytes.fromhex(text)
-    sp = SerializedProgram.from_bytes(clvm_blob)
-    royalty_puzzle = Program.from_bytes(bytes(sp))
-
-    if wallet_fingerprint is not None:
+    global signer
+    if wallet_fingerprint is not None and SIGNER_SOCKET is not None:
+        print(f'Signing through signer daemon at {SIGNER_SOCKET}')
+        signer = SignerClient(SIGNER_SOCKET)
+        for master_pk in await signer.get_public_keys():
+            key_index = KeyIndex.observer(master_pk)
+            key_index.load(DERIVATIONS)
+            key_indexes.append(key_index)
+    elif wallet_fingerprint is not None:
         print('Loading private key for spend bundle signing (fee support)')
         print(f'Is keychain locked? {Keychain.is_keyring_locked()}')
         keychain = Keychain()
@@ -315,44 +383,73 @@ async def main():
 
         all_sks = keychain.get_all_private_keys()
 
-        print(f'Deriving {DERIVATIONS} synthetic private keys')
-        for i in range(DERIVATIONS):
-            for sk in all_sks:
-                wallet_keys.append(master_sk_to_wallet_sk_unhardened(sk[0], i))
-
-    print('Checking XCH spends...')
-
-    add_fees = wallet_fingerprint is not None
-    await spend_unspent_coins(royalty_address, royalty_puzzle_hash, royalty_puzzle, cat_asset_id=None, add_fees=add_fees)
-
-    # It's highly likely you will want to support a different set of these
-    # TODO: look at API or CSV import of all/as many as you care about
-    cats = {
-        "LKY8": "e5a8af7124c2737283838e6797b0f0a5293fc81aca1ffd2720f8506c23f2ad88",
-        "SBX": "a628c1c2c6fcb74d53746157e438e108eab5c0bb3e5c80ff9b1910b3e4832913",
-        "TEST": "2267357bf318926f9ccaa5b68e1d4527df89b00c4aed41d6d590d75aa6fa0ff4",
-        "USDS": "6d95dae356e32a71db5ddcb42224754a02524c615c5fc35f568c2af04774e589",
-        "ALGOLD": "446f5c3532929f71fa82f1c65f7e93170dcfbf8d59baf82a81b6f8e8f85e8a5c",
-        "WTF2": "ef9df6c687ed9a325369f32ba38eb6dc83a1bd081e159a9b2dddfe6159e2ecf0",
-    }
-
-    import json
-    import requests
-    resp = requests.get('https://mainnet-api.taildatabase.com/tails', timeout=30)
-    tails = json.loads(resp.content)
-
-    for tail in tails:
-        code = tail['code']
-        hash = tail['hash']
-        cats[code] = hash
-
-    print(f'Loaded {len(cats)} CAT tails')
-
-    print('Checking CAT spends...')
-    for cat, asset_id in cats.items():
-        print(cat, asset_id)
-        (cat_royalty_address, cat_royalty_puzzle_hash) = calculate_cat_royalty_address(royalty_address, asset_id)
-        await spend_unspent_coins(cat_royalty_address, cat_royalty_puzzle_hash, royalty_puzzle, asset_id)
+        print(f'Loading {DERIVATIONS} wallet keys from key index')
+        for sk in all_sks:
+            key_index = KeyIndex(sk[0])
+            key_index.load(DERIVATIONS)
+            key_indexes.append(key_index)
+        signer = LocalSigner(key_indexes, AGG_SIG_ME_ADDITIONAL_DATA, MAX_BLOCK_COST_CLVM)
+    if SPEND_EXPORT is not None:
+        print(f'Exporting unsigned bundles to {SPEND_EXPORT}, sign and push them with spend_pipeline.py')
+        if signer is not None:
+            await signer.close()
+        signer = SpendExport(SPEND_EXPORT)
+    fee_payer.signer = signer
+    # exported coins are still unspent, so the checkpoints stay put
+    exporting = isinstance(signer, SpendExport)
+
+    # one node and wallet connection for the whole run
+    rpc = await RpcSession.create(config, wallet=True)
+    checkpoints = ScanCheckpoints("royalty_share_spend")
+    try:
+        add_fees = wallet_fingerprint is not None
+
+        # It's highly likely you will want to support a different set of these
+        # merged with the cached tail database and any TAIL_CSV files
+        cats = {
+            "LKY8": "e5a8af7124c2737283838e6797b0f0a5293fc81aca1ffd2720f8506c23f2ad88",
+            "SBX": "a628c1c2c6fcb74d53746157e438e108eab5c0bb3e5c80ff9b1910b3e4832913",
+            "TEST": "2267357bf318926f9ccaa5b68e1d4527df89b00c4aed41d6d590d75aa6fa0ff4",
+            "USDS": "6d95dae356e32a71db5ddcb42224754a02524c615c5fc35f568c2af04774e589",
+            "ALGOLD": "446f5c3532929f71fa82f1c65f7e93170dcfbf8d59baf82a81b6f8e8f85e8a5c",
+            "WTF2": "ef9df6c687ed9a325369f32ba38eb6dc83a1bd081e159a9b2dddfe6159e2ecf0",
+        }
+
+        cats = load_cats(cats)
+
+        if WATCH:
+            royalties = [(royalty_address, royalty_puzzle)]
+            if WATCH_LIST is not None:
+                royalties.extend(read_watch_list(WATCH_LIST))
+            await watch_royalties(rpc.node_client, rpc.wallet_client, watched_puzzle_hashes(royalties, cats), add_fees)
+        else:
+            # only blocks after the last fully handled height are looked at again
+            await checkpoints.begin(rpc.node_client)
+            if add_fees:
+                await fee_payer.top_up_fee_coins(rpc.node_client, rpc.wallet_client)
+
+            print('Checking XCH spends...')
+            start_height = checkpoints.start_height([royalty_puzzle_hash])
+            coin_records = (await get_coin_records_by_puzzle_hashes(rpc.node_client, [royalty_puzzle_hash], start_height=start_height))[royalty_puzzle_hash]
+            if await spend_unspent_coins(rpc.node_client, rpc.wallet_client, royalty_address, royalty_puzzle_hash, royalty_puzzle, cat_asset_id=None, add_fees=add_fees, all_royalty_coins=coin_records) and not exporting:
+                # the checkpoint moves once the pushed coins are seen spent, an export leaves it where it was
+                checkpoints.done([royalty_puzzle_hash], [coin_record.name for coin_record in coin_records])
+
+            print('Checking CAT spends...')
+            for (cat, asset_id, cat_royalty_address, cat_royalty_puzzle_hash, coin_records) in await find_cat_royalty_coins(rpc.node_client, royalty_address, cats, checkpoints):
+                print(cat, asset_id)
+                if await spend_unspent_coins(rpc.node_client, rpc.wallet_client, cat_royalty_address, cat_royalty_puzzle_hash, royalty_puzzle, asset_id, all_royalty_coins=coin_records) and not exporting:
+                    checkpoints.done([cat_royalty_puzzle_hash], [coin_record.name for coin_record in coin_records])
+
+            if WAIT_FOR_CONFIRMATION:
+                print(f'Waiting for {len(fee_payer.submissions.submissions)} pushed bundle(s) to confirm')
+                await fee_payer.submissions.wait(rpc.node_client)
+                await checkpoints.settle(rpc.node_client)
+    finally:
+        checkpoints.save()
+        await rpc.close()
+        if signer is not None:
+            await signer.close()
 
 def load_clsp_relative(filename: str, search_paths: List[Path] = None):
     if search_paths is None:
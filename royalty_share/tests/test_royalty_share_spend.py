@@ -1,4 +1,19 @@
+import asyncio
+import functools
+from types import SimpleNamespace
+
+import fee_payer
+import royalty_share_spend
 from royalty_share_spend import calculate_cat_royalty_address
+from spend_cost import spend_bundle_cost
+from submission_tracker import SubmissionTracker
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.util.bech32m import encode_puzzle_hash
+from chia.util.ints import uint32, uint64
 
 import pytest
 
@@ -10,4 +25,194 @@ class TestRoyaltyShareSpend:
 
     def test_calculate_royalty_address_sbx(self):
         (royalty_address, royalty_puzzle_hash) = calculate_cat_royalty_address('xch18zttqcg25pjwhuf7s4kptpe3kslp7nzwkj5k6vrsxp8tt0nke8cqhz785s', 'a628c1c2c6fcb74d53746157e438e108eab5c0bb3e5c80ff9b1910b3e4832913')
-        assert royalty_address == "xch193cp9h5h5qx5xw88y43aeszvu6tkrg8s03atwqakaz6lfy8jyukqke8xe3"        
\ No newline at end of file
+        assert royalty_address == "xch193cp9h5h5qx5xw88y43aeszvu6tkrg8s03atwqakaz6lfy8jyukqke8xe3"        
+
+class FakeNodeClient:
+
+    def __init__(self, coin_records, delays, failing):
+        self.coin_records = coin_records
+        self.delays = delays
+        self.failing = failing
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.pushed = []
+        self.bundles = []
+
+    async def get_blockchain_state(self):
+        return {"peak": SimpleNamespace(height=10, timestamp=uint64(1000)), "sync": {"synced": True}}
+
+    async def get_coin_records_by_puzzle_hash(self, puzzle_hash, include_spent_coins=True, start_height=None, end_height=None):
+        return self.coin_records
+
+    async def get_coin_record_by_name(self, name):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        coin_record = next(cr for cr in self.coin_records if cr.coin.name() == name)
+        await asyncio.sleep(self.delays[coin_record.coin.amount])
+        self.in_flight -= 1
+        if coin_record.coin.amount in self.failing:
+            raise ValueError(f"no record for {coin_record.coin.amount}")
+        return coin_record
+
+    async def push_tx(self, spend_bundle):
+        self.pushed.append(spend_bundle.coin_spends[0].coin.amount)
+        self.bundles.append(spend_bundle)
+        return {"success": True}
+
+
+class TestSpendUnspentCoins:
+
+    @pytest.mark.asyncio
+    async def test_concurrent_spends_log_in_coin_order(self, monkeypatch, capsys):
+        monkeypatch.setattr(royalty_share_spend, "SPEND_CONCURRENCY", 3)
+        royalty_puzzle = Program.to((1, None)).curry([[bytes32(b'\x02' * 32), 1]])
+        coin_records = [
+            CoinRecord(Coin(bytes32(b'\x01' * 32), royalty_puzzle.get_tree_hash(), uint64(amount)), uint32(1), uint32(0), False, uint64(0))
+            for amount in range(1, 6)
+        ]
+        # later coins finish first
+        node_client = FakeNodeClient(coin_records, {1: 0.05, 2: 0.04, 3: 0.03, 4: 0.02, 5: 0.01}, failing={2})
+
+        await royalty_share_spend.spend_unspent_coins(node_client, None, "address", royalty_puzzle.get_tree_hash(), royalty_puzzle)
+
+        assert node_client.max_in_flight == 3
+        assert sorted(node_client.pushed) == [1, 3, 4, 5]
+        output = capsys.readouterr().out
+        positions = [output.index(f"'amount': {amount}") for amount in (1, 3, 4, 5)]
+        assert positions == sorted(positions)
+        failed = output.index("no record for 2")
+        assert positions[0] < failed < positions[1]
+
+
+class TestBatchedSpends:
+
+    @pytest.mark.asyncio
+    async def test_spends_are_packed_under_the_cost_limit(self, monkeypatch):
+        royalty_puzzle = Program.to((1, None)).curry([[bytes32(b'\x02' * 32), 1]])
+        coin_records = [
+            CoinRecord(Coin(bytes32(b'\x01' * 32), royalty_puzzle.get_tree_hash(), uint64(amount)), uint32(1), uint32(0), False, uint64(0))
+            for amount in range(1, 6)
+        ]
+        node_client = FakeNodeClient(coin_records, {amount: 0 for amount in range(1, 6)}, failing={3})
+        spend_cost = spend_bundle_cost(await royalty_share_spend.royalty_spend_bundle(node_client, coin_records[0], "address", royalty_puzzle))
+        monkeypatch.setattr(royalty_share_spend, "BATCH_SPENDS", True)
+        monkeypatch.setattr(fee_payer, "batch_cost_limit", lambda: spend_cost * 2)
+
+        assert not await royalty_share_spend.spend_unspent_coins(node_client, None, "address", royalty_puzzle.get_tree_hash(), royalty_puzzle)
+        assert [[coin_spend.coin.amount for coin_spend in spend_bundle.coin_spends] for spend_bundle in node_client.bundles] == [[1, 2], [4, 5]]
+
+
+class BulkNodeClient:
+
+    def __init__(self, funded_puzzle_hashes):
+        self.funded_puzzle_hashes = funded_puzzle_hashes
+        self.queries = []
+
+    async def get_coin_records_by_puzzle_hashes(self, puzzle_hashes, include_spent_coins=True, start_height=None, end_height=None):
+        self.queries.append(len(puzzle_hashes))
+        return [
+            CoinRecord(Coin(bytes32(b'\x01' * 32), puzzle_hash, uint64(1)), uint32(1), uint32(0), False, uint64(0))
+            for puzzle_hash in puzzle_hashes if puzzle_hash in self.funded_puzzle_hashes
+        ]
+
+
+class TestFindCatRoyaltyCoins:
+
+    @pytest.mark.asyncio
+    async def test_only_funded_tails_are_returned(self, monkeypatch):
+        monkeypatch.setattr(royalty_share_spend, "get_coin_records_by_puzzle_hashes", functools.partial(royalty_share_spend.get_coin_records_by_puzzle_hashes, chunk_size=2))
+        royalty_address = 'xch18zttqcg25pjwhuf7s4kptpe3kslp7nzwkj5k6vrsxp8tt0nke8cqhz785s'
+        cats = {f"T{i}": bytes([i]).hex() * 32 for i in range(5)}
+        (_, funded_puzzle_hash) = calculate_cat_royalty_address(royalty_address, cats["T3"])
+        node_client = BulkNodeClient({funded_puzzle_hash})
+
+        found = await royalty_share_spend.find_cat_royalty_coins(node_client, royalty_address, cats)
+        assert node_client.queries == [2, 2, 1]
+        assert len(found) == 1
+        (cat, asset_id, cat_royalty_address, cat_royalty_puzzle_hash, coin_records) = found[0]
+        assert (cat, asset_id, cat_royalty_puzzle_hash) == ("T3", cats["T3"], funded_puzzle_hash)
+        assert [coin_record.coin.puzzle_hash for coin_record in coin_records] == [funded_puzzle_hash]
+
+
+class WatchNodeClient:
+
+    def __init__(self, royalty_puzzle_hash):
+        self.royalty_puzzle_hash = royalty_puzzle_hash
+        self.height = 10
+        self.coin_records = []
+        self.start_heights = []
+        self.pushed = []
+
+    def arrive(self, amount):
+        coin = Coin(bytes32(b'\x01' * 32), self.royalty_puzzle_hash, uint64(amount))
+        self.coin_records.append(CoinRecord(coin, uint32(self.height), uint32(0), False, uint64(0)))
+
+    async def get_blockchain_state(self):
+        return {"peak": SimpleNamespace(height=self.height, timestamp=uint64(1000)), "sync": {"synced": True}}
+
+    async def get_coin_records_by_puzzle_hashes(self, puzzle_hashes, include_spent_coins=True, start_height=None, end_height=None):
+        self.start_heights.append(start_height)
+        return [cr for cr in self.coin_records if cr.coin.puzzle_hash in puzzle_hashes and cr.confirmed_block_index >= start_height and cr.spent_block_index == 0]
+
+    async def get_coin_record_by_name(self, name):
+        return next(cr for cr in self.coin_records if cr.coin.name() == name)
+
+    async def get_coin_records_by_names(self, names, include_spent_coins=True, start_height=None, end_height=None):
+        return [cr for cr in self.coin_records if cr.name in names]
+
+    async def push_tx(self, spend_bundle):
+        self.pushed.append(spend_bundle.coin_spends[0].coin.amount)
+        return {"success": True}
+
+
+class TestWatchRoyalties:
+
+    @pytest.mark.asyncio
+    async def test_new_peaks_scan_only_new_blocks(self, monkeypatch):
+        monkeypatch.setattr(royalty_share_spend.fee_payer, "submissions", SubmissionTracker())
+        royalty_puzzle = Program.to((1, None)).curry([[bytes32(b'\x02' * 32), 1]])
+        royalty_address = encode_puzzle_hash(royalty_puzzle.get_tree_hash(), "xch")
+        watched = royalty_share_spend.watched_puzzle_hashes([(royalty_address, royalty_puzzle)], {"T1": "01" * 32})
+        assert len(watched) == 2
+        node_client = WatchNodeClient(royalty_puzzle.get_tree_hash())
+        node_client.arrive(1)
+
+        watcher = asyncio.create_task(royalty_share_spend.watch_royalties(node_client, None, watched, interval=0.01, rescan_blocks=3))
+        await asyncio.sleep(0.05)
+        node_client.height = 11
+        node_client.arrive(2)
+        await asyncio.sleep(0.05)
+        node_client.height = 13
+        await asyncio.sleep(0.05)
+        watcher.cancel()
+
+        # the first peak and every third block sweep everything, other peaks only their new blocks
+        assert node_client.start_heights == [0, 11, 0]
+        assert node_client.pushed[:2] == [1, 2]
+
+    @pytest.mark.asyncio
+    async def test_node_errors_back_off_and_keep_watching(self, monkeypatch):
+        monkeypatch.setattr(royalty_share_spend.fee_payer, "submissions", SubmissionTracker())
+        royalty_puzzle = Program.to((1, None)).curry([[bytes32(b'\x02' * 32), 1]])
+        royalty_address = encode_puzzle_hash(royalty_puzzle.get_tree_hash(), "xch")
+        watched = royalty_share_spend.watched_puzzle_hashes([(royalty_address, royalty_puzzle)], {})
+        node_client = WatchNodeClient(royalty_puzzle.get_tree_hash())
+        node_client.arrive(1)
+        get_blockchain_state = node_client.get_blockchain_state
+        failures = []
+
+        async def flaky_blockchain_state():
+            if len(failures) < 2:
+                failures.append(asyncio.get_running_loop().time())
+                raise ConnectionError("node restarting")
+            return await get_blockchain_state()
+        node_client.get_blockchain_state = flaky_blockchain_state
+
+        watcher = asyncio.create_task(royalty_share_spend.watch_royalties(node_client, None, watched, interval=0.01, max_backoff=0.03))
+        await asyncio.sleep(0.15)
+        assert not watcher.done()
+        watcher.cancel()
+
+        assert len(failures) == 2
+        assert failures[1] - failures[0] >= 0.02
+        assert node_client.pushed == [1]
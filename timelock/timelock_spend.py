@@ -1,12 +1,10 @@
 import asyncio
 from blspy import G2Element
-from collections import deque
 import json
 import os
-import requests
 import sys
 import time
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from chia.consensus.default_constants import DEFAULT_CONSTANTS
 AGG_SIG_ME_ADDITIONAL_DATA = DEFAULT_CONSTANTS.AGG_SIG_ME_ADDITIONAL_DATA
@@ -17,7 +15,8 @@ from chia.rpc.wallet_rpc_client import WalletRpcClient
 
 from chia.types.announcement import Announcement
 from chia.types.blockchain_format.coin import Coin
-from chia.types.blockchain_format.program import Program, SerializedProgram
+from chia.types.blockchain_format.program import Program
+from chia.types.blockchain_format.serialized_program import SerializedProgram
 from chia.types.blockchain_format.sized_bytes import bytes32
 from chia.types.coin_record import CoinRecord
 from chia.types.coin_spend import CoinSpend
@@ -48,6 +47,19 @@ from chia.wallet.transaction_record import TransactionRecord
 from chia.wallet.wallet import Wallet
 from clvm_tools.clvmc import compile_clvm
 
+# modules shared by every tool live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from coin_lookup import get_coin_records_by_puzzle_hashes
+from fee_payer import FeePayer
+from key_index import KeyIndex, PuzzleReveals
+from lineage_cache import LineageProofCache
+from rpc_session import RpcSession
+from scan_checkpoints import ScanCheckpoints
+from signer import SIGNER_SOCKET, LocalSigner, SignerClient
+from spend_cost import SpendNotYetValid, mempool_peak, validate_spend_bundle
+from spend_pipeline import SPEND_EXPORT, SpendExport
+from tail_registry import load_cats
+
 from pathlib import Path
 
 config = load_config(DEFAULT_ROOT_PATH, "config.yaml")
@@ -56,19 +68,34 @@ full_node_rpc_port = config["full_node"]["rpc_port"] # 8555
 wallet_rpc_port = config["wallet"]["rpc_port"] # 9256
 prefix = "xch"
 
-global wallet_keys
-wallet_keys = []
+global key_indexes
+key_indexes: List[KeyIndex] = []
+puzzle_reveals = PuzzleReveals(key_indexes)
+lineage_proofs = LineageProofCache()
+
+# LocalSigner, SignerClient when a signer daemon is running (SIGNER_SOCKET), or SpendExport when exporting (SPEND_EXPORT)
+signer = None
 
 MIN_FEE = 1
-MAX_FEE = 50000
+# MAX_FEE - most mojos paid in fees for one bundle, however high the node's fee estimate
+MAX_FEE = int(os.environ.get('MAX_FEE', 50000))
 DERIVATIONS = 1000
 
 ASSERT_COIN_ANNOUNCEMENT = os.environ.get('ASSERT_COIN_ANNOUNCEMENT', True) is True
 print(f'ASSERT_COIN_ANNOUNCEMENT: {ASSERT_COIN_ANNOUNCEMENT}')
 
-recent_fee_coins: deque = deque([], 10)
+# fee coin pool, fee spends and pushed bundle tracking, the same machinery as the other tools
+fee_payer = FeePayer("timelock_spend", puzzle_reveals, MIN_FEE, MAX_FEE, ASSERT_COIN_ANNOUNCEMENT)
+
+# WAIT_FOR_CONFIRMATION - "1" keeps the run going until every pushed bundle confirms, stuck ones are pushed again with a higher fee
+WAIT_FOR_CONFIRMATION = os.environ.get('WAIT_FOR_CONFIRMATION', '0') == '1'
+
+# BATCH_SPENDS - "1" packs timelock spends into as few bundles as fit under BATCH_COST_FRACTION of a block, each with one fee spend
+BATCH_SPENDS = os.environ.get('BATCH_SPENDS', '0') == '1'
 
 global CATS
+# It's highly likely you will want to support a different set of these
+# merged with the cached tail database and any TAIL_CSV files
 CATS = {
     "LKY8": "e5a8af7124c2737283838e6797b0f0a5293fc81aca1ffd2720f8506c23f2ad88",
     "SBX": "a628c1c2c6fcb74d53746157e438e108eab5c0bb3e5c80ff9b1910b3e4832913",
@@ -80,143 +107,68 @@ CATS = {
 def print_json(dict):
     print(json.dumps(dict, sort_keys=True, indent=4))
 
-async def spend_unspent_coins(address, puzzle_hash, puzzle: Program, cat_asset_id=None, add_fees=False):  
-    try:
-        if cat_asset_id:
-            print(f"\tTrying address {address} as CAT with TAIL hash {cat_asset_id}")
-        node_client = await FullNodeRpcClient.create(self_hostname, uint16(full_node_rpc_port), DEFAULT_ROOT_PATH, config)
-        wallet_client = await WalletRpcClient.create(self_hostname, uint16(wallet_rpc_port), DEFAULT_ROOT_PATH, config)
+async def spend_unspent_coins(node_client: FullNodeRpcClient, wallet_client: WalletRpcClient, address, puzzle_hash, puzzle: Program, cat_asset_id=None, add_fees=False, all_coins: List[CoinRecord] = None) -> bool:  
+    if cat_asset_id:
+        print(f"\tTrying address {address} as CAT with TAIL hash {cat_asset_id}")
+    if all_coins is None:
         all_coins = await node_client.get_coin_records_by_puzzle_hash(puzzle_hash, False, 0)
-        for coin_record in all_coins:
-            try:
-                coin_record = await node_client.get_coin_record_by_name(coin_record.coin.name())
-                print(f"unspent coin_record: \r\n{coin_record}")    
-
-                #Spent Coin
-                coin_spend = CoinSpend(
-                    coin_record.coin,
-                    puzzle,
-                    Program.to([coin_record.coin.amount])
-                )
-                # empty signature i.e., c00000.....
-                signature = G2Element()
-
-                spend_bundle: SpendBundle = None
-
-                if cat_asset_id:
-                    spend_bundle = await calculate_cat_spend_bundle(coin_record, node_client, cat_asset_id, address, puzzle)
-                else:
-                    # SpendBundle
-                    spend_bundle = SpendBundle(
-                            # coin spends
-                            [coin_spend],
-                            # aggregated_signature
-                            signature,
-                        )
-
-                if add_fees is True:
-                    print(f'Adding fees: {MIN_FEE}')
-                    spend_bundle = await add_fees_and_sign_spend_bundle(spend_bundle, node_client, wallet_client)
-
-                print(f'{spend_bundle}')
-
-                status = await node_client.push_tx(spend_bundle)
-                print_json(status)
-            except Exception as e: 
-                print('Failed on: ')
-                print(repr(e))
-                print('\r\n...Continuing to next coin')
-    finally:
-        node_client.close()
-        wallet_client.close()
-        await node_client.await_closed()
-
-def wallet_keyf(pk):
-    print(f'Looking for wallet keys to sign spend, PK: {pk}')
-    for wallet_key in wallet_keys:
-        synth_key = calculate_synthetic_secret_key(wallet_key, DEFAULT_HIDDEN_PUZZLE_HASH)
-        if synth_key.get_g1() == pk:
-            return synth_key
-    raise Exception("Evaluated all keys without finding PK match!")
-
-async def estimate_fees_by_mempool(spend_bundle: SpendBundle, node_client: FullNodeRpcClient) -> uint64:
-    mempool_size = len(await node_client.get_all_mempool_tx_ids())
-    huge_mempool = float(400.0)
-    if mempool_size < 10:
-        return uint64(MIN_FEE)
-    elif mempool_size > huge_mempool:
-        return uint64(MAX_FEE)
-    else:
-        return uint64(MAX_FEE * (mempool_size / huge_mempool))
-
-
-async def add_fees_and_sign_spend_bundle(spend_bundle: SpendBundle, node_client: FullNodeRpcClient, wallet_client: WalletRpcClient):
-    updated_coin_spends = []
-    updated_coin_spends.extend(spend_bundle.coin_spends)
-
-    fees_remaining: uint64 = await estimate_fees_by_mempool(spend_bundle, node_client)
-    print(f'Calculated target fees of {fees_remaining} using mempool')
-    
-    fee_coins = await wallet_client.select_coins(amount=uint64(MAX_FEE), wallet_id=1, excluded_coins=list(recent_fee_coins))
-
-    print(f'evaluating {len(fee_coins)} coin(s) for fees')
-    for fee_coin in fee_coins:
-        print(f'{fee_coin}')
-        if fees_remaining <= 0:
-            break
-        if fee_coin.amount >= fees_remaining:
-            recent_fee_coins.append(fee_coin)
-            change_spend = await calculate_change_spend(node_client, fee_coin, fees_remaining, spend_bundle.coin_spends)
-            updated_coin_spends.append(change_spend)
-            fees_remaining = 0
-        elif fee_coin.amount < fees_remaining:
-            change_spend = await calculate_change_spend(node_client, fee_coin, fee_coin.amount, spend_bundle.coin_spends)
-            updated_coin_spends.append(change_spend)
-            fees_remaining -= fee_coin.amount
-            recent_fee_coins.append(fee_coin)
-
-    spend_bundle = await sign_coin_spends(updated_coin_spends, wallet_keyf, AGG_SIG_ME_ADDITIONAL_DATA, MAX_BLOCK_COST_CLVM)
-
-    return spend_bundle
-
-async def calculate_change_spend(node_client: FullNodeRpcClient, fee_coin: Coin, fee_amount: uint64, peer_coin_spends: List[CoinSpend]):
-
-    puzzle_reveal = None
-    for wallet_key in wallet_keys:
-        pk = wallet_key.get_g1()
-        candidate_puzzle_reveal = puzzle_for_pk(pk)
-        if candidate_puzzle_reveal.get_tree_hash() == fee_coin.puzzle_hash:
-            puzzle_reveal = candidate_puzzle_reveal
-            break
-    if puzzle_reveal is None:
-        raise Exception("Checked all known keys for valid puzzle reveal. Failed to find any.")
-
-    change_amount = fee_coin.amount - fee_amount
-    destination_puzzlehash = fee_coin.puzzle_hash
-    primaries = [{"puzzlehash": destination_puzzlehash, "amount": change_amount, "memos": [destination_puzzlehash]}]
-
-    # FIXME - if we further aggregate spend bundles, we need to assert ALL spends
-    peer_coin_id = peer_coin_spends[0].coin.name()
-
-    if ASSERT_COIN_ANNOUNCEMENT is True:
-        assert_coin_announcement = Announcement(peer_coin_id, b'').name()
-        solution = Wallet().make_solution(
-            primaries=primaries,
-            fee=fee_amount,
-            # make sure our bundles aren't separated
-            coin_announcements_to_assert = [assert_coin_announcement]
-        )
-    else:
-        solution = Wallet().make_solution(
-            primaries=primaries,
-            fee=fee_amount
+    if len(all_coins) == 0:
+        return True
+    # every spend is checked against the same peak before it is pushed
+    peak = await mempool_peak(node_client)
+    if BATCH_SPENDS:
+        return await spend_batches(node_client, wallet_client, all_coins, address, puzzle, cat_asset_id, add_fees, peak)
+    all_spent = True
+    for coin_record in all_coins:
+        try:
+            spend_bundle = await timelock_spend_bundle(node_client, coin_record, address, puzzle, cat_asset_id)
+            cost = await validate_spend_bundle(node_client, spend_bundle, peak)
+            print(f'Timelock spend cost: {cost}')
+
+            status = await fee_payer.pay_and_push(node_client, wallet_client, spend_bundle, cost, peak, add_fees)
+            print_json(status)
+        except SpendNotYetValid as e:
+            print(f'Deferring {coin_record.coin.name().hex()}: {e}')
+            all_spent = False
+        except Exception as e: 
+            print('Failed on: ')
+            print(repr(e))
+            print('\r\n...Continuing to next coin')
+            all_spent = False
+    return all_spent
+
+
+async def timelock_spend_bundle(node_client: FullNodeRpcClient, coin_record: CoinRecord, address, puzzle: Program, cat_asset_id=None) -> SpendBundle:
+    coin_record = await node_client.get_coin_record_by_name(coin_record.coin.name())
+    print(f"unspent coin_record: \r\n{coin_record}")    
+
+    #Spent Coin
+    coin_spend = CoinSpend(
+        coin_record.coin,
+        puzzle,
+        Program.to([coin_record.coin.amount])
+    )
+    # empty signature i.e., c00000.....
+    signature = G2Element()
+
+    if cat_asset_id:
+        return await calculate_cat_spend_bundle(coin_record, node_client, cat_asset_id, address, puzzle)
+
+    # SpendBundle
+    return SpendBundle(
+            # coin spends
+            [coin_spend],
+            # aggregated_signature
+            signature,
         )
 
-    print(f'solution: {solution}')
 
-    print(f'Prepping change spend of amount {change_amount} mojos')
+# one bundle, and one fee spend, per batch of timelock spends that fits under the batch cost limit
+async def spend_batches(node_client: FullNodeRpcClient, wallet_client: WalletRpcClient, coin_records: List[CoinRecord], address, puzzle: Program, cat_asset_id=None, add_fees=False, peak: Tuple[int, int] = None) -> bool:
+    async def build(coin_record: CoinRecord) -> SpendBundle:
+        return await timelock_spend_bundle(node_client, coin_record, address, puzzle, cat_asset_id)
 
-    return CoinSpend(fee_coin, puzzle_reveal, solution)
+    return await fee_payer.spend_batches(node_client, wallet_client, coin_records, build, "timelock", add_fees, peak)
     
 
 def usage():
@@ -225,27 +177,35 @@ def usage():
 
 async def calculate_cat_spend_bundle(coin_record: CoinRecord, node_client: FullNodeRpcClient, cat_asset_id: str, address: str, puzzle: Program) -> SpendBundle:
     coin: Coin = coin_record.coin
-    parent_coin_record: CoinRecord = await node_client.get_coin_record_by_name(coin.parent_coin_info)
-
-    parent_coin: Coin = parent_coin_record.coin
 
     # cross-check cat puzzle hash
     cat_puzzle = construct_cat_puzzle(CAT_MOD, bytes.fromhex(cat_asset_id), puzzle)
 
     assert cat_puzzle.get_tree_hash() == decode_puzzle_hash(address)
     assert coin.puzzle_hash == cat_puzzle.get_tree_hash()
-    parent_coin_spend: CoinSpend = await node_client.get_puzzle_and_solution(parent_coin.name(), parent_coin_record.spent_block_index)
- 
-    parent_puzzle_reveal: SerializedProgram = parent_coin_spend.puzzle_reveal
-    prog_final, curried_args = parent_puzzle_reveal.uncurry()
-    list_args = list(curried_args.as_iter())
-    parent_inner_puzzlehash: bytes32 = list_args[-1].get_tree_hash()
-    lineage_proof = LineageProof(parent_coin.parent_coin_info, parent_inner_puzzlehash, parent_coin.amount)
+    lineage_proof = await lineage_proofs.lineage_proof(node_client, coin.parent_coin_info)
     
     spendable_cat = SpendableCAT(coin, bytes.fromhex(cat_asset_id), puzzle, Program.to([coin.amount]), Program.to([]), lineage_proof, 0)
 
     return unsigned_spend_bundle_for_spendable_cats(CAT_MOD, [spendable_cat])
 
+async def find_cat_coins(node_client: FullNodeRpcClient, address, cats: Dict[str, str], checkpoints: ScanCheckpoints = None) -> List[Tuple[str, str, str, bytes32, List[CoinRecord]]]:
+    # every tail's address up front, then a few bulk lookups instead of a request per tail
+    cat_addresses = dict()
+    for cat, asset_id in cats.items():
+        (cat_address, cat_puzzle_hash) = calculate_cat_address(address, asset_id)
+        cat_addresses[cat_puzzle_hash] = (cat, asset_id, cat_address)
+
+    start_height = None if checkpoints is None else checkpoints.start_height(list(cat_addresses.keys()))
+    coin_records_by_hash = await get_coin_records_by_puzzle_hashes(node_client, list(cat_addresses.keys()), start_height=start_height)
+    funded = [(*cat_addresses[puzzle_hash], puzzle_hash, coin_records) for puzzle_hash, coin_records in coin_records_by_hash.items() if len(coin_records) > 0]
+    if checkpoints is not None:
+        # nothing to spend means nothing left behind
+        checkpoints.done([puzzle_hash for puzzle_hash, coin_records in coin_records_by_hash.items() if len(coin_records) == 0])
+    print(f'Found coins at {len(funded)} of {len(cat_addresses)} CAT addresses')
+    return funded
+
+
 def calculate_cat_address(address, asset_id):
     inner_puzzlehash_bytes32: bytes32 = decode_puzzle_hash(address)
     prefix = address[: address.rfind("1")]
@@ -284,7 +244,15 @@ async def main():
     sp = SerializedProgram.from_bytes(clvm_blob)
     puzzle = Program.from_bytes(bytes(sp))
 
-    if wallet_fingerprint is not None:
+    global signer
+    if wallet_fingerprint is not None and SIGNER_SOCKET is not None:
+        print(f'Signing through signer daemon at {SIGNER_SOCKET}')
+        signer = SignerClient(SIGNER_SOCKET)
+        for master_pk in await signer.get_public_keys():
+            key_index = KeyIndex.observer(master_pk)
+            key_index.load(DERIVATIONS)
+            key_indexes.append(key_index)
+    elif wallet_fingerprint is not None:
         print('Loading private key for spend bundle signing (fee support)')
         print(f'Is keychain locked? {Keychain.is_keyring_locked()}')
         keychain = Keychain()
@@ -293,23 +261,54 @@ async def main():
 
         all_sks = keychain.get_all_private_keys()
 
-        print(f'Deriving {DERIVATIONS} synthetic private keys')
-        for i in range(DERIVATIONS):
-            for sk in all_sks:
-                wallet_keys.append(master_sk_to_wallet_sk_unhardened(sk[0], i))
-
-    print('Checking XCH spends...')
-
-    add_fees = wallet_fingerprint is not None
-    await spend_unspent_coins(address, puzzle_hash, puzzle, cat_asset_id=None, add_fees=add_fees)
-
-    # It's highly likely you will want to support a different set of these
-    # TODO: look at API or CSV import of all/as many as you care about
-    print('Checking CAT spends...')
-    for cat, asset_id in CATS.items():
-        print(cat, asset_id)
-        (cat_address, cat_puzzle_hash) = calculate_cat_address(address, asset_id)
-        await spend_unspent_coins(cat_address, cat_puzzle_hash, puzzle, asset_id)
+        print(f'Loading {DERIVATIONS} wallet keys from key index')
+        for sk in all_sks:
+            key_index = KeyIndex(sk[0])
+            key_index.load(DERIVATIONS)
+            key_indexes.append(key_index)
+        signer = LocalSigner(key_indexes, AGG_SIG_ME_ADDITIONAL_DATA, MAX_BLOCK_COST_CLVM)
+    if SPEND_EXPORT is not None:
+        print(f'Exporting unsigned bundles to {SPEND_EXPORT}, sign and push them with spend_pipeline.py')
+        if signer is not None:
+            await signer.close()
+        signer = SpendExport(SPEND_EXPORT)
+    fee_payer.signer = signer
+    # exported coins are still unspent, so the checkpoints stay put
+    exporting = isinstance(signer, SpendExport)
+
+    # one node and wallet connection for the whole run
+    rpc = await RpcSession.create(config, wallet=True)
+    checkpoints = ScanCheckpoints("timelock_spend")
+    try:
+        # only blocks after the last fully handled height are looked at again
+        await checkpoints.begin(rpc.node_client)
+
+        print('Checking XCH spends...')
+
+        add_fees = wallet_fingerprint is not None
+        if add_fees:
+            await fee_payer.top_up_fee_coins(rpc.node_client, rpc.wallet_client)
+        start_height = checkpoints.start_height([puzzle_hash])
+        coin_records = (await get_coin_records_by_puzzle_hashes(rpc.node_client, [puzzle_hash], start_height=start_height))[puzzle_hash]
+        if await spend_unspent_coins(rpc.node_client, rpc.wallet_client, address, puzzle_hash, puzzle, cat_asset_id=None, add_fees=add_fees, all_coins=coin_records) and not exporting:
+            # the checkpoint moves once the pushed coins are seen spent, an export leaves it where it was
+            checkpoints.done([puzzle_hash], [coin_record.name for coin_record in coin_records])
+
+        print('Checking CAT spends...')
+        for (cat, asset_id, cat_address, cat_puzzle_hash, coin_records) in await find_cat_coins(rpc.node_client, address, CATS, checkpoints):
+            print(cat, asset_id)
+            if await spend_unspent_coins(rpc.node_client, rpc.wallet_client, cat_address, cat_puzzle_hash, puzzle, asset_id, all_coins=coin_records) and not exporting:
+                checkpoints.done([cat_puzzle_hash], [coin_record.name for coin_record in coin_records])
+
+        if WAIT_FOR_CONFIRMATION:
+            print(f'Waiting for {len(fee_payer.submissions.submissions)} pushed bundle(s) to confirm')
+            await fee_payer.submissions.wait(rpc.node_client)
+            await checkpoints.settle(rpc.node_client)
+    finally:
+        checkpoints.save()
+        await rpc.close()
+        if signer is not None:
+            await signer.close()
 
 def load_clsp_relative(filename: str, search_paths: List[Path] = None):
     if search_paths is None:
@@ -324,22 +323,6 @@ def load_clsp_relative(filename: str, search_paths: List[Path] = None):
     sp = SerializedProgram.from_bytes(clvm_blob)
     return Program.from_bytes(bytes(sp))
 
-def load_cats():
-    resp = requests.get('https://mainnet-api.taildatabase.com/tails', timeout=30)
-    tails = json.loads(resp.content)
-
-    cats = {}
-
-    for tail in tails:
-        code = tail['code']
-        hash = tail['hash']
-        cats[code] = hash
-
-    print(f'Loaded {len(cats)} CAT tails')
-
-    return cats
-
-
 if __name__ == "__main__":
-    CATS.update(load_cats())
+    CATS.update(load_cats(CATS))
     asyncio.run(main())
\ No newline at end of file